@@ -0,0 +1,33 @@
+"""Add account search indexes
+
+Revision ID: 3f031244fd57
+Revises: 91b2b97e9f43
+Create Date: 2026-10-18 10:12:31.504127
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = '3f031244fd57'
+down_revision: Union[str, None] = '91b2b97e9f43'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index('ix_accounts_created_date', 'accounts', ['created_date'])
+    op.create_index('ix_accounts_last_login_date', 'accounts', ['last_login_date'])
+    op.create_index('ix_accounts_is_active_created_date', 'accounts', ['is_active', 'created_date'])
+    op.create_index('ix_accounts_is_active_last_login_date', 'accounts', ['is_active', 'last_login_date'])
+    op.create_index('ix_accounts_is_active_name', 'accounts', ['is_active', 'name'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_accounts_is_active_name', table_name='accounts')
+    op.drop_index('ix_accounts_is_active_last_login_date', table_name='accounts')
+    op.drop_index('ix_accounts_is_active_created_date', table_name='accounts')
+    op.drop_index('ix_accounts_last_login_date', table_name='accounts')
+    op.drop_index('ix_accounts_created_date', table_name='accounts')
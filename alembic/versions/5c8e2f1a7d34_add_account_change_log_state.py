@@ -0,0 +1,35 @@
+"""Add account change log state
+
+Revision ID: 5c8e2f1a7d34
+Revises: e41f8a2c9d07
+Create Date: 2026-10-18 18:21:05.317402
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5c8e2f1a7d34'
+down_revision: Union[str, None] = 'e41f8a2c9d07'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'account_change_log_state',
+        sa.Column('id', sa.Integer, primary_key=True),
+        sa.Column('compacted_through', sa.Integer, nullable=False),
+    )
+    # Cursors before the oldest retained change were already refused
+    op.execute(
+        'INSERT INTO account_change_log_state (id, compacted_through) '
+        'SELECT 1, COALESCE(MIN(id) - 1, 0) FROM account_changes'
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('account_change_log_state')
@@ -0,0 +1,32 @@
+"""Add account updated_at
+
+Revision ID: 7b2e9d41c6a3
+Revises: c5d0a7e4b8f1
+Create Date: 2026-10-18 16:02:13.550184
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import mysql
+
+# revision identifiers, used by Alembic.
+revision: str = '7b2e9d41c6a3'
+down_revision: Union[str, None] = 'c5d0a7e4b8f1'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+PreciseDateTime = sa.DateTime().with_variant(mysql.DATETIME(fsp=6), 'mysql', 'mariadb')
+
+
+def upgrade() -> None:
+    op.add_column('accounts', sa.Column('updated_at', PreciseDateTime, nullable=True))
+    op.execute('UPDATE accounts SET updated_at = COALESCE(last_login_date, created_date)')
+    with op.batch_alter_table('accounts') as batch_op:
+        batch_op.alter_column('updated_at', existing_type=PreciseDateTime, nullable=False)
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('accounts') as batch_op:
+        batch_op.drop_column('updated_at')
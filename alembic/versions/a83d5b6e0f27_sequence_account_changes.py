@@ -0,0 +1,37 @@
+"""Sequence account changes after commit
+
+Revision ID: a83d5b6e0f27
+Revises: 5c8e2f1a7d34
+Create Date: 2026-10-18 21:02:44.918237
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a83d5b6e0f27'
+down_revision: Union[str, None] = '5c8e2f1a7d34'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('account_changes', sa.Column('seq', sa.Integer, nullable=True))
+    op.create_index('ix_account_changes_seq', 'account_changes', ['seq'], unique=True)
+    op.add_column('account_change_log_state',
+                  sa.Column('sequenced_through', sa.Integer, nullable=False, server_default='0'))
+    # Ids were allocated in commit order under the previous lock, so they are valid positions already
+    op.execute('UPDATE account_changes SET seq = id')
+    op.execute(
+        'UPDATE account_change_log_state SET sequenced_through = '
+        '(SELECT COALESCE(MAX(id), 0) FROM account_changes)'
+    )
+
+
+def downgrade() -> None:
+    op.drop_column('account_change_log_state', 'sequenced_through')
+    op.drop_index('ix_account_changes_seq', 'account_changes')
+    op.drop_column('account_changes', 'seq')
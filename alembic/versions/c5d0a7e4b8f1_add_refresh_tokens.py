@@ -0,0 +1,36 @@
+"""Add refresh tokens
+
+Revision ID: c5d0a7e4b8f1
+Revises: 3f031244fd57
+Create Date: 2026-10-18 15:20:42.183906
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.sql import func
+
+# revision identifiers, used by Alembic.
+revision: str = 'c5d0a7e4b8f1'
+down_revision: Union[str, None] = '3f031244fd57'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'refresh_tokens',
+        sa.Column('id', sa.Integer, primary_key=True),
+        sa.Column('token_hash', sa.String(64), nullable=False, unique=True),
+        sa.Column('family_id', sa.String(32), nullable=False, index=True),
+        sa.Column('account_id', sa.Integer, sa.ForeignKey('accounts.id', ondelete='CASCADE'), nullable=False,
+                  index=True),
+        sa.Column('created_date', sa.DateTime(), server_default=func.now(), nullable=False),
+        sa.Column('expires_at', sa.DateTime(), nullable=False, index=True),
+        sa.Column('used_at', sa.DateTime(), nullable=True),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('refresh_tokens')
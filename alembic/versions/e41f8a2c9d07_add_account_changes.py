@@ -0,0 +1,35 @@
+"""Add account changes
+
+Revision ID: e41f8a2c9d07
+Revises: 7b2e9d41c6a3
+Create Date: 2026-10-18 16:48:37.912640
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import mysql
+
+# revision identifiers, used by Alembic.
+revision: str = 'e41f8a2c9d07'
+down_revision: Union[str, None] = '7b2e9d41c6a3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+PreciseDateTime = sa.DateTime().with_variant(mysql.DATETIME(fsp=6), 'mysql', 'mariadb')
+
+
+def upgrade() -> None:
+    op.create_table(
+        'account_changes',
+        sa.Column('id', sa.Integer, primary_key=True),
+        sa.Column('account_id', sa.Integer, nullable=False, index=True),
+        sa.Column('operation', sa.String(16), nullable=False),
+        sa.Column('email', sa.String(255), nullable=False),
+        sa.Column('changed_at', PreciseDateTime, nullable=False, index=True),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('account_changes')
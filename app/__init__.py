@@ -0,0 +1,4 @@
+from dotenv import load_dotenv
+
+# Loaded once, before any module of the app reads its settings from the environment
+load_dotenv()
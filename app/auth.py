@@ -1,15 +1,54 @@
+import base64
+import hashlib
+import json
+import logging
+import math
+import os
+import secrets
+import time
+from collections import OrderedDict
 from typing import Optional
 from datetime import datetime, timedelta
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
-from jose import JWTError, jwt
+from jose import JWTError, jwk, jwt
 from passlib.context import CryptContext
 
-# Define secret key and algorithm
+from . import metrics
+
+# Define secret key and algorithm, used only while no signing keys are configured
 SECRET_KEY = "your-secret-key"
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
+# Opaque refresh tokens, rotated on every use
+REFRESH_TOKEN_EXPIRE_DAYS = int(os.getenv("REFRESH_TOKEN_EXPIRE_DAYS", 30))
+REFRESH_TOKEN_PURGE_INTERVAL = float(os.getenv("REFRESH_TOKEN_PURGE_INTERVAL", 3600))
+
+# Comma separated PEM files of RSA or P-256 private keys: the first one signs, the others are only published
+# and accepted, so keys can be rotated without invalidating tokens
+JWT_SIGNING_KEYS = os.getenv("JWT_SIGNING_KEYS", "")
+# How long verifiers may cache the published keys
+JWKS_MAX_AGE = int(os.getenv("JWKS_MAX_AGE", 300))
+
+# Verified token cache
+TOKEN_CACHE_SIZE = 10000
+TOKEN_CACHE_TTL_SECONDS = 60
+# Where revoked tokens are kept: "memory" is per process, "redis" is shared by every worker
+TOKEN_REVOCATION_BACKEND = os.getenv("TOKEN_REVOCATION_BACKEND", "memory")
+TOKEN_REVOCATION_REDIS_URL = os.getenv("TOKEN_REVOCATION_REDIS_URL", "redis://localhost:6379/0")
+
+# bcrypt cost: pinned with BCRYPT_ROUNDS, or calibrated to take about BCRYPT_TARGET_MS on this host
+BCRYPT_ROUNDS = os.getenv("BCRYPT_ROUNDS")
+BCRYPT_TARGET_MS = float(os.getenv("BCRYPT_TARGET_MS", 250))
+BCRYPT_CALIBRATE_ON_STARTUP = os.getenv("BCRYPT_CALIBRATE_ON_STARTUP", "false").lower() in ("1", "true", "yes")
+BCRYPT_MIN_ROUNDS = int(os.getenv("BCRYPT_MIN_ROUNDS", 10))
+BCRYPT_MAX_ROUNDS = int(os.getenv("BCRYPT_MAX_ROUNDS", 20))
+# Cheap enough to measure quickly, costly enough for the timing to be stable
+BCRYPT_PROBE_ROUNDS = 8
+
+logger = logging.getLogger(__name__)
+
 # Password hashing
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
@@ -25,28 +64,295 @@ def verify_password(plain_password, hashed_password):
     return pwd_context.verify(plain_password, hashed_password)
 
 
+def set_bcrypt_rounds(rounds: int):
+    """Hash new passwords with ``rounds`` and flag hashes of a lower cost as needing a rehash.
+
+    Hashes of a higher cost are left alone: a lower cost picked by a noisy
+    calibration never weakens the hashes already stored.
+    """
+    pwd_context.update(bcrypt__default_rounds=rounds, bcrypt__min_rounds=rounds)
+    logger.info("Hashing passwords with %d bcrypt rounds", rounds)
+
+
+def password_needs_rehash(hashed_password: str) -> bool:
+    return pwd_context.needs_update(hashed_password)
+
+
+def measure_bcrypt_seconds(rounds: int, samples: int = 3) -> float:
+    """Best of ``samples`` timings of one bcrypt hash at ``rounds``."""
+    context = CryptContext(schemes=["bcrypt"], bcrypt__rounds=rounds)
+    timings = []
+    for _ in range(samples):
+        started = time.perf_counter()
+        context.hash("calibration-password")
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+def calibrate_bcrypt_rounds(
+        target_ms: float, min_rounds: int = BCRYPT_MIN_ROUNDS, max_rounds: int = BCRYPT_MAX_ROUNDS
+) -> int:
+    """Highest bcrypt cost whose hash takes at most ``target_ms`` on this host, within the bounds.
+
+    Every extra round doubles the work, so the cost is extrapolated from a
+    cheap probe and then checked, stepping down while it is over target.
+    """
+    probe = measure_bcrypt_seconds(BCRYPT_PROBE_ROUNDS)
+    rounds = BCRYPT_PROBE_ROUNDS + math.floor(math.log2(target_ms / 1000 / probe))
+    rounds = min(max(rounds, min_rounds), max_rounds)
+    while rounds > min_rounds and measure_bcrypt_seconds(rounds, samples=1) * 1000 > target_ms:
+        rounds -= 1
+    return rounds
+
+
+if BCRYPT_ROUNDS:
+    set_bcrypt_rounds(int(BCRYPT_ROUNDS))
+
+
+def jwk_thumbprint(public_jwk: dict) -> str:
+    """RFC 7638 thumbprint of a public JWK, used as its ``kid``."""
+    members = ("crv", "kty", "x", "y") if public_jwk["kty"] == "EC" else ("e", "kty", "n")
+    canonical = json.dumps({name: public_jwk[name] for name in members}, separators=(",", ":"), sort_keys=True)
+    return base64.urlsafe_b64encode(hashlib.sha256(canonical.encode()).digest()).rstrip(b"=").decode()
+
+
+class SigningKey:
+    """A private key, the algorithm it signs with and its public JWK."""
+
+    def __init__(self, pem: bytes):
+        from cryptography.hazmat.primitives.asymmetric import ec, rsa
+        from cryptography.hazmat.primitives.serialization import load_pem_private_key
+
+        private_key = load_pem_private_key(pem, password=None)
+        if isinstance(private_key, rsa.RSAPrivateKey):
+            self.algorithm = "RS256"
+        elif isinstance(private_key, ec.EllipticCurvePrivateKey) and private_key.curve.name == "secp256r1":
+            self.algorithm = "ES256"
+        else:
+            # python-jose implements neither EdDSA nor the other curves
+            raise ValueError(f"Unsupported signing key type {type(private_key).__name__}, use an RSA or P-256 key")
+        self.private_key = jwk.construct(pem, self.algorithm)
+        self.public_key = self.private_key.public_key()
+        public_jwk = self.public_key.to_dict()
+        self.kid = jwk_thumbprint(public_jwk)
+        self.public_jwk = {**public_jwk, "kid": self.kid, "use": "sig"}
+
+    @classmethod
+    def from_file(cls, path: str) -> "SigningKey":
+        with open(path, "rb") as key_file:
+            return cls(key_file.read())
+
+
+class KeySet:
+    """Signing keys by ``kid``: the first one signs new tokens, all of them verify and are published."""
+
+    def __init__(self, keys: list):
+        self.keys = keys
+        self._by_kid = {key.kid: key for key in keys}
+        self.document = json.dumps({"keys": [key.public_jwk for key in keys]}, separators=(",", ":")).encode()
+        self.etag = '"' + hashlib.blake2b(self.document, digest_size=16).hexdigest() + '"'
+
+    @classmethod
+    def from_files(cls, paths: str) -> "KeySet":
+        return cls([SigningKey.from_file(path.strip()) for path in paths.split(",") if path.strip()])
+
+    @property
+    def signing_key(self) -> Optional[SigningKey]:
+        return self.keys[0] if self.keys else None
+
+    def get(self, kid: Optional[str]) -> Optional[SigningKey]:
+        return self._by_kid.get(kid)
+
+
+_key_set: Optional[KeySet] = None
+
+
+def get_key_set() -> KeySet:
+    """Load the signing keys on first use."""
+    global _key_set
+    if _key_set is None:
+        _key_set = KeySet.from_files(JWT_SIGNING_KEYS)
+        if not _key_set.keys:
+            logger.warning("No JWT_SIGNING_KEYS configured, tokens are signed with the shared HS256 secret")
+    return _key_set
+
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
     to_encode = data.copy()
     if expires_delta:
         expire = datetime.utcnow() + expires_delta
     else:
         expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
-    return encoded_jwt
+    # jti makes every token unique, so revoking one never revokes another
+    to_encode.update({"exp": expire, "jti": secrets.token_urlsafe(8)})
+    signing_key = get_key_set().signing_key
+    if signing_key is None:
+        return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+    return jwt.encode(to_encode, signing_key.private_key, algorithm=signing_key.algorithm,
+                      headers={"kid": signing_key.kid})
+
+
+def decode_access_token(token: str) -> dict:
+    """Verify a token with the key named by its ``kid``, raising ``JWTError`` if it is not valid."""
+    key_set = get_key_set()
+    if not key_set.keys:
+        return jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    key = key_set.get(jwt.get_unverified_header(token).get("kid"))
+    if key is None:
+        raise JWTError("Unknown signing key")
+    # Only the algorithm of that key, so a token can never pick a weaker one
+    return jwt.decode(token, key.public_key, algorithms=[key.algorithm])
+
 
+def create_refresh_token_value() -> str:
+    return secrets.token_urlsafe(32)
 
-def get_current_account(token: str = Depends(oauth2_scheme)) -> dict:
-    credentials_exception = HTTPException(
+
+def refresh_token_digest(token: str) -> str:
+    """Refresh tokens are 256 random bits, so a fast hash stores them safely, no bcrypt needed."""
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+def token_digest(token: str) -> bytes:
+    return hashlib.blake2b(token.encode(), digest_size=16).digest()
+
+
+class TokenCache:
+    """Bounded LRU of verified tokens.
+
+    An entry lives for at most ``ttl`` seconds and never past the ``exp`` of
+    its token, so a cache hit is always a token ``jwt.decode`` would accept.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: OrderedDict = OrderedDict()
+
+    def get(self, token: str) -> Optional[dict]:
+        key = token_digest(token)
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        account, expires_at = entry
+        if expires_at <= time.time():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return account
+
+    def set(self, token: str, account: dict, exp: float):
+        key = token_digest(token)
+        self._entries[key] = (account, min(exp, time.time() + self.ttl))
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def discard(self, token: str):
+        self._entries.pop(token_digest(token), None)
+
+    def clear(self):
+        self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class RevocationList:
+    """Per-process digests of revoked tokens, each kept only until its token expires anyway."""
+
+    def __init__(self):
+        self._revoked: dict = {}
+
+    async def revoke(self, token: str, exp: float):
+        self.purge()
+        self._revoked[token_digest(token)] = exp
+
+    async def is_revoked(self, token: str) -> bool:
+        return token_digest(token) in self._revoked
+
+    def purge(self):
+        now = time.time()
+        for key in [key for key, exp in self._revoked.items() if exp <= now]:
+            del self._revoked[key]
+
+    def __len__(self):
+        return len(self._revoked)
+
+
+class RedisRevocationList:
+    """Revoked tokens shared between workers in any Redis-protocol server, expiring with their tokens."""
+
+    def __init__(self, client, prefix: str = "revoked-token:"):
+        self.client = client
+        self.prefix = prefix
+
+    @classmethod
+    def from_url(cls, url: str):
+        from redis import asyncio as redis
+
+        # RESP2 is understood by every Redis-protocol server
+        return cls(redis.Redis.from_url(url, protocol=2))
+
+    def _key(self, token: str) -> str:
+        return self.prefix + token_digest(token).hex()
+
+    async def revoke(self, token: str, exp: float):
+        ttl = math.ceil((exp - time.time()) * 1000)
+        if ttl > 0:
+            await self.client.set(self._key(token), b"1", px=ttl)
+
+    async def is_revoked(self, token: str) -> bool:
+        # Errors are raised: a revoked token must not pass while the store is unreachable
+        return await self.client.get(self._key(token)) is not None
+
+
+def create_revocation_list(backend: str = TOKEN_REVOCATION_BACKEND):
+    if backend == "memory":
+        return RevocationList()
+    if backend == "redis":
+        return RedisRevocationList.from_url(TOKEN_REVOCATION_REDIS_URL)
+    raise ValueError(f"Unknown token revocation backend: {backend}")
+
+
+token_cache = TokenCache(maxsize=TOKEN_CACHE_SIZE, ttl=TOKEN_CACHE_TTL_SECONDS)
+revoked_tokens = create_revocation_list()
+metrics.Gauge("token_cache_entries", "Verified tokens held in the token cache.", function=lambda: len(token_cache))
+
+
+def credentials_exception() -> HTTPException:
+    return HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+
+
+async def revoke_token(token: str):
+    """Revoke an already validated token until it expires."""
+    exp = jwt.get_unverified_claims(token).get("exp", time.time() + ACCESS_TOKEN_EXPIRE_MINUTES * 60)
+    token_cache.discard(token)
+    await revoked_tokens.revoke(token, exp)
+
+
+async def get_current_account(token: str = Depends(oauth2_scheme)) -> dict:
+    # Checked before the token cache, which is per process
+    if await revoked_tokens.is_revoked(token):
+        raise credentials_exception()
+    account = token_cache.get(token)
+    if account is not None:
+        return account
+    started = time.perf_counter()
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        email: str = payload.get("sub")
-        if email is None:
-            raise credentials_exception
-        return {"email": email}
+        payload = decode_access_token(token)
     except JWTError:
-        raise credentials_exception
+        raise credentials_exception()
+    finally:
+        metrics.JWT_DECODE_SECONDS.observe(time.perf_counter() - started)
+    email: str = payload.get("sub")
+    if email is None:
+        raise credentials_exception()
+    account = {"email": email}
+    if "exp" in payload:
+        token_cache.set(token, account, payload["exp"])
+    return account
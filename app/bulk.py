@@ -0,0 +1,161 @@
+import codecs
+import csv
+import json
+import os
+from typing import AsyncIterator, Optional
+
+from fastapi import UploadFile
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import crud, hashing, schemas
+
+BULK_REGISTER_CHUNK_SIZE = int(os.getenv("BULK_REGISTER_CHUNK_SIZE", 500))
+# Errors beyond this many are only counted, so the response stays bounded too
+BULK_REGISTER_MAX_ERRORS = int(os.getenv("BULK_REGISTER_MAX_ERRORS", 1000))
+READ_SIZE = 64 * 1024
+
+CSV_FIELDS = ["name", "email", "password"]
+
+
+class InvalidUpload(ValueError):
+    """Raised when an upload cannot be read at all, as opposed to a bad line."""
+
+
+async def read_lines(upload: UploadFile) -> AsyncIterator[str]:
+    """Yield the lines of an uploaded file, reading it ``READ_SIZE`` bytes at a time."""
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    remainder = ""
+    while True:
+        data = await upload.read(READ_SIZE)
+        try:
+            text = remainder + decoder.decode(data, final=not data)
+        except UnicodeDecodeError:
+            raise InvalidUpload("Upload is not valid UTF-8")
+        lines = text.split("\n")
+        remainder = lines.pop()
+        for line in lines:
+            yield line.rstrip("\r")
+        if not data:
+            break
+    if remainder:
+        yield remainder.rstrip("\r")
+
+
+def parse_ndjson(line: str) -> dict:
+    record = json.loads(line)
+    if not isinstance(record, dict):
+        raise ValueError("Expected a JSON object")
+    return record
+
+
+def parse_csv(line: str, header: list) -> dict:
+    values = next(csv.reader([line]))
+    if len(values) != len(header):
+        raise ValueError(f"Expected {len(header)} columns, got {len(values)}")
+    return dict(zip(header, values))
+
+
+async def read_records(upload: UploadFile, file_format: str) -> AsyncIterator[tuple]:
+    """Yield (line number, record, error) for every line of an NDJSON or CSV upload.
+
+    CSV uploads start with a header row naming the name, email and password
+    columns; quoted fields spanning several lines are not supported.
+    """
+    header: Optional[list] = None
+    line_number = 0
+    async for line in read_lines(upload):
+        line_number += 1
+        if not line.strip():
+            continue
+        if file_format == "csv" and header is None:
+            header = [column.strip() for column in next(csv.reader([line]))]
+            if sorted(header) != sorted(CSV_FIELDS):
+                raise InvalidUpload(f"CSV header must name the columns {', '.join(CSV_FIELDS)}")
+            continue
+        try:
+            record = parse_csv(line, header) if file_format == "csv" else parse_ndjson(line)
+        except ValueError as exc:
+            yield line_number, None, f"Malformed line: {exc}"
+            continue
+        yield line_number, record, None
+
+
+def validate_record(record: dict) -> Optional[str]:
+    for field in CSV_FIELDS:
+        if not isinstance(record.get(field), str) or not record[field]:
+            return f"Field '{field}' is required"
+    if not crud.check_email(record["email"]):
+        return "Email is not valid"
+    return None
+
+
+class BulkRegistration:
+    """Collects the outcome of a bulk registration, keeping at most ``max_errors`` errors."""
+
+    def __init__(self, max_errors: int):
+        self.max_errors = max_errors
+        self.created = 0
+        self.failed = 0
+        self.errors = []
+
+    def add_error(self, line: int, email: Optional[str], detail: str):
+        self.failed += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append(schemas.BulkRegisterError(line=line, email=email, detail=detail))
+
+    def response(self) -> schemas.BulkRegisterResponse:
+        return schemas.BulkRegisterResponse(created=self.created, failed=self.failed, errors=self.errors)
+
+
+async def register_chunk(db: AsyncSession, chunk: list, registration: BulkRegistration):
+    hashes = await hashing.hasher.hash_many([record["password"] for _, record in chunk])
+
+    accounts = []
+    lines = []
+    for (line, record), hashed_password in zip(chunk, hashes):
+        if isinstance(hashed_password, hashing.HashingOverloaded):
+            registration.add_error(line, record["email"], "Server is busy, please retry")
+            continue
+        if isinstance(hashed_password, BaseException):
+            raise hashed_password
+        accounts.append({
+            "name": record["name"],
+            "email": record["email"],
+            "password": record["password"],
+            "hashed_password": hashed_password,
+        })
+        lines.append(line)
+
+    if not accounts:
+        return
+    errors = await crud.create_accounts(db, accounts)
+    for line, account, error in zip(lines, accounts, errors):
+        if error is None:
+            registration.created += 1
+        else:
+            registration.add_error(line, account["email"], error)
+
+
+async def register_accounts(
+        db: AsyncSession,
+        upload: UploadFile,
+        file_format: str,
+        chunk_size: int = BULK_REGISTER_CHUNK_SIZE,
+) -> schemas.BulkRegisterResponse:
+    """Validate, hash and insert the accounts of an upload, ``chunk_size`` accounts at a time."""
+    registration = BulkRegistration(max_errors=BULK_REGISTER_MAX_ERRORS)
+    chunk = []
+    async for line, record, error in read_records(upload, file_format):
+        if error is None:
+            error = validate_record(record)
+        if error is not None:
+            email = record.get("email") if record else None
+            registration.add_error(line, email if isinstance(email, str) else None, error)
+            continue
+        chunk.append((line, record))
+        if len(chunk) >= chunk_size:
+            await register_chunk(db, chunk, registration)
+            chunk = []
+    if chunk:
+        await register_chunk(db, chunk, registration)
+    return registration.response()
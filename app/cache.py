@@ -0,0 +1,146 @@
+import json
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Optional
+
+ACCOUNT_CACHE_BACKEND = os.getenv("ACCOUNT_CACHE_BACKEND", "none")
+ACCOUNT_CACHE_SIZE = int(os.getenv("ACCOUNT_CACHE_SIZE", 10000))
+ACCOUNT_CACHE_TTL = int(os.getenv("ACCOUNT_CACHE_TTL", 300))
+ACCOUNT_CACHE_REDIS_URL = os.getenv("ACCOUNT_CACHE_REDIS_URL", "redis://localhost:6379/0")
+
+DATETIME_FIELDS = ("created_date", "last_login_date", "updated_at")
+
+
+class AccountCache:
+    """Base class of the account cache backends, counting hits and misses.
+
+    Values are plain dicts of account columns; backends only implement
+    ``_get``, ``_set`` and ``_delete``.
+    """
+
+    def __init__(self, ttl: int):
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, key: str) -> Optional[dict]:
+        value = await self._get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    async def peek(self, key: str) -> Optional[dict]:
+        """Like ``get`` but without counting a hit or miss."""
+        return await self._get(key)
+
+    async def set(self, key: str, value: dict):
+        await self._set(key, value)
+
+    async def delete(self, *keys: str):
+        if keys:
+            await self._delete(*keys)
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses}
+
+    async def _get(self, key: str) -> Optional[dict]:
+        raise NotImplementedError
+
+    async def _set(self, key: str, value: dict):
+        raise NotImplementedError
+
+    async def _delete(self, *keys: str):
+        raise NotImplementedError
+
+
+class NullAccountCache(AccountCache):
+    """Cache that stores nothing, every lookup goes to the database."""
+
+    async def _get(self, key: str) -> Optional[dict]:
+        return None
+
+    async def _set(self, key: str, value: dict):
+        pass
+
+    async def _delete(self, *keys: str):
+        pass
+
+
+class LRUAccountCache(AccountCache):
+    """In-process LRU cache with a per-entry TTL."""
+
+    def __init__(self, maxsize: int, ttl: int):
+        super().__init__(ttl)
+        self.maxsize = maxsize
+        self._entries: OrderedDict = OrderedDict()
+
+    async def _get(self, key: str) -> Optional[dict]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return dict(value)
+
+    async def _set(self, key: str, value: dict):
+        self._entries[key] = (dict(value), time.monotonic() + self.ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    async def _delete(self, *keys: str):
+        for key in keys:
+            self._entries.pop(key, None)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class RedisAccountCache(AccountCache):
+    """Cache shared between workers, stored as JSON in any Redis-protocol server."""
+
+    def __init__(self, client, ttl: int, prefix: str = "account-cache:"):
+        super().__init__(ttl)
+        self.client = client
+        self.prefix = prefix
+
+    @classmethod
+    def from_url(cls, url: str, ttl: int):
+        from redis import asyncio as redis
+
+        # RESP2 is understood by every Redis-protocol server
+        return cls(redis.Redis.from_url(url, protocol=2), ttl)
+
+    async def _get(self, key: str) -> Optional[dict]:
+        raw = await self.client.get(self.prefix + key)
+        if raw is None:
+            return None
+        value = json.loads(raw)
+        for field in DATETIME_FIELDS:
+            if value.get(field) is not None:
+                value[field] = datetime.fromisoformat(value[field])
+        return value
+
+    async def _set(self, key: str, value: dict):
+        raw = json.dumps(value, default=datetime.isoformat)
+        await self.client.set(self.prefix + key, raw, ex=self.ttl)
+
+    async def _delete(self, *keys: str):
+        await self.client.delete(*[self.prefix + key for key in keys])
+
+
+def create_account_cache(backend: str = ACCOUNT_CACHE_BACKEND) -> AccountCache:
+    if backend == "none":
+        return NullAccountCache(ACCOUNT_CACHE_TTL)
+    if backend == "memory":
+        return LRUAccountCache(maxsize=ACCOUNT_CACHE_SIZE, ttl=ACCOUNT_CACHE_TTL)
+    if backend == "redis":
+        return RedisAccountCache.from_url(ACCOUNT_CACHE_REDIS_URL, ttl=ACCOUNT_CACHE_TTL)
+    raise ValueError(f"Unknown account cache backend: {backend}")
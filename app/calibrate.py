@@ -0,0 +1,31 @@
+"""Pick the bcrypt cost that fits a latency budget on this host.
+
+    python -m app.calibrate --target-ms 250
+
+Prints the timing of every candidate cost and the recommended value, to be
+pinned with BCRYPT_ROUNDS on every instance of the same type.
+"""
+import argparse
+
+from . import auth
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--target-ms", type=float, default=auth.BCRYPT_TARGET_MS,
+                        help="hash time budget in milliseconds")
+    parser.add_argument("--min-rounds", type=int, default=auth.BCRYPT_MIN_ROUNDS)
+    parser.add_argument("--max-rounds", type=int, default=auth.BCRYPT_MAX_ROUNDS)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    rounds = auth.calibrate_bcrypt_rounds(args.target_ms, args.min_rounds, args.max_rounds)
+    for candidate in range(max(rounds - 2, args.min_rounds), min(rounds + 1, args.max_rounds) + 1):
+        print(f"{candidate:>2} rounds: {auth.measure_bcrypt_seconds(candidate, samples=1) * 1000:8.1f} ms")
+    print(f"BCRYPT_ROUNDS={rounds}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta
+from typing import AsyncIterator, Optional
+
+import orjson
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from . import crud, metrics
+from .database import get_read_session_factory, get_session_factory
+
+# Seconds between checks for new changes, shared by every stream of a worker
+CHANGE_FEED_POLL_INTERVAL = float(os.getenv("CHANGE_FEED_POLL_INTERVAL", 1))
+CHANGE_FEED_HEARTBEAT = float(os.getenv("CHANGE_FEED_HEARTBEAT", 15))
+CHANGE_FEED_RETENTION_DAYS = float(os.getenv("CHANGE_FEED_RETENTION_DAYS", 7))
+CHANGE_FEED_COMPACT_INTERVAL = float(os.getenv("CHANGE_FEED_COMPACT_INTERVAL", 3600))
+# Changes given their feed positions per poll
+CHANGE_FEED_SEQUENCE_BATCH = int(os.getenv("CHANGE_FEED_SEQUENCE_BATCH", 10000))
+
+logger = logging.getLogger(__name__)
+
+COMPACTED_CHANGES = metrics.Counter("account_changes_compacted_total", "Account changes deleted past their retention.")
+
+
+class CursorExpired(Exception):
+    """The cursor points before the retained change log, the reader has to resync."""
+
+
+class ChangeFeed:
+    """Sequences the logged changes, wakes the change streams of this worker, and compacts the log.
+
+    Every ``poll_interval`` the changes committed since the last poll get
+    their positions in the feed, on the primary, and one query reads the
+    newest position for all the streams, instead of every stream polling
+    the log; a change is readable within one interval of its commit. Every
+    ``compact_interval`` the changes older than ``retention`` are deleted.
+    """
+
+    def __init__(
+            self,
+            session_factory: Optional[async_sessionmaker],
+            poll_interval: float,
+            retention: timedelta,
+            compact_interval: float,
+    ):
+        self.session_factory = session_factory
+        self.poll_interval = poll_interval
+        self.retention = retention
+        self.compact_interval = compact_interval
+        self.latest_id: Optional[int] = None
+        self._changed: Optional[asyncio.Condition] = None
+        self._tasks: list = []
+
+    def _condition(self) -> asyncio.Condition:
+        if self._changed is None:
+            self._changed = asyncio.Condition()
+        return self._changed
+
+    async def sequence(self) -> int:
+        session_factory = self.session_factory or get_session_factory()
+        async with session_factory() as db:
+            return await crud.sequence_account_changes(db, limit=CHANGE_FEED_SEQUENCE_BATCH)
+
+    async def poll(self):
+        await self.sequence()
+        session_factory = self.session_factory or get_read_session_factory()
+        async with session_factory() as db:
+            _, latest_id = await crud.get_account_changes_bounds(db)
+        if latest_id != self.latest_id:
+            self.latest_id = latest_id
+            async with self._condition():
+                self._condition().notify_all()
+
+    async def wait(self, cursor: Optional[int], timeout: float) -> bool:
+        """Wait until a change after ``cursor`` is logged, False if none was within ``timeout`` seconds."""
+        def changed():
+            return self.latest_id is not None and (cursor is None or self.latest_id > cursor)
+
+        async with self._condition():
+            try:
+                await asyncio.wait_for(self._condition().wait_for(changed), timeout)
+            except asyncio.TimeoutError:
+                return False
+        return True
+
+    async def compact(self) -> int:
+        session_factory = self.session_factory or get_session_factory()
+        async with session_factory() as db:
+            compacted = await crud.compact_account_changes(db, older_than=datetime.now() - self.retention)
+        COMPACTED_CHANGES.inc(amount=compacted)
+        return compacted
+
+    async def _poll_periodically(self):
+        while True:
+            try:
+                await self.poll()
+            except Exception:
+                logger.exception("Failed to poll the account change log")
+            await asyncio.sleep(self.poll_interval)
+
+    async def _compact_periodically(self):
+        while True:
+            await asyncio.sleep(self.compact_interval)
+            try:
+                compacted = await self.compact()
+                logger.info("Compacted %d account changes", compacted)
+            except Exception:
+                logger.exception("Failed to compact the account change log")
+
+    def start(self):
+        if not self._tasks:
+            loop = asyncio.get_running_loop()
+            self._tasks = [loop.create_task(self._poll_periodically()), loop.create_task(self._compact_periodically())]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+
+async def read_changes(session_factory: async_sessionmaker, since: Optional[int], limit: int) -> list:
+    """A batch of changes after ``since``, raising ``CursorExpired`` if the log no longer reaches back to it."""
+    async with session_factory() as db:
+        if since is not None:
+            compacted_through, _ = await crud.get_account_changes_bounds(db)
+            if since < compacted_through:
+                raise CursorExpired(since)
+        return await crud.get_account_changes(db, since=since, limit=limit)
+
+
+async def change_events(
+        feed: ChangeFeed, session_factory: async_sessionmaker, since: Optional[int], limit: int
+) -> AsyncIterator[str]:
+    """Server-Sent Events of the changes after ``since``, as they are logged, with heartbeats in between.
+
+    The event ids are the change ids, so a reconnecting EventSource resumes
+    from its ``Last-Event-ID``.
+    """
+    cursor = since
+    while True:
+        try:
+            changes = await read_changes(session_factory, cursor, limit)
+        except CursorExpired:
+            yield "event: expired\ndata: {}\n\n"
+            return
+        for change in changes:
+            yield f"id: {change['id']}\ndata: {orjson.dumps(change).decode()}\n\n"
+        if changes:
+            cursor = changes[-1]["id"]
+            continue
+        if feed.latest_id is not None and (cursor is None or feed.latest_id > cursor):
+            # Logged, but not on the replica this read went to yet
+            await asyncio.sleep(feed.poll_interval)
+        elif not await feed.wait(cursor, timeout=CHANGE_FEED_HEARTBEAT):
+            # Keeps proxies from closing an idle stream
+            yield ": heartbeat\n\n"
+
+
+change_feed = ChangeFeed(
+    None,
+    poll_interval=CHANGE_FEED_POLL_INTERVAL,
+    retention=timedelta(days=CHANGE_FEED_RETENTION_DAYS),
+    compact_interval=CHANGE_FEED_COMPACT_INTERVAL,
+)
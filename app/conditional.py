@@ -0,0 +1,55 @@
+"""Validators of conditional GETs: ``ETag``/``If-None-Match`` and ``Last-Modified``/``If-Modified-Since``."""
+import hashlib
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Optional
+
+from fastapi import Request
+
+
+def make_etag(*parts) -> str:
+    """Weak ETag of the values a response is derived from, rather than of its bytes."""
+    digest = hashlib.blake2b(repr(parts).encode(), digest_size=12).hexdigest()
+    return f'W/"{digest}"'
+
+
+def http_date(moment: datetime) -> str:
+    # Naive datetimes are local time, like every datetime the app stores
+    return format_datetime(moment.astimezone(timezone.utc), usegmt=True)
+
+
+def validator_headers(etag: str, last_modified: Optional[datetime]) -> dict:
+    headers = {"ETag": etag}
+    if last_modified is not None:
+        headers["Last-Modified"] = http_date(last_modified)
+    return headers
+
+
+def _opaque_tag(etag: str) -> str:
+    return etag[2:] if etag.startswith("W/") else etag
+
+
+def is_not_modified(request: Request, etag: str, last_modified: Optional[datetime]) -> bool:
+    """Whether the client's copy is current, so a 304 can be sent instead of the body.
+
+    ``If-None-Match`` takes precedence over ``If-Modified-Since`` (RFC 9110),
+    and tags are compared weakly as a GET allows.
+    """
+    if_none_match = request.headers.get("If-None-Match")
+    if if_none_match is not None:
+        if if_none_match.strip() == "*":
+            return True
+        tags = {_opaque_tag(tag.strip()) for tag in if_none_match.split(",")}
+        return _opaque_tag(etag) in tags
+
+    if_modified_since = request.headers.get("If-Modified-Since")
+    if if_modified_since is None or last_modified is None:
+        return False
+    try:
+        since = parsedate_to_datetime(if_modified_since)
+    except (TypeError, ValueError):
+        return False
+    if since.tzinfo is None:
+        return False
+    # HTTP dates have whole seconds
+    return last_modified.astimezone(timezone.utc).replace(microsecond=0) <= since
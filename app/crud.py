@@ -1,69 +1,725 @@
-from sqlalchemy.orm import Session
+import base64
+import json
+import secrets
+from typing import Optional
+from sqlalchemy import and_, case, delete, func, insert, literal, or_, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
 from validate_email_address import validate_email
-from datetime import datetime
+from datetime import datetime, timedelta
 
-from . import auth, models, schemas
+from . import auth, cache, hashing, metrics, models, schemas
 
+account_cache = cache.create_account_cache()
+metrics.Counter("account_cache_hits_total", "Account cache lookups served from the cache.",
+                function=lambda: account_cache.hits)
+metrics.Counter("account_cache_misses_total", "Account cache lookups that went to the database.",
+                function=lambda: account_cache.misses)
 
-def create_account(db: Session, account: schemas.AccountRegister):
-    hashed_password = auth.get_password_hash(account.password)
+# Columns kept in the account cache, the plain text password is never cached
+CACHED_COLUMNS = [column.key for column in models.Account.__table__.columns if column.key != "password"]
+# Columns of schemas.AccountResponse, selected as plain rows by the read paths that skip the ORM
+RESPONSE_FIELDS = list(schemas.AccountResponse.model_fields)
+RESPONSE_COLUMNS = [getattr(models.Account, field) for field in RESPONSE_FIELDS]
+# Keys per IN (...) list of the batch lookups, well within the bound parameter limits of every backend
+LOOKUP_CHUNK_SIZE = 500
+# Dialects whose default collations compare emails case-insensitively (MariaDB runs on the "mysql" dialect)
+CASE_INSENSITIVE_EMAIL_DIALECTS = {"mysql"}
+
+
+def _id_key(acc_id: int) -> str:
+    return f"id:{acc_id}"
+
+
+def _email_key(email: str) -> str:
+    return f"email:{email}"
+
+
+def _fills_cache(db: AsyncSession) -> bool:
+    """Whether rows read through ``db`` may be cached: a lagging replica would put back rows a write uncached."""
+    return db.info.get("role") != "replica"
+
+
+async def _cache_account(db_account: models.Account):
+    await _cache_values({column: getattr(db_account, column) for column in CACHED_COLUMNS})
+
+
+async def _cache_values(data: dict):
+    await account_cache.set(_id_key(data["id"]), data)
+    await account_cache.set(_email_key(data["email"]), data)
+
+
+async def _uncache_account(acc_id: int, email: str):
+    await account_cache.delete(_id_key(acc_id), _email_key(email))
+
+
+async def _uncache_emails(emails):
+    for email in emails:
+        cached = await account_cache.peek(_email_key(email))
+        if cached is not None:
+            await _uncache_account(cached["id"], email)
+
+
+async def _log_change(db: AsyncSession, operation: str, account_id: int, email: str):
+    """Append to the change log in the caller's transaction, so a change is logged if and only if it commits.
+
+    Nothing is locked: the change gets its position in the feed once it has
+    committed, from ``sequence_account_changes``.
+    """
+    await db.execute(insert(models.AccountChange).values(
+        account_id=account_id, operation=operation, email=email, changed_at=datetime.now()
+    ))
+
+
+async def _log_changes(db: AsyncSession, operation: str, where):
+    """Like ``_log_change`` for every account matching ``where``, with one INSERT ... SELECT."""
+    await db.execute(insert(models.AccountChange).from_select(
+        ["account_id", "operation", "email", "changed_at"],
+        select(models.Account.id, literal(operation), models.Account.email,
+               literal(datetime.now(), models.PreciseDateTime)).where(where),
+    ))
+
+
+async def _log_key_changes(db: AsyncSession, operation: str, keys: list):
+    """Like ``_log_change`` for every (id, email) of ``keys``, in one executemany INSERT."""
+    if not keys:
+        return
+    now = datetime.now()
+    await db.execute(insert(models.AccountChange), [
+        {"account_id": acc_id, "operation": operation, "email": email, "changed_at": now} for acc_id, email in keys
+    ])
+
+
+async def create_account(db: AsyncSession, account: schemas.AccountRegister):
+    """Insert a new account in a single statement and commit.
+
+    Duplicate emails are left to the unique constraint on ``Account.email``,
+    the resulting IntegrityError is raised to the caller after a rollback.
+    """
+    hashed_password = await hashing.hasher.hash(account.password)
+    now = datetime.now()
     db_account = models.Account(
         name=account.name,
         email=account.email,
         is_active=True,
         password=account.password,
         hashed_password=hashed_password,
+        created_date=now,
+        last_login_date=now,
+        updated_at=now,
     )
     db.add(db_account)
-    db.commit()
-    db.refresh(db_account)
-    set_last_login_date(db, email=account.email)
-    db.commit()
-    db.refresh(db_account)
+    try:
+        await db.flush()
+    except IntegrityError:
+        await db.rollback()
+        raise
+    await _log_change(db, "create", db_account.id, db_account.email)
+    await db.commit()
+    await _cache_account(db_account)
     return db_account
 
 
-def get_accounts(db: Session):
-    return db.query(models.Account).all()
+async def create_accounts(db: AsyncSession, accounts: list):
+    """Insert many accounts, given as dicts of Account columns, with one executemany INSERT.
 
+    Returns one entry per account: None when it was created, otherwise the
+    reason it was not.
+    """
+    emails = [account["email"] for account in accounts]
+    result = await db.scalars(select(models.Account.email).filter(models.Account.email.in_(emails)))
+    taken = set(result.all())
 
-def get_account_by_id(db: Session, acc_id: int):
-    return db.query(models.Account).filter(models.Account.id == acc_id).first()
+    errors = []
+    rows = []
+    now = datetime.now()
+    for index, account in enumerate(accounts):
+        if account["email"] in taken:
+            errors.append("Email already registered")
+            continue
+        taken.add(account["email"])
+        errors.append(None)
+        # The defaults create_account sets, so both paths create identical rows
+        rows.append((index, {
+            **account, "is_active": True, "created_date": now, "last_login_date": now, "updated_at": now,
+        }))
 
+    if not rows:
+        return errors
+    try:
+        await db.execute(insert(models.Account), [row for _, row in rows])
+    except IntegrityError:
+        await db.rollback()
+        # A concurrent registration took one of the emails, find it row by row
+        for index, row in rows:
+            try:
+                async with db.begin_nested():
+                    await db.execute(insert(models.Account), [row])
+            except IntegrityError:
+                errors[index] = "Email already registered"
+    created = [row["email"] for index, row in rows if errors[index] is None]
+    if created:
+        await _log_changes(db, "create", models.Account.email.in_(created))
+    await db.commit()
+    return errors
 
-def get_account_by_email(db: Session, email: str):
-    return db.query(models.Account).filter(models.Account.email == email).first()
 
+async def get_accounts(db: AsyncSession, limit: Optional[int] = None, after: Optional[int] = None):
+    query = select(models.Account).order_by(models.Account.id)
+    if after is not None:
+        query = query.filter(models.Account.id > after)
+    if limit is not None:
+        query = query.limit(limit)
+    result = await db.scalars(query)
+    return result.all()
 
-def update_account(db: Session, email: str, account_update: schemas.AccountPartialUpdate):
-    db_account = db.query(models.Account).filter(models.Account.email == email).first()
-    if db_account:
-        acc = account_update.dict(exclude_unset=True)
 
-        request_body = {key: value for key, value in acc.items() if value is not None}
-        for key, value in request_body.items():
-            setattr(db_account, key, value)
-        db.commit()
-        db.refresh(db_account)
-    return db_account
+async def get_account_projections(db: AsyncSession, limit: Optional[int] = None, after: Optional[int] = None):
+    """Like ``get_accounts``, but return plain dicts of the response columns without building ORM objects."""
+    query = select(*RESPONSE_COLUMNS).order_by(models.Account.id)
+    if after is not None:
+        query = query.filter(models.Account.id > after)
+    if limit is not None:
+        query = query.limit(limit)
+    result = await db.execute(query)
+    return [dict(zip(RESPONSE_FIELDS, row)) for row in result.tuples()]
+
+
+async def get_account_projections_version(
+        db: AsyncSession, limit: Optional[int] = None, after: Optional[int] = None
+) -> tuple:
+    """(count, last id, latest ``updated_at``) of the page ``get_account_projections`` would return.
+
+    An aggregate over the same id range, so the page's validators cost one
+    row instead of the whole page: a write to one of its rows moves the
+    latest ``updated_at``, and an insert or delete changes which rows it
+    holds, hence its count or last id.
+    """
+    page = select(models.Account.id, models.Account.updated_at).order_by(models.Account.id)
+    if after is not None:
+        page = page.filter(models.Account.id > after)
+    if limit is not None:
+        page = page.limit(limit)
+    page = page.subquery()
+    row = (await db.execute(select(func.count(), func.max(page.c.id), func.max(page.c.updated_at)))).one()
+    return tuple(row)
+
 
+async def get_account_id_bounds(db: AsyncSession) -> tuple:
+    """(lowest, highest) account id, both None when there are no accounts."""
+    row = (await db.execute(select(func.min(models.Account.id), func.max(models.Account.id)))).one()
+    return tuple(row)
 
-def delete_account(db: Session, email: str):
-    db_account = db.query(models.Account).filter(models.Account.email == email).first()
-    if db_account:
-        db.delete(db_account)
-        db.commit()
+
+async def stream_accounts(
+        db: AsyncSession,
+        chunk_size: int = 1000,
+        after: Optional[int] = None,
+        until: Optional[int] = None,
+        columns: Optional[list] = None,
+):
+    """Yield lists of account rows read from a server-side cursor, ``chunk_size`` rows at a time.
+
+    ``after`` and ``until`` bound the ids read (exclusive and inclusive), and
+    ``columns`` defaults to the response columns.
+    """
+    query = select(*(columns or RESPONSE_COLUMNS)).order_by(models.Account.id)
+    if after is not None:
+        query = query.filter(models.Account.id > after)
+    if until is not None:
+        query = query.filter(models.Account.id <= until)
+    result = await db.stream(query.execution_options(yield_per=chunk_size))
+    async for chunk in result.partitions():
+        yield chunk
+
+
+def _prefix_upper_bound(prefix: str) -> Optional[str]:
+    last = ord(prefix[-1])
+    if last >= 0x10FFFF:
+        return None
+    return prefix[:-1] + chr(last + 1)
+
+
+def account_filters(search: schemas.AccountSearch) -> list:
+    """Conditions of the filters of ``search``, its sort and order aside.
+
+    Every filter is a plain comparison, the name prefix included, so it can
+    use the search indexes of ``models.Account`` on any backend. ``*_from``
+    bounds are inclusive and ``*_to`` bounds exclusive.
+    """
+    account = models.Account
+    conditions = []
+    if search.is_active is not None:
+        conditions.append(account.is_active == search.is_active)
+    if search.name_prefix:
+        conditions.append(account.name >= search.name_prefix)
+        upper_bound = _prefix_upper_bound(search.name_prefix)
+        if upper_bound is not None:
+            conditions.append(account.name < upper_bound)
+    if search.created_from is not None:
+        conditions.append(account.created_date >= search.created_from)
+    if search.created_to is not None:
+        conditions.append(account.created_date < search.created_to)
+    if search.last_login_from is not None:
+        conditions.append(account.last_login_date >= search.last_login_from)
+    if search.last_login_to is not None:
+        conditions.append(account.last_login_date < search.last_login_to)
+    return conditions
+
+
+def search_accounts_query(search: schemas.AccountSearch, limit: int, after: Optional[tuple] = None):
+    """Build the keyset-paginated query behind search_accounts.
+
+    The filters are those of ``account_filters``. Sorting by a nullable
+    column skips the accounts where it is NULL.
+    """
+    account = models.Account
+    sort_column = getattr(account, search.sort)
+    query = select(account).filter(*account_filters(search))
+    if search.sort != "id":
+        query = query.filter(sort_column.is_not(None))
+
+    descending = search.order == "desc"
+    if after is not None:
+        value, acc_id = after
+        if search.sort == "id":
+            query = query.filter(account.id < acc_id if descending else account.id > acc_id)
+        elif descending:
+            query = query.filter(or_(sort_column < value, and_(sort_column == value, account.id < acc_id)))
+        else:
+            query = query.filter(or_(sort_column > value, and_(sort_column == value, account.id > acc_id)))
+
+    if search.sort == "id":
+        order_by = [account.id.desc() if descending else account.id]
+    else:
+        order_by = [sort_column.desc(), account.id.desc()] if descending else [sort_column, account.id]
+    return query.order_by(*order_by).limit(limit)
+
+
+async def search_accounts(
+        db: AsyncSession, search: schemas.AccountSearch, limit: int, after: Optional[tuple] = None
+):
+    result = await db.scalars(search_accounts_query(search, limit=limit, after=after))
+    return result.all()
+
+
+def encode_search_cursor(db_account: models.Account, sort: str) -> str:
+    value = getattr(db_account, sort)
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    return base64.urlsafe_b64encode(json.dumps([value, db_account.id]).encode()).decode()
+
+
+def decode_search_cursor(cursor: str, sort: str) -> tuple:
+    """Return the (sort value, id) pair of a search cursor, raising ValueError if it is malformed."""
+    try:
+        value, acc_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if sort in ("created_date", "last_login_date"):
+            value = datetime.fromisoformat(value)
+    except (TypeError, ValueError) as exc:
+        raise ValueError("Malformed cursor") from exc
+    if not isinstance(acc_id, int):
+        raise ValueError("Malformed cursor")
+    return value, acc_id
+
+
+async def get_account_by_id(db: AsyncSession, acc_id: int):
+    cached = await account_cache.get(_id_key(acc_id))
+    if cached is not None:
+        return models.Account(**cached)
+    db_account = await db.scalar(select(models.Account).filter(models.Account.id == acc_id))
+    if db_account and _fills_cache(db):
+        await _cache_account(db_account)
     return db_account
 
 
-def set_last_login_date(db: Session, email: str):
-    db_account = db.query(models.Account).filter(models.Account.email == email).first()
-    setattr(db_account, 'last_login_date', datetime.now())
-    db.commit()
-    db.refresh(db_account)
+async def get_account_projection(db: AsyncSession, acc_id: int) -> Optional[dict]:
+    """Like ``get_account_by_id``, but return a plain dict of the response columns."""
+    cached = await account_cache.get(_id_key(acc_id))
+    if cached is None:
+        columns = [getattr(models.Account, column) for column in CACHED_COLUMNS]
+        row = (await db.execute(select(*columns).filter(models.Account.id == acc_id))).first()
+        if row is None:
+            return None
+        cached = dict(zip(CACHED_COLUMNS, row))
+        if _fills_cache(db):
+            await _cache_values(cached)
+    return {field: cached[field] for field in RESPONSE_FIELDS}
+
+
+async def get_account_updated_at(db: AsyncSession, acc_id: int) -> Optional[datetime]:
+    """``updated_at`` of an account, None if it does not exist; from the cache when it holds the account."""
+    cached = await account_cache.get(_id_key(acc_id))
+    if cached is not None:
+        return cached["updated_at"]
+    return await db.scalar(select(models.Account.updated_at).filter(models.Account.id == acc_id))
+
+
+async def _get_account_projections_by(db: AsyncSession, column, keys: list, normalize=None) -> list:
+    """Projections of the accounts whose ``column`` is one of ``keys``, in the order of ``keys``, None if missing.
+
+    One ``IN (...)`` query per ``LOOKUP_CHUNK_SIZE`` distinct keys, bypassing
+    the account cache, which would take a round trip per key. Keys without an
+    exact match are paired through ``normalize``, when given, which has to
+    agree with the comparison the database made.
+    """
+    found = {}
+    normalized = {}
+    distinct = list(dict.fromkeys(keys))
+    for start in range(0, len(distinct), LOOKUP_CHUNK_SIZE):
+        result = await db.execute(
+            select(*RESPONSE_COLUMNS).where(column.in_(distinct[start:start + LOOKUP_CHUNK_SIZE]))
+        )
+        for row in result.tuples():
+            account = dict(zip(RESPONSE_FIELDS, row))
+            found[account[column.key]] = account
+            if normalize is not None:
+                normalized[normalize(account[column.key])] = account
+    return [
+        found.get(key) or (normalized.get(normalize(key)) if normalize is not None else None)
+        for key in keys
+    ]
+
+
+async def get_account_projections_by_ids(db: AsyncSession, ids: list) -> list:
+    return await _get_account_projections_by(db, models.Account.id, ids)
+
+
+async def get_account_projections_by_emails(db: AsyncSession, emails: list) -> list:
+    # Where the collation matched User@Example.com to the stored user@example.com, pair them too
+    case_insensitive = db.get_bind().dialect.name in CASE_INSENSITIVE_EMAIL_DIALECTS
+    return await _get_account_projections_by(db, models.Account.email, emails,
+                                             normalize=str.casefold if case_insensitive else None)
+
+
+async def get_account_by_email(db: AsyncSession, email: str):
+    cached = await account_cache.get(_email_key(email))
+    if cached is not None:
+        return models.Account(**cached)
+    db_account = await db.scalar(select(models.Account).filter(models.Account.email == email))
+    if db_account and _fills_cache(db):
+        await _cache_account(db_account)
     return db_account
 
 
+def _supports_returning(db: AsyncSession, statement: str) -> bool:
+    """Whether the database of ``db`` can return the rows of an ``"update"`` or ``"delete"``."""
+    return getattr(db.get_bind().dialect, f"{statement}_returning", False)
+
+
+async def update_account(db: AsyncSession, email: str, account_update: schemas.AccountPartialUpdate):
+    """Set the fields given in ``account_update`` with one ``UPDATE ... WHERE email = ?``.
+
+    The updated row comes back with ``RETURNING``; databases without it
+    (MySQL) read it with one more SELECT. Returns a detached
+    ``models.Account``, None if there is no account with that email.
+    """
+    columns = [getattr(models.Account, column) for column in CACHED_COLUMNS]
+    values = {key: value for key, value in account_update.model_dump(exclude_unset=True).items() if value is not None}
+    if not values:
+        row = (await db.execute(select(*columns).filter(models.Account.email == email))).first()
+        return models.Account(**dict(zip(CACHED_COLUMNS, row))) if row is not None else None
+
+    statement = (
+        update(models.Account)
+        .where(models.Account.email == email)
+        .values(**values)
+        .execution_options(synchronize_session=False)
+    )
+    if _supports_returning(db, "update"):
+        row = (await db.execute(statement.returning(*columns))).first()
+    else:
+        result = await db.execute(statement)
+        row = None
+        if result.rowcount:
+            new_email = values.get("email", email)
+            row = (await db.execute(select(*columns).filter(models.Account.email == new_email))).first()
+    if row is None:
+        await db.rollback()
+        return None
+
+    data = dict(zip(CACHED_COLUMNS, row))
+    await _log_change(db, "update", data["id"], data["email"])
+    await db.commit()
+    await _uncache_account(data["id"], email)
+    await _cache_values(data)
+    return models.Account(**data)
+
+
+async def delete_account(db: AsyncSession, email: str):
+    """Delete an account with one ``DELETE ... WHERE email = ? RETURNING``, or a SELECT and a DELETE without it.
+
+    Returns the deleted account as a detached ``models.Account``, None if
+    there is no account with that email.
+    """
+    columns = [getattr(models.Account, column) for column in CACHED_COLUMNS]
+    statement = delete(models.Account).where(models.Account.email == email)
+    if _supports_returning(db, "delete"):
+        row = (await db.execute(statement.returning(*columns))).first()
+    else:
+        row = (await db.execute(select(*columns).filter(models.Account.email == email))).first()
+        if row is not None:
+            await db.execute(statement)
+    if row is None:
+        await db.rollback()
+        return None
+
+    data = dict(zip(CACHED_COLUMNS, row))
+    await _log_change(db, "delete", data["id"], data["email"])
+    await db.commit()
+    await _uncache_account(data["id"], data["email"])
+    return models.Account(**data)
+
+
+async def _locked_keys(db: AsyncSession, where) -> list:
+    """(id, email) of the accounts matching ``where``, locked until commit, for databases without RETURNING."""
+    return (await db.execute(select(models.Account.id, models.Account.email).where(where).with_for_update())).all()
+
+
+async def set_accounts_active(db: AsyncSession, search: schemas.AccountSearch, is_active: bool) -> int:
+    """Activate or deactivate every account matching the filters of ``search``, in one set-based UPDATE.
+
+    Accounts already in that state are left alone, so only real changes are
+    logged, after the UPDATE and from the keys it returns. Returns the
+    number of accounts changed.
+    """
+    where = and_(*account_filters(search), models.Account.is_active.is_distinct_from(is_active))
+    statement = (
+        update(models.Account)
+        .where(where)
+        .values(is_active=is_active)
+        .execution_options(synchronize_session=False)
+    )
+    if _supports_returning(db, "update"):
+        keys = (await db.execute(statement.returning(models.Account.id, models.Account.email))).all()
+    else:
+        keys = await _locked_keys(db, where)
+        await db.execute(statement)
+    await _log_key_changes(db, "update", keys)
+    await db.commit()
+    for acc_id, email in keys:
+        await _uncache_account(acc_id, email)
+    return len(keys)
+
+
+async def delete_accounts(db: AsyncSession, emails: list) -> int:
+    """Delete the accounts of ``emails`` in one set-based DELETE, returning how many there were."""
+    where = models.Account.email.in_(emails)
+    statement = delete(models.Account).where(where)
+    if _supports_returning(db, "delete"):
+        keys = (await db.execute(statement.returning(models.Account.id, models.Account.email))).all()
+    else:
+        keys = await _locked_keys(db, where)
+        await db.execute(statement)
+    await _log_key_changes(db, "delete", keys)
+    await db.commit()
+    for acc_id, email in keys:
+        await _uncache_account(acc_id, email)
+    return len(keys)
+
+
+async def rehash_password(db: AsyncSession, account: models.Account, password: str) -> bool:
+    """Replace the outdated hash of ``account`` with one at the current bcrypt cost.
+
+    The UPDATE only applies while the stored hash is still the one that was
+    verified, so a password changed in the meantime is never overwritten.
+    """
+    hashed_password = await hashing.hasher.hash(password)
+    result = await db.execute(
+        update(models.Account)
+        .where(models.Account.id == account.id, models.Account.hashed_password == account.hashed_password)
+        .values(hashed_password=hashed_password)
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount == 1:
+        await _log_change(db, "update", account.id, account.email)
+    await db.commit()
+    await _uncache_account(account.id, account.email)
+    return result.rowcount == 1
+
+
+async def set_last_login_dates(db: AsyncSession, logins: dict):
+    """Set ``last_login_date`` of many accounts, given as {email: datetime}, in one UPDATE."""
+    if not logins:
+        return
+    await db.execute(
+        update(models.Account)
+        .where(models.Account.email.in_(logins))
+        .values(last_login_date=case(logins, value=models.Account.email))
+        .execution_options(synchronize_session=False)
+    )
+    await _log_changes(db, "update", models.Account.email.in_(logins))
+    await db.commit()
+    await _uncache_emails(logins)
+
+
+class RefreshTokenReused(Exception):
+    """An already rotated refresh token was presented again, its whole family has been revoked."""
+
+
+async def create_refresh_token(db: AsyncSession, account_id: int, family_id: Optional[str] = None) -> str:
+    """Store a new refresh token of ``account_id`` and return its value, which is never stored."""
+    token = auth.create_refresh_token_value()
+    await db.execute(insert(models.RefreshToken).values(
+        token_hash=auth.refresh_token_digest(token),
+        family_id=family_id or secrets.token_hex(16),
+        account_id=account_id,
+        created_date=datetime.now(),
+        expires_at=datetime.now() + timedelta(days=auth.REFRESH_TOKEN_EXPIRE_DAYS),
+    ))
+    await db.commit()
+    return token
+
+
+async def revoke_refresh_token_family(db: AsyncSession, family_id: str) -> int:
+    result = await db.execute(delete(models.RefreshToken).where(models.RefreshToken.family_id == family_id))
+    await db.commit()
+    return result.rowcount
+
+
+async def rotate_refresh_token(db: AsyncSession, token: str) -> Optional[tuple]:
+    """Exchange a refresh token for a new one of the same family, returning (email, new token).
+
+    One indexed lookup by the token's digest, joined to its account; None
+    if the token is unknown or expired. A token can be rotated only once:
+    presenting it again means it leaked, so its whole family is revoked and
+    ``RefreshTokenReused`` raised.
+    """
+    now = datetime.now()
+    row = (await db.execute(
+        select(models.RefreshToken.id, models.RefreshToken.family_id, models.RefreshToken.account_id,
+               models.RefreshToken.expires_at, models.RefreshToken.used_at, models.Account.email)
+        .join(models.Account, models.Account.id == models.RefreshToken.account_id)
+        .where(models.RefreshToken.token_hash == auth.refresh_token_digest(token))
+    )).one_or_none()
+    if row is None or row.expires_at <= now:
+        return None
+
+    # Compare-and-set, so of two concurrent rotations of the same token only one wins
+    claimed = await db.execute(
+        update(models.RefreshToken)
+        .where(models.RefreshToken.id == row.id, models.RefreshToken.used_at.is_(None))
+        .values(used_at=now)
+        .execution_options(synchronize_session=False)
+    )
+    if row.used_at is not None or claimed.rowcount != 1:
+        await revoke_refresh_token_family(db, row.family_id)
+        raise RefreshTokenReused(row.family_id)
+    return row.email, await create_refresh_token(db, row.account_id, family_id=row.family_id)
+
+
+async def revoke_refresh_token(db: AsyncSession, token: str) -> bool:
+    """Revoke the family of a refresh token, e.g. on logout."""
+    family_id = await db.scalar(
+        select(models.RefreshToken.family_id)
+        .where(models.RefreshToken.token_hash == auth.refresh_token_digest(token))
+    )
+    if family_id is None:
+        return False
+    await revoke_refresh_token_family(db, family_id)
+    return True
+
+
+async def purge_expired_refresh_tokens(db: AsyncSession) -> int:
+    result = await db.execute(delete(models.RefreshToken).where(models.RefreshToken.expires_at <= datetime.now()))
+    await db.commit()
+    return result.rowcount
+
+
+async def get_account_changes(db: AsyncSession, since: Optional[int], limit: int) -> list:
+    """Up to ``limit`` logged changes after the ``since`` cursor, in feed order, with the account's current state.
+
+    Only sequenced changes are read, and they are sequenced in the order
+    they became visible, so once a change is read every change before it
+    has been too, and a cursor moving past it skips nothing. The ``id`` of a
+    change is its ``seq``. ``account`` is None once the account is deleted.
+    """
+    query = (
+        select(models.AccountChange.seq, models.AccountChange.account_id, models.AccountChange.operation,
+               models.AccountChange.email, models.AccountChange.changed_at, *RESPONSE_COLUMNS)
+        .outerjoin(models.Account, models.Account.id == models.AccountChange.account_id)
+        .filter(models.AccountChange.seq.is_not(None))
+        .order_by(models.AccountChange.seq)
+        .limit(limit)
+    )
+    if since is not None:
+        query = query.filter(models.AccountChange.seq > since)
+    changes = []
+    for row in (await db.execute(query)).tuples():
+        seq, account_id, operation, email, changed_at = row[:5]
+        account = dict(zip(RESPONSE_FIELDS, row[5:])) if operation != "delete" and row[5] is not None else None
+        changes.append({
+            "id": seq, "account_id": account_id, "operation": operation, "email": email,
+            "changed_at": changed_at, "account": account,
+        })
+    return changes
+
+
+async def get_account_changes_bounds(db: AsyncSession) -> tuple:
+    """(highest compacted seq, last seq) of the change log, cursors below the first one have expired.
+
+    The compacted seq is 0 until the first compaction, the last seq None until a change is sequenced.
+    """
+    state = models.AccountChangeLogState
+    row = (await db.execute(select(state.compacted_through, state.sequenced_through))).first()
+    if row is None:
+        return 0, None
+    compacted_through, sequenced_through = row
+    return compacted_through or 0, sequenced_through or None
+
+
+async def sequence_account_changes(db: AsyncSession, limit: int) -> int:
+    """Give up to ``limit`` committed, unsequenced changes the next positions in the feed, in id order.
+
+    The single sequencer of the moment holds the change log state row, and
+    sees only committed changes, so a change that commits after a later one
+    is sequenced after it too. Writers never wait for this; another worker
+    already sequencing is skipped rather than waited for. Returns the number
+    of changes sequenced.
+    """
+    state = models.AccountChangeLogState
+    row = (await db.execute(select(state.sequenced_through).with_for_update(skip_locked=True))).first()
+    if row is None:
+        await db.rollback()
+        return 0
+    ids = (await db.scalars(
+        select(models.AccountChange.id)
+        .filter(models.AccountChange.seq.is_(None))
+        .order_by(models.AccountChange.id)
+        .limit(limit)
+    )).all()
+    if not ids:
+        await db.rollback()
+        return 0
+    sequenced_through = row[0]
+    await db.execute(update(models.AccountChange), [
+        {"id": change_id, "seq": sequenced_through + position} for position, change_id in enumerate(ids, 1)
+    ])
+    await db.execute(update(state).values(sequenced_through=sequenced_through + len(ids)))
+    await db.commit()
+    return len(ids)
+
+
+async def compact_account_changes(db: AsyncSession, older_than: datetime) -> int:
+    """Delete the sequenced changes logged before ``older_than``, recording the highest seq deleted.
+
+    Positions come from ``sequenced_through``, not from the deleted rows, so
+    they are never handed out again.
+    """
+    last_expired = await db.scalar(select(func.max(models.AccountChange.seq)).filter(
+        models.AccountChange.changed_at < older_than
+    ))
+    if last_expired is None:
+        return 0
+    result = await db.execute(delete(models.AccountChange).where(models.AccountChange.seq <= last_expired))
+    state = models.AccountChangeLogState
+    await db.execute(update(state).values(compacted_through=case(
+        (state.compacted_through < last_expired, last_expired), else_=state.compacted_through
+    )))
+    await db.commit()
+    return result.rowcount
+
+
 def check_email(email):
     is_valid = validate_email(email, verify=False)
     return is_valid
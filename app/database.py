@@ -1,23 +1,178 @@
+import itertools
 import os
+import time
+from typing import Optional
 
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.orm import declarative_base
 
-from dotenv import load_dotenv
-
-load_dotenv()
+from . import metrics
 
 SQLALCHEMY_DATABASE_URI = str(os.getenv("DB_URL"))
+# Overrides the async URL otherwise derived from DB_URL
+ASYNC_SQLALCHEMY_DATABASE_URI = os.getenv("ASYNC_DB_URL")
+# Comma separated URLs of read replicas, reads go to the primary when empty
+REPLICA_DATABASE_URIS = [url.strip() for url in os.getenv("DB_REPLICA_URLS", "").split(",") if url.strip()]
+
+# Fail startup unless the database is at the Alembic head revision
+DB_CHECK_MIGRATIONS = os.getenv("DB_CHECK_MIGRATIONS", "false").lower() in ("1", "true", "yes")
+ALEMBIC_CONFIG = os.getenv(
+    "ALEMBIC_CONFIG", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "alembic.ini")
+)
+
+# Async drivers used in place of the blocking ones configured in DB_URL
+ASYNC_DRIVERS = {
+    "mysql": "aiomysql",
+    "mariadb": "aiomysql",
+    "sqlite": "aiosqlite",
+}
+
+
+def to_async_url(url: str) -> str:
+    """Return ``url`` rewritten to use the async driver of its backend."""
+    parsed = make_url(url)
+    backend = parsed.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        return url
+    return parsed.set(drivername=f"{backend}+{ASYNC_DRIVERS[backend]}").render_as_string(hide_password=False)
+
+
+def engine_options(role: str) -> dict:
+    """Pool and logging options for the engines of ``role`` ("primary" or "replica").
+
+    Every DB_<OPTION> variable can be overridden for one role with
+    DB_<ROLE>_<OPTION>, e.g. DB_REPLICA_POOL_SIZE. Pool sizes are left to
+    SQLAlchemy unless set, since not every pool class accepts them.
+    """
+    def setting(name, default=None):
+        return os.getenv(f"DB_{role.upper()}_{name}", os.getenv(f"DB_{name}", default))
+
+    options = {
+        "echo": setting("ECHO", "false").lower() in ("1", "true", "yes"),
+        "pool_pre_ping": setting("POOL_PRE_PING", "false").lower() in ("1", "true", "yes"),
+    }
+    for name, option in (("POOL_SIZE", "pool_size"), ("MAX_OVERFLOW", "max_overflow"), ("POOL_RECYCLE", "pool_recycle")):
+        value = setting(name)
+        if value is not None:
+            options[option] = int(value)
+    return options
+
+
+def instrument_engine(sync_engine):
+    """Record the count and duration of the statements run on ``sync_engine``."""
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        # On the execution context, which is dropped with it when the statement fails and after_cursor_execute never runs
+        context._query_started = time.perf_counter()
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        metrics.observe_query(time.perf_counter() - context._query_started)
+
+
+def create_session_factory(async_url: str, role: str) -> async_sessionmaker:
+    async_engine = create_async_engine(async_url, **engine_options(role))
+    instrument_engine(async_engine.sync_engine)
+    # The role is kept in Session.info, crud only fills the account cache from the primary
+    return async_sessionmaker(
+        bind=async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False, info={"role": role}
+    )
+
+
+class SessionRouter:
+    """Routes writes to the primary database and spreads reads over the replicas.
+
+    Read session factories are handed out round-robin; without replicas,
+    reads share the primary.
+    """
+
+    def __init__(self, primary: async_sessionmaker, replicas: list):
+        self.primary = primary
+        self.replicas = replicas or [primary]
+        self._next_replica = itertools.cycle(self.replicas)
+
+    def write_sessions(self) -> async_sessionmaker:
+        return self.primary
+
+    def read_sessions(self) -> async_sessionmaker:
+        return next(self._next_replica)
+
+    async def dispose(self):
+        for session_factory in {self.primary, *self.replicas}:
+            await session_factory.kw["bind"].dispose()
 
-engine = create_engine(SQLALCHEMY_DATABASE_URI, echo=True)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 Base = declarative_base()
 
+_router: Optional[SessionRouter] = None
+
+
+def get_router() -> SessionRouter:
+    """Router over the configured databases; the engines are only created on first use."""
+    global _router
+    if _router is None:
+        async_url = ASYNC_SQLALCHEMY_DATABASE_URI or to_async_url(SQLALCHEMY_DATABASE_URI)
+        _router = SessionRouter(create_session_factory(async_url, "primary"), [
+            create_session_factory(to_async_url(url), "replica") for url in REPLICA_DATABASE_URIS
+        ])
+    return _router
+
+
+async def dispose_router():
+    global _router
+    if _router is not None:
+        await _router.dispose()
+        _router = None
+
+
+class SchemaOutdated(RuntimeError):
+    """Raised at startup when the database is not at the Alembic head revision."""
+
+
+def alembic_heads() -> set:
+    from alembic.config import Config
+    from alembic.script import ScriptDirectory
+
+    config = Config(ALEMBIC_CONFIG)
+    # script_location is relative to the ini file, not to the working directory
+    config.set_main_option("script_location", os.path.join(
+        os.path.dirname(ALEMBIC_CONFIG), config.get_main_option("script_location")
+    ))
+    return set(ScriptDirectory.from_config(config).get_heads())
+
+
+async def check_migrations(session_factory: async_sessionmaker):
+    from alembic.runtime.migration import MigrationContext
+
+    async with session_factory.kw["bind"].connect() as connection:
+        current = await connection.run_sync(
+            lambda sync_connection: set(MigrationContext.configure(sync_connection).get_current_heads())
+        )
+    heads = alembic_heads()
+    if current != heads:
+        raise SchemaOutdated(
+            f"Database is at revision {', '.join(sorted(current)) or 'none'}, expected {', '.join(sorted(heads))}; "
+            "run `alembic upgrade head`"
+        )
+
+
+def get_session_factory():
+    # For streaming responses, which outlive the session handed out by get_db
+    return get_router().write_sessions()
+
+
+def get_read_session_factory():
+    return get_router().read_sessions()
+
+
+async def get_db():
+    async with get_router().write_sessions()() as db:
+        yield db
+
 
-def get_db():
-    db = SessionLocal()
-    try:
+async def get_read_db():
+    """Session on a replica, for reads that may lag behind the latest writes."""
+    async with get_router().read_sessions()() as db:
         yield db
-    finally:
-        db.close()
@@ -0,0 +1,240 @@
+"""Export the accounts table to compressed CSV or NDJSON files.
+
+    python -m app.export exports/ --format ndjson --workers 4 --chunk-size 10000
+
+Rows are read from a server-side cursor ``--chunk-size`` at a time and each
+chunk is compressed and written before the next one is read, so memory stays
+flat whatever the size of the table. The id range of the table is split into
+``--parts`` key ranges, each exported to its own file by one of ``--workers``
+processes. Every part records the last id it wrote next to its file, and
+``--resume`` carries an interrupted export on from there.
+
+Credentials are never exported. Accounts created after the export started are
+left out: the key ranges end at the highest id seen when it started.
+"""
+import argparse
+import asyncio
+import csv
+import gzip
+import io
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+
+import orjson
+
+from . import crud, models
+from .database import ASYNC_SQLALCHEMY_DATABASE_URI, SQLALCHEMY_DATABASE_URI, create_session_factory, to_async_url
+
+EXPORT_CHUNK_SIZE = int(os.getenv("EXPORT_CHUNK_SIZE", 10000))
+EXPORT_WORKERS = int(os.getenv("EXPORT_WORKERS", os.cpu_count() or 1))
+# Key ranges per worker, more of them even out the work when ids are unevenly spread
+EXPORT_PARTS_PER_WORKER = int(os.getenv("EXPORT_PARTS_PER_WORKER", 4))
+EXPORT_COMPRESSLEVEL = int(os.getenv("EXPORT_COMPRESSLEVEL", 6))
+
+EXPORT_COLUMNS = [
+    column for column in models.Account.__table__.columns if column.key not in ("password", "hashed_password")
+]
+FORMATS = ("csv", "ndjson")
+MANIFEST = "manifest.json"
+
+
+def encode_csv(rows) -> bytes:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerows(
+        [value.isoformat() if hasattr(value, "isoformat") else value for value in row] for row in rows
+    )
+    return buffer.getvalue().encode()
+
+
+def encode_ndjson(rows) -> bytes:
+    return b"".join(orjson.dumps(row._asdict()) + b"\n" for row in rows)
+
+
+ENCODERS = {"csv": encode_csv, "ndjson": encode_ndjson}
+
+
+def split_key_ranges(lowest: Optional[int], highest: Optional[int], parts: int) -> list:
+    """``parts`` (after, until] id ranges of equal width covering ``lowest`` to ``highest``."""
+    if lowest is None:
+        return []
+    width = -(-(highest - lowest + 1) // parts)
+    return [
+        (after, min(after + width, highest)) for after in range(lowest - 1, highest, width)
+    ]
+
+
+def part_path(output_dir: str, index: int, fmt: str, compresslevel: int) -> str:
+    suffix = ".gz" if compresslevel else ""
+    return os.path.join(output_dir, f"accounts-{index:04d}.{fmt}{suffix}")
+
+
+def read_progress(path: str, after: int) -> dict:
+    try:
+        with open(f"{path}.progress") as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return {"last_id": after, "offset": 0, "rows": 0, "done": False}
+
+
+def write_progress(path: str, progress: dict):
+    # Replaced in one step, so a crash leaves the previous checkpoint rather than half of one
+    with open(f"{path}.progress.tmp", "w") as file:
+        json.dump(progress, file)
+    os.replace(f"{path}.progress.tmp", f"{path}.progress")
+
+
+async def export_part(
+        db_url: str, path: str, after: int, until: int, fmt: str, chunk_size: int, compresslevel: int
+) -> int:
+    """Export the accounts with ids in (``after``, ``until``] to ``path``, from its last checkpoint on.
+
+    Every chunk is written as a gzip member of its own, so the file is a valid
+    gzip stream at each checkpoint; resuming truncates what was written past
+    the last one and appends from there. Returns the rows in the file.
+    """
+    progress = read_progress(path, after)
+    if progress["done"]:
+        return progress["rows"]
+
+    def compress(data: bytes) -> bytes:
+        return gzip.compress(data, compresslevel=compresslevel, mtime=0) if compresslevel else data
+
+    encode = ENCODERS[fmt]
+    session_factory = create_session_factory(to_async_url(db_url), "primary")
+    try:
+        with open(path, "r+b" if progress["offset"] else "wb") as out:
+            out.truncate(progress["offset"])
+            out.seek(progress["offset"])
+            if not progress["offset"] and fmt == "csv":
+                out.write(compress(encode_csv([[column.key for column in EXPORT_COLUMNS]])))
+            async with session_factory() as db:
+                chunks = crud.stream_accounts(
+                    db, chunk_size=chunk_size, after=progress["last_id"], until=until, columns=EXPORT_COLUMNS
+                )
+                async for chunk in chunks:
+                    out.write(compress(encode(chunk)))
+                    out.flush()
+                    # On disk before the checkpoint that points past it
+                    os.fsync(out.fileno())
+                    progress.update(last_id=chunk[-1].id, offset=out.tell(), rows=progress["rows"] + len(chunk))
+                    write_progress(path, progress)
+        progress["done"] = True
+        write_progress(path, progress)
+    finally:
+        await session_factory.kw["bind"].dispose()
+    return progress["rows"]
+
+
+def _export_part(kwargs: dict) -> int:
+    return asyncio.run(export_part(**kwargs))
+
+
+async def _id_bounds(db_url: str) -> tuple:
+    session_factory = create_session_factory(to_async_url(db_url), "primary")
+    try:
+        async with session_factory() as db:
+            return await crud.get_account_id_bounds(db)
+    finally:
+        await session_factory.kw["bind"].dispose()
+
+
+def plan_export(db_url: str, output_dir: str, fmt: str, parts: int, compresslevel: int, resume: bool) -> dict:
+    """The manifest of the export: a resumed export keeps the key ranges and format it started with."""
+    manifest_path = os.path.join(output_dir, MANIFEST)
+    if resume and os.path.exists(manifest_path):
+        with open(manifest_path) as file:
+            return json.load(file)
+
+    os.makedirs(output_dir, exist_ok=True)
+    for name in os.listdir(output_dir):
+        if name.startswith("accounts-"):
+            os.remove(os.path.join(output_dir, name))
+    lowest, highest = asyncio.run(_id_bounds(db_url))
+    manifest = {
+        "format": fmt,
+        "compresslevel": compresslevel,
+        "columns": [column.key for column in EXPORT_COLUMNS],
+        "ranges": split_key_ranges(lowest, highest, parts),
+    }
+    with open(manifest_path, "w") as file:
+        json.dump(manifest, file)
+    return manifest
+
+
+def export(
+        db_url: str,
+        output_dir: str,
+        fmt: str = "ndjson",
+        workers: int = EXPORT_WORKERS,
+        parts: Optional[int] = None,
+        chunk_size: int = EXPORT_CHUNK_SIZE,
+        compresslevel: int = EXPORT_COMPRESSLEVEL,
+        resume: bool = False,
+) -> list:
+    """Export the accounts table to one file per key range, returning (path, rows) of every file."""
+    manifest = plan_export(
+        db_url, output_dir, fmt, parts or workers * EXPORT_PARTS_PER_WORKER, compresslevel, resume
+    )
+    tasks = [
+        {
+            "db_url": db_url,
+            "path": part_path(output_dir, index, manifest["format"], manifest["compresslevel"]),
+            "after": after,
+            "until": until,
+            "fmt": manifest["format"],
+            "chunk_size": chunk_size,
+            "compresslevel": manifest["compresslevel"],
+        }
+        for index, (after, until) in enumerate(manifest["ranges"])
+    ]
+    if workers <= 1:
+        rows = [_export_part(task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+            rows = list(pool.map(_export_part, tasks))
+    return [(task["path"], count) for task, count in zip(tasks, rows)]
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("output_dir", help="directory receiving the part files and the manifest")
+    parser.add_argument("--format", choices=FORMATS, default="ndjson")
+    parser.add_argument("--workers", type=int, default=EXPORT_WORKERS, help="processes exporting key ranges")
+    parser.add_argument("--parts", type=int, default=None,
+                        help=f"key ranges to split the table into, {EXPORT_PARTS_PER_WORKER} per worker by default")
+    parser.add_argument("--chunk-size", type=int, default=EXPORT_CHUNK_SIZE, help="rows fetched per round trip")
+    parser.add_argument("--compresslevel", type=int, choices=range(10), default=EXPORT_COMPRESSLEVEL,
+                        help="gzip level, 0 writes uncompressed files")
+    parser.add_argument("--resume", action="store_true",
+                        help="carry on the export in output_dir from the last exported id of every part")
+    parser.add_argument("--db-url", default=ASYNC_SQLALCHEMY_DATABASE_URI or SQLALCHEMY_DATABASE_URI)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    started = time.perf_counter()
+    files = export(
+        args.db_url,
+        args.output_dir,
+        fmt=args.format,
+        workers=args.workers,
+        parts=args.parts,
+        chunk_size=args.chunk_size,
+        compresslevel=args.compresslevel,
+        resume=args.resume,
+    )
+    for path, rows in files:
+        print(f"{path}: {rows} rows")
+    total = sum(rows for _, rows in files)
+    elapsed = time.perf_counter() - started
+    print(f"{total} rows in {elapsed:.1f} s ({total / elapsed if elapsed else 0:.0f} rows/s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,24 +1,169 @@
 from fastapi import APIRouter, HTTPException
 from fastapi.responses import RedirectResponse
 from fastapi.security import OAuth2AuthorizationCodeBearer
-import httpx
-from dotenv import load_dotenv
+import math
 import os
+import time
+from typing import TYPE_CHECKING, Optional
 
-load_dotenv()
+if TYPE_CHECKING:
+    # httpx is only imported with the first GitHub call, it is a large share of the app's import time
+    import httpx
 
 GITHUB_CLIENT_ID = os.getenv("GITHUB_CLIENT_ID")
 GITHUB_CLIENT_SECRET = os.getenv("GITHUB_CLIENT_SECRET")
 REDIRECT_URI = "http://localhost:8000/auth/callback"
 
+GITHUB_TOKEN_URL = "https://github.com/login/oauth/access_token"
+GITHUB_USER_URL = "https://api.github.com/user"
+
+# Per-call limits of the shared GitHub client, in seconds
+GITHUB_CONNECT_TIMEOUT = float(os.getenv("GITHUB_CONNECT_TIMEOUT", 2))
+GITHUB_TIMEOUT = float(os.getenv("GITHUB_TIMEOUT", 5))
+# Connection attempts retried after a failed connect, requests themselves are never resent
+GITHUB_CONNECT_RETRIES = int(os.getenv("GITHUB_CONNECT_RETRIES", 1))
+GITHUB_MAX_CONNECTIONS = int(os.getenv("GITHUB_MAX_CONNECTIONS", 20))
+GITHUB_KEEPALIVE_EXPIRY = float(os.getenv("GITHUB_KEEPALIVE_EXPIRY", 30))
+# Consecutive failures that open the circuit, and how long it stays open
+GITHUB_BREAKER_FAILURES = int(os.getenv("GITHUB_BREAKER_FAILURES", 5))
+GITHUB_BREAKER_RESET = float(os.getenv("GITHUB_BREAKER_RESET", 30))
+
 router = APIRouter()
 
 oauth2_scheme = OAuth2AuthorizationCodeBearer(
     authorizationUrl="https://github.com/login/oauth/authorize",
-    tokenUrl="https://github.com/login/oauth/access_token"
+    tokenUrl=GITHUB_TOKEN_URL
 )
 
 
+class GitHubUnavailable(Exception):
+    """Raised when GitHub fails, times out, or the circuit breaker is open."""
+
+    def __init__(self, detail: str, retry_after: float):
+        super().__init__(detail)
+        self.retry_after = max(math.ceil(retry_after), 1)
+
+
+class CircuitBreaker:
+    """Opens after ``failure_threshold`` consecutive failures and rejects calls for ``reset_timeout`` seconds.
+
+    Once the timeout has passed a single trial call is let through; its
+    success closes the circuit again and its failure re-opens it.
+    """
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._trial_running = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def retry_after(self) -> float:
+        if self.opened_at is None:
+            return 0
+        return max(self.reset_timeout - (time.monotonic() - self.opened_at), 0)
+
+    def before_call(self):
+        state = self.state
+        if state == "open" or (state == "half-open" and self._trial_running):
+            raise GitHubUnavailable("GitHub is unavailable", retry_after=self.retry_after())
+        if state == "half-open":
+            self._trial_running = True
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self._trial_running = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self._trial_running or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+        self._trial_running = False
+
+    def release_trial(self):
+        """Give up a half-open trial that ended without an answer from GitHub, neither closing nor re-opening."""
+        self._trial_running = False
+
+
+class GitHubClient:
+    """GitHub OAuth client sharing one pooled ``httpx.AsyncClient`` for the lifetime of the app."""
+
+    def __init__(self, transport: Optional["httpx.AsyncBaseTransport"] = None,
+                 breaker: Optional[CircuitBreaker] = None):
+        self.transport = transport
+        self.breaker = breaker or CircuitBreaker(GITHUB_BREAKER_FAILURES, GITHUB_BREAKER_RESET)
+        self._client: Optional["httpx.AsyncClient"] = None
+
+    def _get_client(self) -> "httpx.AsyncClient":
+        if self._client is None:
+            import httpx
+
+            limits = httpx.Limits(
+                max_connections=GITHUB_MAX_CONNECTIONS,
+                max_keepalive_connections=GITHUB_MAX_CONNECTIONS,
+                keepalive_expiry=GITHUB_KEEPALIVE_EXPIRY,
+            )
+            transport = self.transport or httpx.AsyncHTTPTransport(limits=limits, retries=GITHUB_CONNECT_RETRIES)
+            self._client = httpx.AsyncClient(
+                transport=transport,
+                timeout=httpx.Timeout(GITHUB_TIMEOUT, connect=GITHUB_CONNECT_TIMEOUT, pool=GITHUB_CONNECT_TIMEOUT),
+                headers={"Accept": "application/json"},
+            )
+        return self._client
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def _request(self, method: str, url: str, **kwargs) -> "httpx.Response":
+        """Send a request through the circuit breaker; timeouts, transport errors and 5xx count as failures."""
+        import httpx
+
+        self.breaker.before_call()
+        try:
+            response = await self._get_client().request(method, url, **kwargs)
+        except httpx.TransportError:
+            self.breaker.record_failure()
+            raise GitHubUnavailable("GitHub did not respond", retry_after=self.breaker.retry_after())
+        except BaseException:
+            # e.g. a cancelled request, which says nothing about GitHub but must not leave the trial pending forever
+            self.breaker.release_trial()
+            raise
+        if response.status_code >= 500:
+            self.breaker.record_failure()
+            raise GitHubUnavailable(f"GitHub answered {response.status_code}",
+                                    retry_after=self.breaker.retry_after())
+        self.breaker.record_success()
+        return response
+
+    async def exchange_code(self, code: str) -> Optional[str]:
+        response = await self._request("POST", GITHUB_TOKEN_URL, data={
+            "client_id": GITHUB_CLIENT_ID,
+            "client_secret": GITHUB_CLIENT_SECRET,
+            "code": code,
+            "redirect_uri": REDIRECT_URI,
+        })
+        return response.json().get("access_token")
+
+    async def get_user(self, access_token: str) -> dict:
+        # Not cached: every callback exchanges its code for a new access token, which would never be seen again
+        response = await self._request("GET", GITHUB_USER_URL, headers={"Authorization": f"Bearer {access_token}"})
+        return response.json()
+
+
+github = GitHubClient()
+
+
 @router.get("/login")
 async def github_login():
     github_url = (
@@ -32,29 +177,15 @@ async def github_login():
 
 @router.get("/auth/callback")
 async def github_auth_callback(code: str):
-    async with httpx.AsyncClient() as client:
+    try:
         # Exchange authorization code for an access token
-        token_response = await client.post(
-            "https://github.com/login/oauth/access_token",
-            headers={"Accept": "application/json"},
-            data={
-                "client_id": GITHUB_CLIENT_ID,
-                "client_secret": GITHUB_CLIENT_SECRET,
-                "code": code,
-                "redirect_uri": REDIRECT_URI,
-            }
-        )
-        token_data = token_response.json()
-        access_token = token_data.get("access_token")
-
+        access_token = await github.exchange_code(code)
         if not access_token:
             raise HTTPException(status_code=400, detail="Failed to retrieve access token")
 
         # Retrieve user information using the access token
-        user_info_response = await client.get(
-            "https://api.github.com/user",
-            headers={"Authorization": f"Bearer {access_token}"}
-        )
-        user_info = user_info_response.json()
+        user_info = await github.get_user(access_token)
+    except GitHubUnavailable as exc:
+        raise HTTPException(status_code=503, detail=str(exc), headers={"Retry-After": str(exc.retry_after)})
 
-        return {"user_info": user_info}
+    return {"user_info": user_info}
@@ -0,0 +1,115 @@
+import asyncio
+import os
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Optional
+
+from . import auth, metrics
+
+# bcrypt releases the GIL, so a thread pool already scales with the cores;
+# "process" is available for hosts where that is not the case.
+PASSWORD_HASH_POOL = os.getenv("PASSWORD_HASH_POOL", "thread")
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", os.cpu_count() or 1))
+PASSWORD_HASH_QUEUE_SIZE = int(os.getenv("PASSWORD_HASH_QUEUE_SIZE", 64))
+PASSWORD_HASH_QUEUE_TIMEOUT = float(os.getenv("PASSWORD_HASH_QUEUE_TIMEOUT", 5))
+
+
+def timed_call(fn, *args) -> tuple:
+    """Run ``fn`` in the pool and return its result with the seconds it took there, queueing excluded."""
+    started = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - started
+
+
+class HashingOverloaded(Exception):
+    """Raised when a hashing job could not get a pool slot within the queue timeout."""
+
+
+class PasswordHasher:
+    """Runs bcrypt hashing and verification on a dedicated, bounded pool.
+
+    At most ``workers + queue_size`` jobs are handed to the pool at once;
+    further callers wait up to ``queue_timeout`` seconds for a slot and then
+    get ``HashingOverloaded`` instead of piling up behind the pool.
+    """
+
+    def __init__(self, workers: int, pool: str = "thread", queue_size: int = 64, queue_timeout: float = 5.0):
+        if pool not in ("thread", "process"):
+            raise ValueError(f"Unknown password hash pool type: {pool}")
+        self.workers = workers
+        self.pool = pool
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        self._executor: Optional[Executor] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._slots_loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            if self.pool == "process":
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="bcrypt")
+        return self._executor
+
+    def _get_slots(self) -> asyncio.Semaphore:
+        # asyncio primitives are bound to the loop they are first used on
+        loop = asyncio.get_running_loop()
+        if self._slots is None or self._slots_loop is not loop:
+            self._slots = asyncio.Semaphore(self.workers + self.queue_size)
+            self._slots_loop = loop
+        return self._slots
+
+    async def _run(self, operation: str, fn, *args):
+        slots = self._get_slots()
+        try:
+            await asyncio.wait_for(slots.acquire(), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            raise HashingOverloaded(f"No password hashing slot available within {self.queue_timeout}s")
+        self.in_flight += 1
+        try:
+            result, seconds = await asyncio.get_running_loop().run_in_executor(
+                self._get_executor(), timed_call, fn, *args
+            )
+        finally:
+            self.in_flight -= 1
+            slots.release()
+        metrics.PASSWORD_HASH_SECONDS.observe(seconds, operation)
+        return result
+
+    async def hash(self, password: str) -> str:
+        return await self._run("hash", auth.get_password_hash, password)
+
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        return await self._run("verify", auth.verify_password, plain_password, hashed_password)
+
+    async def hash_many(self, passwords: list) -> list:
+        """Hash passwords in parallel, with at most ``workers`` of them admitted at once.
+
+        Leaves the rest of the queue to interactive requests. Failed jobs are
+        returned as their exception instead of a hash.
+        """
+        limit = asyncio.Semaphore(self.workers)
+
+        async def hash_one(password):
+            async with limit:
+                return await self.hash(password)
+
+        return await asyncio.gather(*(hash_one(password) for password in passwords), return_exceptions=True)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+
+hasher = PasswordHasher(
+    workers=PASSWORD_HASH_WORKERS,
+    pool=PASSWORD_HASH_POOL,
+    queue_size=PASSWORD_HASH_QUEUE_SIZE,
+    queue_timeout=PASSWORD_HASH_QUEUE_TIMEOUT,
+)
+
+metrics.Gauge("password_hash_jobs_in_flight", "Password hashing jobs queued or running in the pool.",
+              function=lambda: hasher.in_flight)
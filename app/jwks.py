@@ -0,0 +1,104 @@
+"""Verify access tokens locally against the keys this service publishes.
+
+Other services verify tokens without calling back into this one: the key set
+is fetched from ``/.well-known/jwks.json`` once, kept for the ``max-age`` it
+is served with, and refetched early only when a token names an unknown
+``kid`` (a key rotation), at most once per ``min_refresh_interval``.
+
+    verifier = JWKSVerifier("https://accounts.internal/.well-known/jwks.json")
+    claims = await verifier.verify(token)  # raises jose.JWTError if the token is not valid
+
+It depends on python-jose and httpx only, so it can be copied into services
+that do not install this app.
+"""
+import asyncio
+import logging
+import re
+import time
+from typing import Optional
+
+import httpx
+from jose import JWTError, jwk, jwt
+
+DEFAULT_MAX_AGE = 300
+MIN_REFRESH_INTERVAL = 30
+
+logger = logging.getLogger(__name__)
+
+
+def parse_max_age(cache_control: Optional[str], default: float) -> float:
+    match = re.search(r"max-age=(\d+)", cache_control or "")
+    return float(match.group(1)) if match else default
+
+
+class JWKSVerifier:
+    """Verifies tokens with a cached copy of a JWKS, refetched when it goes stale or a new ``kid`` shows up."""
+
+    def __init__(
+            self,
+            url: str,
+            default_max_age: float = DEFAULT_MAX_AGE,
+            min_refresh_interval: float = MIN_REFRESH_INTERVAL,
+            timeout: float = 5,
+            transport: Optional[httpx.AsyncBaseTransport] = None,
+    ):
+        self.url = url
+        self.default_max_age = default_max_age
+        self.min_refresh_interval = min_refresh_interval
+        self._client = httpx.AsyncClient(timeout=timeout, transport=transport)
+        self._keys: dict = {}
+        self._expires_at = 0.0
+        self._fetched_at = float("-inf")
+        # Created in the event loop that uses it
+        self._lock: Optional[asyncio.Lock] = None
+
+    async def aclose(self):
+        await self._client.aclose()
+
+    async def refresh(self):
+        """Fetch the key set, keeping the current one if the fetch fails."""
+        self._fetched_at = time.monotonic()
+        try:
+            response = await self._client.get(self.url)
+            response.raise_for_status()
+            keys = {}
+            for key in response.json()["keys"]:
+                keys[key["kid"]] = (jwk.construct(key, key["alg"]), key["alg"])
+        except (httpx.HTTPError, ValueError, KeyError, JWTError):
+            if not self._keys:
+                raise
+            # Serve the stale keys rather than reject every token while the issuer is unreachable
+            logger.warning("Could not refresh the JWKS from %s, keeping the cached keys", self.url, exc_info=True)
+            self._expires_at = self._fetched_at + self.min_refresh_interval
+            return
+        self._keys = keys
+        max_age = parse_max_age(response.headers.get("Cache-Control"), self.default_max_age)
+        self._expires_at = self._fetched_at + max_age
+
+    def _needs_refresh(self, kid: Optional[str]) -> bool:
+        now = time.monotonic()
+        if now >= self._expires_at:
+            return True
+        return kid not in self._keys and now - self._fetched_at >= self.min_refresh_interval
+
+    async def get_key(self, kid: Optional[str]) -> Optional[tuple]:
+        if self._needs_refresh(kid):
+            if self._lock is None:
+                self._lock = asyncio.Lock()
+            async with self._lock:
+                # Another request may have refreshed it while this one waited
+                if self._needs_refresh(kid):
+                    await self.refresh()
+        return self._keys.get(kid)
+
+    async def verify(self, token: str, **options) -> dict:
+        """Claims of a valid token; ``options`` are passed on to ``jwt.decode``, e.g. ``audience``.
+
+        Raises ``JWTError`` for an invalid token, and ``httpx.HTTPError`` if the
+        key set could never be fetched.
+        """
+        key = await self.get_key(jwt.get_unverified_header(token).get("kid"))
+        if key is None:
+            raise JWTError("Unknown signing key")
+        public_key, algorithm = key
+        return jwt.decode(token, public_key, algorithms=[algorithm], **options)
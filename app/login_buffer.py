@@ -0,0 +1,103 @@
+import asyncio
+import logging
+import os
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from . import crud, metrics
+from .database import get_session_factory
+
+LAST_LOGIN_FLUSH_INTERVAL = float(os.getenv("LAST_LOGIN_FLUSH_INTERVAL", 5))
+LAST_LOGIN_BUFFER_SIZE = int(os.getenv("LAST_LOGIN_BUFFER_SIZE", 1000))
+
+logger = logging.getLogger(__name__)
+
+
+class LastLoginBuffer:
+    """Write-behind buffer of last login dates.
+
+    Logins are collected in memory as {email: datetime} and written with a
+    single bulk UPDATE every ``flush_interval`` seconds, as soon as
+    ``max_size`` emails are pending, and once more on shutdown.
+    """
+
+    def __init__(self, session_factory: Optional[async_sessionmaker], flush_interval: float, max_size: int):
+        self.session_factory = session_factory
+        self.flush_interval = flush_interval
+        self.max_size = max_size
+        self._pending: dict = {}
+        self._lock: Optional[asyncio.Lock] = None
+        self._flusher: Optional[asyncio.Task] = None
+        self._tasks: set = set()
+
+    @property
+    def depth(self) -> int:
+        return len(self._pending)
+
+    def add(self, email: str, login_date: Optional[datetime] = None):
+        """Buffer a login of ``email``, which has to be spelled as stored so the flush uncaches the right entry."""
+        self._pending[email] = login_date or datetime.now()
+        if len(self._pending) >= self.max_size:
+            task = asyncio.get_running_loop().create_task(self.flush())
+            self._tasks.add(task)
+            task.add_done_callback(self._flushed)
+
+    def _flushed(self, task: asyncio.Task):
+        # Nobody awaits a size-triggered flush, its failure would otherwise go unnoticed
+        self._tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error("Failed to flush %d last login dates", self.depth, exc_info=task.exception())
+
+    async def flush(self) -> int:
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            pending, self._pending = self._pending, {}
+            if not pending:
+                return 0
+            try:
+                # Without a session factory of its own, the buffer writes to the primary database
+                session_factory = self.session_factory or get_session_factory()
+                async with session_factory() as db:
+                    await crud.set_last_login_dates(db, pending)
+            except Exception:
+                # Keep the logins for the next flush, without overwriting newer ones
+                self._pending = {**pending, **self._pending}
+                raise
+            return len(pending)
+
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Failed to flush %d last login dates", self.depth)
+
+    def start(self):
+        if self._flusher is None:
+            self._lock = asyncio.Lock()
+            self._flusher = asyncio.get_running_loop().create_task(self._flush_periodically())
+
+    async def stop(self):
+        if self._flusher is not None:
+            self._flusher.cancel()
+            try:
+                await self._flusher
+            except asyncio.CancelledError:
+                pass
+            self._flusher = None
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        await self.flush()
+
+
+last_login_buffer = LastLoginBuffer(
+    None,
+    flush_interval=LAST_LOGIN_FLUSH_INTERVAL,
+    max_size=LAST_LOGIN_BUFFER_SIZE,
+)
+metrics.Gauge("last_login_buffer_depth", "Logins waiting to be written to the database.",
+              function=lambda: last_login_buffer.depth)
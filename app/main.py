@@ -1,90 +1,404 @@
+import asyncio
+import logging
+import os
+from contextlib import asynccontextmanager
 from datetime import timedelta
-from sqlalchemy.orm import Session
-from fastapi import FastAPI, Depends, HTTPException, status, Form
+from typing import Optional
+from sqlalchemy import text
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+from fastapi import (
+    FastAPI, BackgroundTasks, Depends, File, HTTPException, Query, Request, Response, UploadFile, status, Form
+)
+from fastapi.responses import JSONResponse, ORJSONResponse, StreamingResponse
 from fastapi.security import OAuth2PasswordRequestForm
 
-from .database import engine, get_db
-from . import crud, models, schemas, auth
-from .git_auth import router as auth_app
+from .database import (
+    DB_CHECK_MIGRATIONS, check_migrations, dispose_router, get_router, get_db, get_read_db, get_read_session_factory,
+    get_session_factory,
+)
+from . import bulk, change_feed, conditional, crud, models, schemas, auth, hashing, metrics
+from .login_buffer import last_login_buffer
+from .refresh_tokens import REFRESHED_TOKENS, REUSED_REFRESH_TOKENS, refresh_token_purger
+from .throttle import login_throttle
+from .git_auth import github, router as auth_app
 
-models.Base.metadata.create_all(bind=engine)
+logger = logging.getLogger(__name__)
 
-app = FastAPI()
+READINESS_TIMEOUT = float(os.getenv("READINESS_TIMEOUT", 2))
+# Keys accepted by one /accounts/batch request
+ACCOUNT_BATCH_MAX = int(os.getenv("ACCOUNT_BATCH_MAX", 1000))
+# Page size of /accounts/ when a cursor is given without a limit
+ACCOUNTS_PAGE_SIZE = 100
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Engines are created here rather than at import, and nothing connects before the optional schema check
+    db_router = get_router()
+    if DB_CHECK_MIGRATIONS:
+        await check_migrations(db_router.write_sessions())
+    # A missing or unsupported signing key fails the startup rather than the first login
+    auth.get_key_set()
+    if auth.BCRYPT_CALIBRATE_ON_STARTUP and not auth.BCRYPT_ROUNDS:
+        # Only a lone process gets here, app.serve calibrates once and pins BCRYPT_ROUNDS for its workers.
+        # Before the first hashing job, so forked process pool workers inherit the cost too
+        rounds = await asyncio.to_thread(auth.calibrate_bcrypt_rounds, auth.BCRYPT_TARGET_MS)
+        auth.set_bcrypt_rounds(rounds)
+    last_login_buffer.start()
+    refresh_token_purger.start()
+    change_feed.change_feed.start()
+    yield
+    await change_feed.change_feed.stop()
+    await refresh_token_purger.stop()
+    await last_login_buffer.stop()
+    # Waiting for the in-flight bcrypt jobs off the event loop, which keeps serving the rest of the shutdown
+    await asyncio.to_thread(hashing.hasher.shutdown)
+    await github.aclose()
+    await dispose_router()
+
+
+app = FastAPI(lifespan=lifespan)
 app.include_router(auth_app)
+app.add_middleware(metrics.PrometheusMiddleware, routes=app.routes)
+
+
+@app.exception_handler(hashing.HashingOverloaded)
+async def hashing_overloaded_handler(request: Request, exc: hashing.HashingOverloaded):
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"detail": "Server is busy, please retry"},
+        headers={"Retry-After": "1"},
+    )
+
+
+@app.get("/healthz", include_in_schema=False)
+async def health():
+    """Liveness: the worker's event loop is serving requests."""
+    return {"status": "ok", "pid": os.getpid()}
+
+
+@app.get("/readyz", include_in_schema=False)
+async def readiness(db: AsyncSession = Depends(get_db)):
+    """Readiness: startup has finished and the primary database answers."""
+    try:
+        await asyncio.wait_for(db.execute(text("SELECT 1")), timeout=READINESS_TIMEOUT)
+    except (SQLAlchemyError, OSError, asyncio.TimeoutError):
+        return JSONResponse(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, content={"status": "unavailable"})
+    return {"status": "ready"}
+
+
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    return Response(content=metrics.REGISTRY.render(), media_type=metrics.CONTENT_TYPE)
+
+
+@app.get("/.well-known/jwks.json", include_in_schema=False)
+async def jwks(request: Request):
+    """Public keys verifying access tokens, so other services can check them without calling this one."""
+    key_set = auth.get_key_set()
+    headers = {"Cache-Control": f"public, max-age={auth.JWKS_MAX_AGE}", "ETag": key_set.etag}
+    if conditional.is_not_modified(request, key_set.etag, None):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(content=key_set.document, media_type="application/json", headers=headers)
+
+
+async def rehash_password(session_factory: async_sessionmaker, account: models.Account, password: str):
+    try:
+        async with session_factory() as db:
+            await crud.rehash_password(db, account, password)
+    except hashing.HashingOverloaded:
+        logger.warning("Skipped rehashing the password of account %s, the hashing pool is busy", account.id)
 
 
 @app.post("/token", response_model=schemas.LoginResponse)
 async def authorization(
-        form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)
+        request: Request,
+        background_tasks: BackgroundTasks,
+        form_data: OAuth2PasswordRequestForm = Depends(),
+        db: AsyncSession = Depends(get_db),
+        session_factory: async_sessionmaker = Depends(get_session_factory),
 ):
-    account = crud.get_account_by_email(db, email=form_data.username)
-    if not account or not auth.verify_password(form_data.password, account.hashed_password):
+    client_ip = request.client.host if request.client else "unknown"
+    # Counted before the account lookup and bcrypt, so throttled attempts cost next to nothing
+    retry_after, window_index = await login_throttle.reserve(form_data.username, client_ip)
+    if retry_after:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many failed login attempts, please retry later",
+            headers={"Retry-After": str(retry_after)},
+        )
+
+    try:
+        account = await crud.get_account_by_email(db, email=form_data.username)
+        verified = account is not None and await hashing.hasher.verify(form_data.password, account.hashed_password)
+    except Exception:
+        # The password was never checked (the hashing pool is busy or the lookup failed), the client is told to retry
+        await login_throttle.refund(form_data.username, client_ip, window_index)
+        raise
+    if not verified:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect email or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
 
+    await login_throttle.refund(form_data.username, client_ip, window_index)
     access_token_expires = timedelta(minutes=auth.ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = auth.create_access_token(
         data={"sub": form_data.username}, expires_delta=access_token_expires
     )
+    refresh_token = await crud.create_refresh_token(db, account.id)
+
+    # As stored: a case-insensitive collation matches the typed spelling, but the cache is keyed by the stored one
+    last_login_buffer.add(account.email)
+    if auth.password_needs_rehash(account.hashed_password):
+        # After the response is sent; the next login retries if it does not happen
+        background_tasks.add_task(rehash_password, session_factory, account, form_data.password)
+    return {"access_token": access_token, "token_type": "bearer", "refresh_token": refresh_token}
+
+
+@app.post("/token/refresh", response_model=schemas.LoginResponse)
+async def refresh_authorization(
+        refresh_token: str = Form(..., description="refresh token of the previous /token or /token/refresh"),
+        db: AsyncSession = Depends(get_db),
+):
+    # No password and no bcrypt: the opaque token is looked up by its digest and rotated
+    invalid = HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Invalid refresh token",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+    try:
+        rotated = await crud.rotate_refresh_token(db, refresh_token)
+    except crud.RefreshTokenReused as exc:
+        REUSED_REFRESH_TOKENS.inc()
+        logger.warning("Refresh token of family %s reused, revoked the family", exc)
+        raise invalid
+    if rotated is None:
+        raise invalid
+
+    email, new_refresh_token = rotated
+    REFRESHED_TOKENS.inc()
+    access_token = auth.create_access_token(
+        data={"sub": email}, expires_delta=timedelta(minutes=auth.ACCESS_TOKEN_EXPIRE_MINUTES)
+    )
+    return {"access_token": access_token, "token_type": "bearer", "refresh_token": new_refresh_token}
 
-    crud.set_last_login_date(db, email=form_data.username)
-    return {"access_token": access_token, "token_type": "bearer"}
+
+@app.post("/logout", status_code=status.HTTP_204_NO_CONTENT)
+async def logout(
+        refresh_token: Optional[str] = Form(None, description="refresh token to revoke along with the access token"),
+        token: str = Depends(auth.oauth2_scheme),
+        db: AsyncSession = Depends(get_db),
+        current_account: dict = Depends(auth.get_current_account)
+):
+    await auth.revoke_token(token)
+    if refresh_token:
+        await crud.revoke_refresh_token(db, refresh_token)
 
 
 @app.post("/register/", response_model=schemas.AccountResponse)
-def register(
+async def register(
         name: str = Form(..., description="insert new account name"),
         email: str = Form(..., description="insert new account email"),
         password: str = Form(..., description="insert new account password"),
-        db: Session = Depends(get_db)
+        db: AsyncSession = Depends(get_db)
 ):
-    db_account = crud.get_account_by_email(db, email=email)
-    if db_account:
-        raise HTTPException(status_code=400, detail="Email already registered")
-
     if not crud.check_email(email):
         raise HTTPException(status_code=400, detail="Email is not valid")
 
     account = schemas.AccountRegister(name=name, email=email, password=password)
-    return crud.create_account(db=db, account=account)
+    try:
+        return await crud.create_account(db=db, account=account)
+    except IntegrityError:
+        raise HTTPException(status_code=400, detail="Email already registered")
+
+
+@app.post("/register/bulk", response_model=schemas.BulkRegisterResponse)
+async def register_bulk(
+        file: UploadFile = File(..., description="NDJSON or CSV file of accounts with name, email and password"),
+        file_format: Optional[str] = Query(
+            None, alias="format", pattern="^(ndjson|csv)$", description="defaults to the file type of the upload"
+        ),
+        db: AsyncSession = Depends(get_db),
+        current_account: dict = Depends(auth.get_current_account)
+):
+    if file_format is None:
+        is_csv = (file.filename or "").endswith(".csv") or file.content_type == "text/csv"
+        file_format = "csv" if is_csv else "ndjson"
+
+    try:
+        return await bulk.register_accounts(db, file, file_format)
+    except bulk.InvalidUpload as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
 
 
 @app.get("/accounts/", response_model=list[schemas.AccountResponse])
-def get_accounts(
-        db: Session = Depends(get_db),
+async def get_accounts(
+        request: Request,
+        limit: Optional[int] = Query(None, ge=1, le=1000, description="maximum number of accounts to return, "
+                                     "every account unless limit or after is given"),
+        after: Optional[int] = Query(None, description="return accounts with an id greater than this cursor"),
+        db: AsyncSession = Depends(get_read_db),
+        current_account: dict = Depends(auth.get_current_account)
+):
+    # Paging is opt-in, clients that never sent limit or after keep getting every account
+    if limit is None and after is not None:
+        limit = ACCOUNTS_PAGE_SIZE
+    # Validated from one aggregate row, so an unchanged page is answered without reading its rows.
+    # No Last-Modified: the latest updated_at of a page goes back when its newest row is deleted
+    count, last_id, updated_at = await crud.get_account_projections_version(db, limit=limit, after=after)
+    headers = conditional.validator_headers(conditional.make_etag(count, last_id, updated_at), None)
+    if conditional.is_not_modified(request, headers["ETag"], None):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    # Rows are already in the response shape, so they skip the ORM, response_model validation and stdlib json
+    accounts = await crud.get_account_projections(db, limit=limit, after=after)
+    if limit is not None and len(accounts) == limit:
+        headers["X-Next-Cursor"] = str(accounts[-1]["id"])
+    return ORJSONResponse(accounts, headers=headers)
+
+
+@app.post("/accounts/batch", response_model=schemas.AccountBatchResponse)
+async def get_accounts_batch(
+        lookup: schemas.AccountBatchLookup,
+        db: AsyncSession = Depends(get_read_db),
         current_account: dict = Depends(auth.get_current_account)
 ):
-    return crud.get_accounts(db)
+    keys = lookup.ids if lookup.ids is not None else lookup.emails
+    if len(keys) > ACCOUNT_BATCH_MAX:
+        raise HTTPException(status_code=400, detail=f"At most {ACCOUNT_BATCH_MAX} keys per request")
+
+    # One IN (...) query instead of a round trip per account, in the order of the keys
+    if lookup.ids is not None:
+        accounts = await crud.get_account_projections_by_ids(db, keys)
+    else:
+        accounts = await crud.get_account_projections_by_emails(db, keys)
+    return ORJSONResponse({
+        "accounts": [account for account in accounts if account is not None],
+        "missing": [key for key, account in zip(keys, accounts) if account is None],
+    })
+
+
+@app.get("/accounts/search", response_model=list[schemas.AccountResponse])
+async def search_accounts(
+        response: Response,
+        search: schemas.AccountSearch = Depends(),
+        limit: int = Query(100, ge=1, le=1000, description="maximum number of accounts to return"),
+        after: Optional[str] = Query(None, description="X-Next-Cursor of the previous page"),
+        db: AsyncSession = Depends(get_read_db),
+        current_account: dict = Depends(auth.get_current_account)
+):
+    try:
+        cursor = crud.decode_search_cursor(after, search.sort) if after else None
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+
+    accounts = await crud.search_accounts(db, search, limit=limit, after=cursor)
+    if len(accounts) == limit:
+        response.headers["X-Next-Cursor"] = crud.encode_search_cursor(accounts[-1], search.sort)
+    return accounts
+
+
+@app.get("/accounts/stream")
+async def stream_accounts(
+        chunk_size: int = Query(1000, ge=1, le=10000, description="number of rows fetched per round trip"),
+        session_factory: async_sessionmaker = Depends(get_read_session_factory),
+        current_account: dict = Depends(auth.get_current_account)
+):
+    async def ndjson_lines():
+        async with session_factory() as db:
+            async for chunk in crud.stream_accounts(db, chunk_size=chunk_size):
+                yield "".join(
+                    schemas.AccountResponse.model_validate(row._asdict()).model_dump_json() + "\n" for row in chunk
+                )
+
+    return StreamingResponse(ndjson_lines(), media_type="application/x-ndjson")
+
+
+@app.post("/accounts/deactivate", response_model=schemas.BulkUpdateResponse)
+async def deactivate_accounts(
+        search: schemas.AccountSearch = Depends(),
+        db: AsyncSession = Depends(get_db),
+        current_account: dict = Depends(auth.get_current_account)
+):
+    # Refuses to deactivate every account by omission
+    if not crud.account_filters(search):
+        raise HTTPException(status_code=400, detail="At least one filter is required")
+    return {"updated": await crud.set_accounts_active(db, search, is_active=False)}
+
+
+@app.get("/accounts/changes")
+async def get_account_changes(
+        since: Optional[int] = Query(None, description="cursor of the previous batch, omit to start from the oldest"),
+        limit: int = Query(1000, ge=1, le=10000, description="maximum number of changes to return"),
+        session_factory: async_sessionmaker = Depends(get_read_session_factory),
+        current_account: dict = Depends(auth.get_current_account)
+):
+    try:
+        changes = await change_feed.read_changes(session_factory, since, limit)
+    except change_feed.CursorExpired:
+        raise HTTPException(
+            status_code=status.HTTP_410_GONE,
+            detail="The cursor is older than the retained changes, resync from /accounts/",
+        )
+    cursor = changes[-1]["id"] if changes else since
+    return ORJSONResponse({"changes": changes, "cursor": cursor, "has_more": len(changes) == limit})
+
+
+@app.get("/accounts/changes/stream")
+async def stream_account_changes(
+        request: Request,
+        since: Optional[int] = Query(None, description="cursor to start after, defaults to the Last-Event-ID header"),
+        limit: int = Query(1000, ge=1, le=10000, description="maximum number of changes read per round trip"),
+        session_factory: async_sessionmaker = Depends(get_read_session_factory),
+        current_account: dict = Depends(auth.get_current_account)
+):
+    last_event_id = request.headers.get("Last-Event-ID")
+    if since is None and last_event_id and last_event_id.isdigit():
+        since = int(last_event_id)
+    return StreamingResponse(
+        change_feed.change_events(change_feed.change_feed, session_factory, since, limit),
+        media_type="text/event-stream",
+        # Proxies must neither cache nor buffer the stream
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
 @app.get("/account/{id}/", response_model=schemas.AccountResponse)
-def get_account(
-        acc_id: int, db: Session = Depends(get_db),
+async def get_account(
+        request: Request,
+        acc_id: int, db: AsyncSession = Depends(get_read_db),
         current_account: dict = Depends(auth.get_current_account)
 ):
-    db_account = crud.get_account_by_id(db, acc_id=acc_id)
-    if db_account is None:
+    updated_at = await crud.get_account_updated_at(db, acc_id=acc_id)
+    if updated_at is None:
         raise HTTPException(status_code=404, detail="Account not found")
-    return db_account
+    headers = conditional.validator_headers(conditional.make_etag(acc_id, updated_at), updated_at)
+    if conditional.is_not_modified(request, headers["ETag"], updated_at):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    account = await crud.get_account_projection(db, acc_id=acc_id)
+    if account is None:
+        raise HTTPException(status_code=404, detail="Account not found")
+    return ORJSONResponse(account, headers=headers)
 
 
 @app.patch("/account_partial_update", response_model=schemas.AccountResponse)
-def update_partial_account(
+async def update_partial_account(
         email: str = Form(..., description="Account email which account should be updated"),
         name: str = Form(None),
         password: str = Form(None),
         is_active: bool = Form(None),
-        db: Session = Depends(get_db),
+        db: AsyncSession = Depends(get_db),
         current_account: dict = Depends(auth.get_current_account)
 ):
     if not crud.check_email(email):
         raise HTTPException(status_code=400, detail="Email is not valid")
 
     account_update = schemas.AccountPartialUpdate(name=name, email=email, password=password, is_active=is_active)
-    db_account = crud.update_account(db=db, email=email, account_update=account_update)
+    db_account = await crud.update_account(db=db, email=email, account_update=account_update)
 
     if db_account is None:
         raise HTTPException(status_code=404, detail="Account not found")
@@ -93,19 +407,19 @@ def update_partial_account(
 
 
 @app.put("/account_full_update", response_model=schemas.AccountResponse)
-def update_full_account(
+async def update_full_account(
         email: str = Form(..., description="Account email which account should be updated"),
         name: str = Form(...),
         password: str = Form(...),
         is_active: bool = Form(...),
-        db: Session = Depends(get_db),
+        db: AsyncSession = Depends(get_db),
         current_account: dict = Depends(auth.get_current_account)
 ):
     if not crud.check_email(email):
         raise HTTPException(status_code=400, detail="Email is not valid")
 
     account_update = schemas.AccountFullUpdate(name=name, email=email, password=password, is_active=is_active)
-    db_account = crud.update_account(db=db, email=email, account_update=account_update)
+    db_account = await crud.update_account(db=db, email=email, account_update=account_update)
 
     if db_account is None:
         raise HTTPException(status_code=404, detail="Account not found")
@@ -114,12 +428,12 @@ def update_full_account(
 
 
 @app.delete("/account_delete", response_model=schemas.AccountResponse)
-def delete_account(
+async def delete_account(
         email: str = Form(..., description="Account email which account should be deleted"),
-        db: Session = Depends(get_db),
+        db: AsyncSession = Depends(get_db),
         current_account: dict = Depends(auth.get_current_account)
 ):
-    db_account = crud.delete_account(db=db, email=email)
+    db_account = await crud.delete_account(db=db, email=email)
     if db_account is None:
         raise HTTPException(status_code=404, detail="Account not found")
     return db_account
@@ -1,14 +1,87 @@
-from sqlalchemy import Boolean, Column, Integer, String, DateTime, func
+from datetime import datetime
+
+from sqlalchemy import DDL, Boolean, Column, ForeignKey, Integer, String, DateTime, Index, event, func
+from sqlalchemy.dialects import mysql
 from .database import Base
 
+# Microseconds on MySQL too, so that writes within the same second still change the validators derived from it
+PreciseDateTime = DateTime().with_variant(mysql.DATETIME(fsp=6), "mysql", "mariadb")
+
 
 class Account(Base):
     __tablename__ = "accounts"
+    __table_args__ = (
+        # Search filters by is_active and sorts or ranges on one of these columns;
+        # the primary key every index carries serves as the keyset tie-breaker
+        Index("ix_accounts_is_active_created_date", "is_active", "created_date"),
+        Index("ix_accounts_is_active_last_login_date", "is_active", "last_login_date"),
+        Index("ix_accounts_is_active_name", "is_active", "name"),
+    )
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String(255), index=True)
     email = Column(String(length=255), nullable=False, unique=True)
     password = Column(String(length=255), nullable=False)
     hashed_password = Column(String(length=255), nullable=False)
     is_active = Column(Boolean, default=False)
-    created_date = Column(DateTime, default=func.now())
-    last_login_date = Column(DateTime, nullable=True)
+    created_date = Column(DateTime, default=func.now(), index=True)
+    last_login_date = Column(DateTime, nullable=True, index=True)
+    # Set by every write, the ETag and Last-Modified of account reads are derived from it
+    updated_at = Column(PreciseDateTime, default=datetime.now, onupdate=datetime.now, nullable=False)
+
+
+class RefreshToken(Base):
+    """A refresh token, stored by the SHA-256 of its value only.
+
+    Tokens rotated from one login share a ``family_id``; a rotated token is
+    kept, marked ``used_at``, until it expires so that its reuse is detected.
+    """
+    __tablename__ = "refresh_tokens"
+    id = Column(Integer, primary_key=True)
+    token_hash = Column(String(length=64), nullable=False, unique=True)
+    family_id = Column(String(length=32), nullable=False, index=True)
+    account_id = Column(Integer, ForeignKey("accounts.id", ondelete="CASCADE"), nullable=False, index=True)
+    created_date = Column(DateTime, default=func.now(), nullable=False)
+    expires_at = Column(DateTime, nullable=False, index=True)
+    used_at = Column(DateTime, nullable=True)
+
+
+class AccountChange(Base):
+    """Append-only log of account writes, read by the change feed in ``seq`` order.
+
+    Writers only append; ``seq``, the position in the feed, is assigned
+    after they commit (see ``crud.sequence_account_changes``). Rows outlive
+    their account, so there is no foreign key; the feed joins the account's
+    current state at read time.
+    """
+    __tablename__ = "account_changes"
+    id = Column(Integer, primary_key=True)
+    # NULL until sequenced; the unique index also finds the rows still to sequence
+    seq = Column(Integer, nullable=True, unique=True, index=True)
+    account_id = Column(Integer, nullable=False, index=True)
+    operation = Column(String(length=16), nullable=False)
+    email = Column(String(length=255), nullable=False)
+    changed_at = Column(PreciseDateTime, nullable=False, index=True)
+
+
+class AccountChangeLogState(Base):
+    """The single row of change log state.
+
+    ``sequenced_through`` is the last ``seq`` assigned, the high-water mark
+    of the feed; sequencers lock the row while they assign the next ones, so
+    changes get their positions in the order they became visible and a
+    cursor never moves past a change that commits later. Writers never touch
+    it. ``compacted_through`` is the highest ``seq`` compaction deleted;
+    cursors below it have expired.
+    """
+    __tablename__ = "account_change_log_state"
+    id = Column(Integer, primary_key=True)
+    sequenced_through = Column(Integer, nullable=False, default=0)
+    compacted_through = Column(Integer, nullable=False, default=0)
+
+
+# The row has to exist for sequencers to lock it, whether the schema comes from Alembic or create_all
+event.listen(
+    AccountChangeLogState.__table__,
+    "after_create",
+    DDL("INSERT INTO account_change_log_state (id, sequenced_through, compacted_through) VALUES (1, 0, 0)"),
+)
@@ -0,0 +1,57 @@
+import asyncio
+import logging
+from typing import Optional
+
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from . import auth, crud, metrics
+from .database import get_session_factory
+
+logger = logging.getLogger(__name__)
+
+REFRESHED_TOKENS = metrics.Counter("refresh_tokens_rotated_total", "Refresh tokens exchanged for new tokens.")
+REUSED_REFRESH_TOKENS = metrics.Counter(
+    "refresh_tokens_reused_total", "Rotated refresh tokens presented again, revoking their family."
+)
+PURGED_REFRESH_TOKENS = metrics.Counter("refresh_tokens_purged_total", "Expired refresh tokens deleted.")
+
+
+class RefreshTokenPurger:
+    """Deletes expired refresh tokens every ``interval`` seconds, off the request path."""
+
+    def __init__(self, session_factory: Optional[async_sessionmaker], interval: float):
+        self.session_factory = session_factory
+        self.interval = interval
+        self._purger: Optional[asyncio.Task] = None
+
+    async def purge(self) -> int:
+        session_factory = self.session_factory or get_session_factory()
+        async with session_factory() as db:
+            purged = await crud.purge_expired_refresh_tokens(db)
+        PURGED_REFRESH_TOKENS.inc(amount=purged)
+        return purged
+
+    async def _purge_periodically(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                purged = await self.purge()
+                logger.info("Purged %d expired refresh tokens", purged)
+            except Exception:
+                logger.exception("Failed to purge expired refresh tokens")
+
+    def start(self):
+        if self._purger is None:
+            self._purger = asyncio.get_running_loop().create_task(self._purge_periodically())
+
+    async def stop(self):
+        if self._purger is not None:
+            self._purger.cancel()
+            try:
+                await self._purger
+            except asyncio.CancelledError:
+                pass
+            self._purger = None
+
+
+refresh_token_purger = RefreshTokenPurger(None, interval=auth.REFRESH_TOKEN_PURGE_INTERVAL)
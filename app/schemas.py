@@ -1,11 +1,12 @@
-from pydantic import BaseModel
-from typing import Optional
+from pydantic import BaseModel, model_validator
+from typing import Literal, Optional
 from datetime import datetime
 
 
 class LoginResponse(BaseModel):
     access_token: str
     token_type: str
+    refresh_token: str
 
 
 class AccountRegister(BaseModel):
@@ -36,3 +37,46 @@ class AccountResponse(BaseModel):
     created_date: datetime
     last_login_date: Optional[datetime] = None
     hashed_password: str
+
+
+class AccountBatchLookup(BaseModel):
+    ids: Optional[list[int]] = None
+    emails: Optional[list[str]] = None
+
+    @model_validator(mode="after")
+    def one_kind_of_key(self):
+        if (self.ids is None) == (self.emails is None):
+            raise ValueError("Provide either ids or emails")
+        return self
+
+
+class AccountBatchResponse(BaseModel):
+    accounts: list[AccountResponse]
+    missing: list
+
+
+class AccountSearch(BaseModel):
+    is_active: Optional[bool] = None
+    name_prefix: Optional[str] = None
+    created_from: Optional[datetime] = None
+    created_to: Optional[datetime] = None
+    last_login_from: Optional[datetime] = None
+    last_login_to: Optional[datetime] = None
+    sort: Literal["id", "name", "created_date", "last_login_date"] = "id"
+    order: Literal["asc", "desc"] = "asc"
+
+
+class BulkUpdateResponse(BaseModel):
+    updated: int
+
+
+class BulkRegisterError(BaseModel):
+    line: int
+    email: Optional[str] = None
+    detail: str
+
+
+class BulkRegisterResponse(BaseModel):
+    created: int
+    failed: int
+    errors: list[BulkRegisterError]
@@ -0,0 +1,405 @@
+"""Serve the app from several uvicorn worker processes under a small supervisor.
+
+    python -m app.serve --host 0.0.0.0 --port 8000 --workers 4 --max-requests 10000
+
+The supervisor binds the listening socket once and shares it with every
+worker (uvloop + httptools). Each worker also listens on a private loopback
+port the supervisor uses to probe ``/readyz`` and ``/healthz``:
+
+- workers that exit (e.g. after ``--max-requests``) or fail their health
+  checks are replaced;
+- SIGHUP restarts the workers one at a time, each old worker stopping only
+  once its replacement is ready, so the service never goes down;
+- SIGTERM / SIGINT stop every worker gracefully.
+
+Workers share nothing but the socket, so with more than one of them the
+in-process backends (``memory``) of the login throttle, the account cache and
+token revocation would each hold a partial view: a logout would only revoke
+its token on one worker. The supervisor refuses to start several workers with
+any of them, unless ``--allow-per-process-state`` accepts that.
+``/metrics`` on the public port reaches whichever worker accepts the
+connection, so ``--metrics-port`` serves the metrics of every worker instead,
+each sample labelled with the ``pid`` of its worker.
+
+With ``BCRYPT_CALIBRATE_ON_STARTUP``, the supervisor calibrates the bcrypt
+cost once, before starting any worker, and hands it to every worker as
+``BCRYPT_ROUNDS``: workers calibrating side by side would compete for the CPU
+and settle on different costs.
+"""
+import argparse
+import http.client
+import http.server
+import logging
+import multiprocessing
+import os
+import random
+import signal
+import socket
+import threading
+import time
+from typing import Optional
+
+import uvicorn
+
+from . import metrics
+
+SERVE_WORKERS = int(os.getenv("WEB_CONCURRENCY", os.cpu_count() or 1))
+# Requests after which a worker is recycled, 0 for never; the jitter keeps workers from recycling together
+SERVE_MAX_REQUESTS = int(os.getenv("SERVE_MAX_REQUESTS", 0))
+SERVE_MAX_REQUESTS_JITTER = int(os.getenv("SERVE_MAX_REQUESTS_JITTER", 0))
+SERVE_GRACEFUL_TIMEOUT = float(os.getenv("SERVE_GRACEFUL_TIMEOUT", 30))
+SERVE_READY_TIMEOUT = float(os.getenv("SERVE_READY_TIMEOUT", 60))
+SERVE_HEALTH_INTERVAL = float(os.getenv("SERVE_HEALTH_INTERVAL", 5))
+SERVE_HEALTH_FAILURES = int(os.getenv("SERVE_HEALTH_FAILURES", 3))
+# Port of the merged metrics of every worker, not served when unset
+SERVE_METRICS_PORT = int(os.environ["SERVE_METRICS_PORT"]) if os.getenv("SERVE_METRICS_PORT") else None
+SERVE_ALLOW_PER_PROCESS_STATE = os.getenv("SERVE_ALLOW_PER_PROCESS_STATE", "false").lower() in ("1", "true", "yes")
+PROBE_TIMEOUT = 2
+
+logger = logging.getLogger("app.serve")
+
+
+class PerProcessState(RuntimeError):
+    """Raised when several workers would each keep their own copy of state that has to be shared."""
+
+
+def bind_socket(host: str, port: int) -> socket.socket:
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.set_inheritable(True)
+    return sock
+
+
+def per_process_state() -> list:
+    """The configured backends that keep their state in each worker process, and what that breaks."""
+    from . import auth, cache, throttle
+
+    problems = []
+    if throttle.LOGIN_THROTTLE_BACKEND == "memory":
+        problems.append("LOGIN_THROTTLE_BACKEND=memory: every worker counts failed logins on its own, "
+                        "multiplying the limits by the number of workers")
+    if cache.ACCOUNT_CACHE_BACKEND == "memory":
+        problems.append("ACCOUNT_CACHE_BACKEND=memory: workers do not see each other's invalidations, "
+                        "a changed account may be served stale for up to ACCOUNT_CACHE_TTL")
+    if auth.TOKEN_REVOCATION_BACKEND == "memory":
+        problems.append("TOKEN_REVOCATION_BACKEND=memory: a logout only revokes its token on the worker that served it")
+    return problems
+
+
+def pin_bcrypt_rounds():
+    """Calibrate the bcrypt cost once and pin it in the environment the workers inherit."""
+    from . import auth
+
+    if auth.BCRYPT_CALIBRATE_ON_STARTUP and not auth.BCRYPT_ROUNDS:
+        rounds = auth.calibrate_bcrypt_rounds(auth.BCRYPT_TARGET_MS)
+        os.environ["BCRYPT_ROUNDS"] = str(rounds)
+        logger.info("Calibrated bcrypt to %d rounds for every worker", rounds)
+
+
+def add_label(sample: str, name: str, value) -> str:
+    """``sample``, a line of the Prometheus text format, with one more label."""
+    metric_end = min(index for index in (sample.find("{"), sample.find(" ")) if index >= 0)
+    if sample[metric_end] == "{":
+        return f'{sample[:metric_end + 1]}{name}="{value}",{sample[metric_end + 1:]}'
+    return f'{sample[:metric_end]}{{{name}="{value}"}}{sample[metric_end:]}'
+
+
+def merge_metrics(pages: dict) -> str:
+    """One page of the metrics pages of several workers, keyed by pid.
+
+    Every family keeps one HELP and TYPE line, followed by the samples of
+    every worker labelled with its ``pid``, so the counters of different
+    workers are separate series rather than one that jumps back and forth.
+    """
+    families: dict = {}
+    for pid, page in pages.items():
+        family = None
+        for line in page.splitlines():
+            if line.startswith("# "):
+                family = families.setdefault(line.split(" ", 3)[2], ([], []))
+                if line not in family[0]:
+                    family[0].append(line)
+            elif line and family is not None:
+                family[1].append(add_label(line, "pid", pid))
+    return "".join(line + "\n" for headers, samples in families.values() for line in headers + samples)
+
+
+def run_worker(options: dict, sockets: list):
+    config = uvicorn.Config("app.main:app", loop="uvloop", http="httptools", **options)
+    uvicorn.Server(config).run(sockets=sockets)
+
+
+class Worker:
+    """A worker process and the private port it is probed on."""
+
+    def __init__(self, process: multiprocessing.Process, probe_socket: socket.socket):
+        self.process = process
+        self.probe_socket = probe_socket
+        self.port = probe_socket.getsockname()[1]
+        self.started_at = time.monotonic()
+        self.ready = False
+        self.failures = 0
+
+    @property
+    def pid(self) -> Optional[int]:
+        return self.process.pid
+
+    def fetch(self, path: str) -> Optional[bytes]:
+        """Body of a 200 response to a GET of ``path`` on the probe port, None otherwise."""
+        connection = http.client.HTTPConnection("127.0.0.1", self.port, timeout=PROBE_TIMEOUT)
+        try:
+            connection.request("GET", path)
+            response = connection.getresponse()
+            body = response.read()
+            return body if response.status == 200 else None
+        except OSError:
+            return None
+        finally:
+            connection.close()
+
+    def probe(self, path: str) -> bool:
+        return self.fetch(path) is not None
+
+    def stop(self, timeout: float):
+        """Ask the worker to finish its requests and exit, killing it after ``timeout`` seconds."""
+        if self.process.is_alive():
+            os.kill(self.process.pid, signal.SIGTERM)
+        self.process.join(timeout)
+        if self.process.is_alive():
+            logger.warning("Worker %s did not stop within %ss, killing it", self.pid, timeout)
+            self.process.kill()
+            self.process.join()
+        self.probe_socket.close()
+
+
+class Supervisor:
+    def __init__(
+            self,
+            host: str,
+            port: int,
+            workers: int,
+            max_requests: int = 0,
+            max_requests_jitter: int = 0,
+            graceful_timeout: float = 30,
+            ready_timeout: float = 60,
+            health_interval: float = 5,
+            health_failures: int = 3,
+            log_level: str = "info",
+            metrics_port: Optional[int] = None,
+            allow_per_process_state: bool = False,
+    ):
+        self.host = host
+        self.port = port
+        self.worker_count = workers
+        self.max_requests = max_requests
+        self.max_requests_jitter = max_requests_jitter
+        self.graceful_timeout = graceful_timeout
+        self.ready_timeout = ready_timeout
+        self.health_interval = health_interval
+        self.health_failures = health_failures
+        self.log_level = log_level
+        self.metrics_port = metrics_port
+        self.allow_per_process_state = allow_per_process_state
+        self.workers: list = []
+        self.socket: Optional[socket.socket] = None
+        self.metrics_server: Optional[http.server.ThreadingHTTPServer] = None
+        self._context = multiprocessing.get_context("spawn")
+        self._should_exit = False
+        self._should_restart = False
+
+    def spawn_worker(self) -> Worker:
+        probe_socket = bind_socket("127.0.0.1", 0)
+        options = {"log_level": self.log_level, "timeout_graceful_shutdown": self.graceful_timeout}
+        if self.max_requests:
+            options["limit_max_requests"] = self.max_requests + random.randint(0, self.max_requests_jitter)
+        process = self._context.Process(target=run_worker, args=(options, [self.socket, probe_socket]))
+        process.start()
+        worker = Worker(process, probe_socket)
+        logger.info("Started worker %s", worker.pid)
+        return worker
+
+    def wait_ready(self, worker: Worker) -> bool:
+        while time.monotonic() - worker.started_at < self.ready_timeout:
+            if not worker.process.is_alive():
+                return False
+            if worker.probe("/readyz"):
+                worker.ready = True
+                return True
+            time.sleep(0.1)
+        return False
+
+    def replace(self, worker: Worker, reason: str):
+        logger.warning("Replacing worker %s: %s", worker.pid, reason)
+        self.workers.remove(worker)
+        worker.stop(self.graceful_timeout)
+        self.workers.append(self.spawn_worker())
+
+    def check_workers(self):
+        for worker in list(self.workers):
+            if not worker.process.is_alive():
+                # Recycled after max requests (exit code 0) or crashed
+                self.workers.remove(worker)
+                worker.stop(0)
+                logger.info("Worker %s exited with code %s", worker.pid, worker.process.exitcode)
+                self.workers.append(self.spawn_worker())
+            elif not worker.ready:
+                if worker.probe("/readyz"):
+                    worker.ready = True
+                elif time.monotonic() - worker.started_at > self.ready_timeout:
+                    self.replace(worker, f"not ready within {self.ready_timeout}s")
+            elif worker.probe("/healthz"):
+                worker.failures = 0
+            else:
+                worker.failures += 1
+                if worker.failures >= self.health_failures:
+                    self.replace(worker, f"{worker.failures} failed health checks")
+
+    def rolling_restart(self):
+        logger.info("Rolling restart of %d workers", len(self.workers))
+        for old in list(self.workers):
+            new = self.spawn_worker()
+            if not self.wait_ready(new):
+                logger.error("Worker %s did not become ready, aborting the rolling restart", new.pid)
+                new.stop(0)
+                return
+            self.workers.append(new)
+            self.workers.remove(old)
+            old.stop(self.graceful_timeout)
+
+    def render_metrics(self) -> str:
+        pages = {}
+        for worker in list(self.workers):
+            page = worker.fetch("/metrics") if worker.ready else None
+            if page is not None:
+                pages[worker.pid] = page.decode()
+        return merge_metrics(pages)
+
+    def serve_metrics(self):
+        supervisor = self
+
+        class MetricsHandler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != "/metrics":
+                    self.send_error(404)
+                    return
+                body = supervisor.render_metrics().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", metrics.CONTENT_TYPE)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.metrics_server = http.server.ThreadingHTTPServer((self.host, self.metrics_port), MetricsHandler)
+        threading.Thread(target=self.metrics_server.serve_forever, daemon=True).start()
+        logger.info("Serving the metrics of every worker on %s:%s", self.host, self.metrics_server.server_port)
+
+    def handle_exit(self, signum, frame):
+        self._should_exit = True
+
+    def handle_restart(self, signum, frame):
+        self._should_restart = True
+
+    def check_shared_state(self):
+        """Refuse to start several workers that would each hold their own part of the shared state."""
+        if self.worker_count <= 1:
+            return
+        problems = per_process_state()
+        if problems and not self.allow_per_process_state:
+            raise PerProcessState(
+                f"Refusing to start {self.worker_count} workers with per-process state: {'; '.join(problems)}. "
+                "Set these backends to redis, run a single worker, or pass --allow-per-process-state"
+            )
+        for problem in problems:
+            logger.warning("Per-process state with %d workers, %s", self.worker_count, problem)
+
+    def run(self):
+        self.check_shared_state()
+        self.socket = bind_socket(self.host, self.port)
+        logger.info("Listening on %s:%s with %d workers", self.host, self.socket.getsockname()[1], self.worker_count)
+        pin_bcrypt_rounds()
+        if self.metrics_port is not None:
+            self.serve_metrics()
+        signal.signal(signal.SIGTERM, self.handle_exit)
+        signal.signal(signal.SIGINT, self.handle_exit)
+        signal.signal(signal.SIGHUP, self.handle_restart)
+        try:
+            self.workers = [self.spawn_worker() for _ in range(self.worker_count)]
+            next_check = time.monotonic()
+            while not self._should_exit:
+                if self._should_restart:
+                    self._should_restart = False
+                    self.rolling_restart()
+                # Not-ready workers are polled every tick, ready ones every health interval
+                if time.monotonic() >= next_check or not all(worker.ready for worker in self.workers):
+                    self.check_workers()
+                    next_check = time.monotonic() + self.health_interval
+                time.sleep(0.1)
+        finally:
+            logger.info("Stopping %d workers", len(self.workers))
+            for worker in self.workers:
+                if worker.process.is_alive():
+                    os.kill(worker.pid, signal.SIGTERM)
+            for worker in self.workers:
+                worker.stop(self.graceful_timeout)
+            if self.metrics_server is not None:
+                self.metrics_server.shutdown()
+                self.metrics_server.server_close()
+            self.socket.close()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=SERVE_WORKERS,
+                        help="worker processes, defaults to WEB_CONCURRENCY or the CPU count")
+    parser.add_argument("--max-requests", type=int, default=SERVE_MAX_REQUESTS,
+                        help="recycle a worker after this many requests, 0 for never")
+    parser.add_argument("--max-requests-jitter", type=int, default=SERVE_MAX_REQUESTS_JITTER,
+                        help="add up to this many requests to --max-requests per worker")
+    parser.add_argument("--graceful-timeout", type=float, default=SERVE_GRACEFUL_TIMEOUT,
+                        help="seconds a stopping worker gets to finish its requests")
+    parser.add_argument("--ready-timeout", type=float, default=SERVE_READY_TIMEOUT,
+                        help="seconds a new worker gets to become ready")
+    parser.add_argument("--health-interval", type=float, default=SERVE_HEALTH_INTERVAL,
+                        help="seconds between health checks of every worker")
+    parser.add_argument("--health-failures", type=int, default=SERVE_HEALTH_FAILURES,
+                        help="consecutive failed health checks after which a worker is replaced")
+    parser.add_argument("--metrics-port", type=int, default=SERVE_METRICS_PORT,
+                        help="serve the metrics of every worker, labelled by pid, on this port")
+    parser.add_argument("--allow-per-process-state", action="store_true", default=SERVE_ALLOW_PER_PROCESS_STATE,
+                        help="start several workers even with memory backends, each holding its own state")
+    parser.add_argument("--log-level", default="info")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.basicConfig(level=args.log_level.upper(), format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    supervisor = Supervisor(
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        max_requests=args.max_requests,
+        max_requests_jitter=args.max_requests_jitter,
+        graceful_timeout=args.graceful_timeout,
+        ready_timeout=args.ready_timeout,
+        health_interval=args.health_interval,
+        health_failures=args.health_failures,
+        log_level=args.log_level,
+        metrics_port=args.metrics_port,
+        allow_per_process_state=args.allow_per_process_state,
+    )
+    try:
+        supervisor.run()
+    except PerProcessState as exc:
+        logger.error("%s", exc)
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
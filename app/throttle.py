@@ -0,0 +1,194 @@
+import logging
+import math
+import os
+import time
+from collections import OrderedDict
+
+from . import metrics
+
+LOGIN_THROTTLE_BACKEND = os.getenv("LOGIN_THROTTLE_BACKEND", "memory")
+# Failed logins allowed per email and per client IP within a sliding window of LOGIN_THROTTLE_WINDOW seconds
+LOGIN_THROTTLE_EMAIL_LIMIT = int(os.getenv("LOGIN_THROTTLE_EMAIL_LIMIT", 5))
+LOGIN_THROTTLE_IP_LIMIT = int(os.getenv("LOGIN_THROTTLE_IP_LIMIT", 30))
+LOGIN_THROTTLE_WINDOW = int(os.getenv("LOGIN_THROTTLE_WINDOW", 60))
+LOGIN_THROTTLE_SIZE = int(os.getenv("LOGIN_THROTTLE_SIZE", 100000))
+LOGIN_THROTTLE_REDIS_URL = os.getenv("LOGIN_THROTTLE_REDIS_URL", "redis://localhost:6379/0")
+
+logger = logging.getLogger(__name__)
+
+THROTTLED_LOGINS = metrics.Counter("login_throttled_total", "Logins rejected before hashing, by limit.", ["limit"])
+
+
+def sliding_window_retry_after(current: int, previous: int, limit: int, window: float, elapsed: float) -> float:
+    """Seconds until a sliding window counter drops below ``limit``, 0 if it already is.
+
+    The count is estimated as ``current`` plus the part of ``previous`` (the
+    count of the window before) that still overlaps the sliding window.
+    """
+    if previous * (1 - elapsed / window) + current < limit:
+        return 0
+    if current < limit:
+        # Wait for enough of the previous window to slide out
+        return window * (1 - (limit - current) / previous) - elapsed
+    # Wait for this window to end and enough of it to slide out of the next one
+    return window - elapsed + window * (1 - limit / current)
+
+
+class NullThrottleStore:
+    """Store of a disabled throttle, which never counts anything."""
+
+    async def incr(self, key: str, window_index: int, ttl: float) -> tuple:
+        return 0, 0
+
+    async def decr(self, key: str, window_index: int, ttl: float):
+        pass
+
+
+class MemoryThrottleStore:
+    """Per-process window counters, keeping the ``maxsize`` most recently used keys."""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._windows: OrderedDict = OrderedDict()
+
+    def _roll(self, key: str, window_index: int) -> list:
+        index, current, previous = self._windows.get(key, (window_index, 0, 0))
+        if index == window_index - 1:
+            return [window_index, 0, current]
+        if index != window_index:
+            return [window_index, 0, 0]
+        return [index, current, previous]
+
+    async def incr(self, key: str, window_index: int, ttl: float) -> tuple:
+        entry = self._roll(key, window_index)
+        entry[1] += 1
+        self._windows[key] = tuple(entry)
+        self._windows.move_to_end(key)
+        while len(self._windows) > self.maxsize:
+            self._windows.popitem(last=False)
+        return entry[1], entry[2]
+
+    async def decr(self, key: str, window_index: int, ttl: float):
+        if key not in self._windows:
+            return
+        index, current, previous = self._windows[key]
+        # The window may have rolled over since the increment
+        if index == window_index:
+            self._windows[key] = (index, max(current - 1, 0), previous)
+        elif index == window_index + 1:
+            self._windows[key] = (index, current, max(previous - 1, 0))
+
+
+class RedisThrottleStore:
+    """Window counters shared between workers in any Redis-protocol server, one key per window."""
+
+    def __init__(self, client, prefix: str = "login-throttle:"):
+        from redis.exceptions import RedisError
+
+        self.client = client
+        self.prefix = prefix
+        self.errors = RedisError
+
+    @classmethod
+    def from_url(cls, url: str):
+        from redis import asyncio as redis
+
+        # RESP2 is understood by every Redis-protocol server
+        return cls(redis.Redis.from_url(url, protocol=2))
+
+    def _key(self, key: str, window_index: int) -> str:
+        return f"{self.prefix}{key}:{window_index}"
+
+    async def incr(self, key: str, window_index: int, ttl: float) -> tuple:
+        pipeline = self.client.pipeline(transaction=False)
+        pipeline.incr(self._key(key, window_index))
+        pipeline.pexpire(self._key(key, window_index), int(ttl * 1000))
+        pipeline.get(self._key(key, window_index - 1))
+        try:
+            current, _, previous = await pipeline.execute()
+        except self.errors:
+            # An unreachable store must not lock everybody out
+            logger.warning("Login throttle store unavailable, letting the attempt through", exc_info=True)
+            return 0, 0
+        # INCR is atomic, so concurrent attempts on any worker each get a count of their own
+        return int(current), int(previous or 0)
+
+    async def decr(self, key: str, window_index: int, ttl: float):
+        pipeline = self.client.pipeline(transaction=False)
+        pipeline.incrby(self._key(key, window_index), -1)
+        pipeline.pexpire(self._key(key, window_index), int(ttl * 1000))
+        try:
+            await pipeline.execute()
+        except self.errors:
+            logger.warning("Login throttle store unavailable, attempt not refunded", exc_info=True)
+
+
+class LoginThrottle:
+    """Sliding window limits of failed logins per email and per client IP.
+
+    Every attempt is counted as a failure before bcrypt runs and refunded once
+    the password turns out right, so a burst of concurrent attempts cannot all
+    pass the check before any of them is counted, while regular users are
+    never throttled by their own successful logins; a limit of 0 disables it.
+    """
+
+    def __init__(self, store, email_limit: int, ip_limit: int, window: int):
+        self.store = store
+        self.limits = {"email": email_limit, "ip": ip_limit}
+        self.window = window
+
+    def _keys(self, email: str, client_ip: str) -> dict:
+        return {
+            name: key for name, key in (("email", f"email:{email.lower()}"), ("ip", f"ip:{client_ip}"))
+            if self.limits[name] > 0
+        }
+
+    def _wait(self, name: str, current: int, previous: int, elapsed: float) -> int:
+        wait = sliding_window_retry_after(current, previous, self.limits[name], self.window, elapsed)
+        if wait <= 0:
+            return 0
+        THROTTLED_LOGINS.inc(name)
+        # Rounded to milliseconds first, so float noise never adds a second
+        return max(math.ceil(round(wait, 3)), 1)
+
+    async def reserve(self, email: str, client_ip: str) -> tuple:
+        """Count an attempt as failed before the password is verified.
+
+        Returns (retry_after, window_index): a throttled attempt gets its wait
+        in seconds and is not counted; otherwise retry_after is 0 and
+        ``refund`` takes the attempt back if the password is right.
+        """
+        window_index, elapsed = divmod(time.time(), self.window)
+        window_index = int(window_index)
+        reserved = []
+        for name, key in self._keys(email, client_ip).items():
+            # The previous window is still read during the whole next one
+            current, previous = await self.store.incr(key, window_index, ttl=2 * self.window)
+            reserved.append(key)
+            # Judged on the attempts counted before this one
+            wait = self._wait(name, max(current - 1, 0), previous, elapsed)
+            if wait:
+                for reserved_key in reserved:
+                    await self.store.decr(reserved_key, window_index, ttl=2 * self.window)
+                return wait, window_index
+        return 0, window_index
+
+    async def refund(self, email: str, client_ip: str, window_index: int):
+        """Take back the attempt ``reserve`` counted, once it turned out not to have failed."""
+        for key in self._keys(email, client_ip).values():
+            await self.store.decr(key, window_index, ttl=2 * self.window)
+
+
+def create_login_throttle(backend: str = LOGIN_THROTTLE_BACKEND) -> LoginThrottle:
+    if backend == "none":
+        store = NullThrottleStore()
+    elif backend == "memory":
+        store = MemoryThrottleStore(maxsize=LOGIN_THROTTLE_SIZE)
+    elif backend == "redis":
+        store = RedisThrottleStore.from_url(LOGIN_THROTTLE_REDIS_URL)
+    else:
+        raise ValueError(f"Unknown login throttle backend: {backend}")
+    return LoginThrottle(store, LOGIN_THROTTLE_EMAIL_LIMIT, LOGIN_THROTTLE_IP_LIMIT, LOGIN_THROTTLE_WINDOW)
+
+
+login_throttle = create_login_throttle()
@@ -0,0 +1,280 @@
+"""Throughput and latency benchmark of the HTTP endpoints.
+
+Runs the app in-process (through httpx's ASGI transport) or under uvicorn
+against a SQLite file or any DB_URL, seeds accounts, drives each endpoint at
+the requested concurrency levels and reports req/s and p50/p95/p99 latency.
+
+    python -m benchmarks.endpoints --accounts 10000 --concurrency 1,16,64 \\
+        --output benchmarks/results/baseline.json
+    python -m benchmarks.endpoints --compare benchmarks/results/baseline.json
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import math
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime
+
+import httpx
+
+PASSWORD = "benchmark-password"
+ENDPOINTS = ["token", "register", "accounts", "account", "partial_update", "full_update"]
+
+
+def percentile(latencies: list, percent: float) -> float:
+    """Nearest-rank percentile of a non-empty list of latencies."""
+    ordered = sorted(latencies)
+    rank = max(math.ceil(percent / 100 * len(ordered)), 1)
+    return ordered[rank - 1]
+
+
+def summarize(endpoint: str, concurrency: int, latencies: list, errors: int, elapsed: float) -> dict:
+    return {
+        "endpoint": endpoint,
+        "concurrency": concurrency,
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+    }
+
+
+def compare(results: list, baseline: list) -> list:
+    """Pair every result with its baseline run, adding the relative change of req/s and p99."""
+    previous = {(run["endpoint"], run["concurrency"]): run for run in baseline}
+    rows = []
+    for run in results:
+        before = previous.get((run["endpoint"], run["concurrency"]))
+        row = dict(run)
+        if before is not None:
+            row["rps_change"] = round((run["rps"] - before["rps"]) / before["rps"] * 100, 1) if before["rps"] else None
+            row["p99_change"] = (
+                round((run["p99_ms"] - before["p99_ms"]) / before["p99_ms"] * 100, 1) if before["p99_ms"] else None
+            )
+        rows.append(row)
+    return rows
+
+
+def print_table(rows: list):
+    columns = ["endpoint", "concurrency", "requests", "errors", "rps", "p50_ms", "p95_ms", "p99_ms"]
+    if any("rps_change" in row for row in rows):
+        columns += ["rps_change", "p99_change"]
+    print("  ".join(f"{column:>14}" for column in columns))
+    for row in rows:
+        print("  ".join(f"{str(row.get(column, '')):>14}" for column in columns))
+
+
+def seed_accounts(db_url: str, count: int) -> list:
+    """Create the schema and ``count`` accounts sharing one bcrypt hash, returning their emails."""
+    from sqlalchemy import create_engine, delete, insert
+
+    from app import auth, models
+
+    engine = create_engine(db_url)
+    models.Base.metadata.create_all(bind=engine)
+    hashed_password = auth.get_password_hash(PASSWORD)
+    now = datetime.now()
+    emails = [f"bench{index}@example.com" for index in range(count)]
+    with engine.begin() as connection:
+        connection.execute(delete(models.Account))
+        for start in range(0, count, 1000):
+            connection.execute(insert(models.Account), [
+                {
+                    "name": f"Bench User {index}",
+                    "email": emails[index],
+                    "password": PASSWORD,
+                    "hashed_password": hashed_password,
+                    "is_active": True,
+                    "created_date": now,
+                    "last_login_date": now,
+                }
+                for index in range(start, min(start + 1000, count))
+            ])
+    engine.dispose()
+    return emails
+
+
+class Scenarios:
+    """Builds one request of each endpoint against the seeded accounts."""
+
+    def __init__(self, emails: list, ids: list, token: str):
+        self.emails = itertools.cycle(emails)
+        self.ids = itertools.cycle(ids)
+        self.headers = {"Authorization": f"Bearer {token}"}
+        self.registrations = itertools.count()
+        self.run_id = int(time.time())
+
+    def token(self, client):
+        return client.post("/token", data={"username": next(self.emails), "password": PASSWORD})
+
+    def register(self, client):
+        index = next(self.registrations)
+        return client.post("/register/", data={
+            "name": f"Registered User {index}",
+            "email": f"registered{self.run_id}-{index}@example.com",
+            "password": PASSWORD,
+        })
+
+    def accounts(self, client):
+        return client.get("/accounts/", params={"limit": 100}, headers=self.headers)
+
+    def account(self, client):
+        acc_id = next(self.ids)
+        return client.get(f"/account/{acc_id}/", params={"acc_id": acc_id}, headers=self.headers)
+
+    def partial_update(self, client):
+        return client.patch("/account_partial_update", data={
+            "email": next(self.emails), "name": "Partially Updated",
+        }, headers=self.headers)
+
+    def full_update(self, client):
+        return client.put("/account_full_update", data={
+            "email": next(self.emails), "name": "Fully Updated", "password": PASSWORD, "is_active": "true",
+        }, headers=self.headers)
+
+
+async def run_level(client, request, concurrency: int, total: int) -> tuple:
+    """Send ``total`` requests from ``concurrency`` concurrent workers, returning latencies, errors and wall time."""
+    latencies = []
+    errors = 0
+    remaining = itertools.count()
+
+    async def worker():
+        nonlocal errors
+        while next(remaining) < total:
+            started = time.perf_counter()
+            response = await request(client)
+            latencies.append(time.perf_counter() - started)
+            if response.status_code >= 400:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies, errors, time.perf_counter() - started
+
+
+@asynccontextmanager
+async def in_process_client():
+    from app.main import app
+
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as client:
+            yield client
+
+
+@asynccontextmanager
+async def uvicorn_client(workers: int):
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+    server = subprocess.Popen([
+        sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(port),
+        "--workers", str(workers), "--log-level", "warning",
+    ])
+    try:
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=60) as client:
+            for _ in range(100):
+                try:
+                    await client.get("/docs")
+                    break
+                except httpx.TransportError:
+                    await asyncio.sleep(0.1)
+            yield client
+    finally:
+        server.terminate()
+        server.wait()
+
+
+async def run(args) -> list:
+    from sqlalchemy import create_engine, select
+
+    from app import models
+
+    emails = seed_accounts(os.environ["DB_URL"], args.accounts)
+    engine = create_engine(os.environ["DB_URL"])
+    with engine.connect() as connection:
+        ids = connection.execute(select(models.Account.id)).scalars().all()
+    engine.dispose()
+
+    client_context = uvicorn_client(args.workers) if args.uvicorn else in_process_client()
+    results = []
+    async with client_context as client:
+        login = await client.post("/token", data={"username": emails[0], "password": PASSWORD})
+        login.raise_for_status()
+        scenarios = Scenarios(emails, ids, login.json()["access_token"])
+        for endpoint in args.endpoints:
+            for concurrency in args.concurrency:
+                request = getattr(scenarios, endpoint)
+                # Warm up connections and caches before measuring
+                await run_level(client, request, concurrency, concurrency)
+                latencies, errors, elapsed = await run_level(client, request, concurrency, args.requests)
+                results.append(summarize(endpoint, concurrency, latencies, errors, elapsed))
+                print(f"{endpoint} @ {concurrency}: {results[-1]['rps']} req/s, p99 {results[-1]['p99_ms']} ms",
+                      file=sys.stderr)
+    return results
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--accounts", type=int, default=1000, help="number of accounts to seed")
+    parser.add_argument("--requests", type=int, default=200, help="requests per endpoint and concurrency level")
+    parser.add_argument("--concurrency", default="1,10,50",
+                        type=lambda value: [int(level) for level in value.split(",")],
+                        help="comma separated concurrency levels")
+    parser.add_argument("--endpoints", default=",".join(ENDPOINTS),
+                        type=lambda value: value.split(","),
+                        help=f"comma separated subset of {','.join(ENDPOINTS)}")
+    parser.add_argument("--db-url", help="database to benchmark against, defaults to a temporary SQLite file")
+    parser.add_argument("--uvicorn", action="store_true", help="serve the app with uvicorn instead of in-process")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn workers, with --uvicorn")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="JSON file of an earlier run to compare against")
+    args = parser.parse_args(argv)
+    unknown = set(args.endpoints) - set(ENDPOINTS)
+    if unknown:
+        parser.error(f"unknown endpoints: {', '.join(sorted(unknown))}")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    with tempfile.TemporaryDirectory() as tmp:
+        # The app reads DB_URL at import time, so it must be set before anything imports it
+        os.environ["DB_URL"] = args.db_url or f"sqlite:///{tmp}/benchmark.db"
+        results = asyncio.run(run(args))
+
+    print()
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            print_table(compare(results, json.load(baseline_file)["results"]))
+    else:
+        print_table(results)
+
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w") as output_file:
+            json.dump({
+                "created": datetime.now().isoformat(timespec="seconds"),
+                "python": platform.python_version(),
+                "machine": platform.machine(),
+                "cpus": os.cpu_count(),
+                "accounts": args.accounts,
+                "uvicorn": args.uvicorn,
+                "workers": args.workers,
+                "results": results,
+            }, output_file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""Benchmark of the account read path: ORM + pydantic + json against projection + orjson.
+
+Seeds a temporary SQLite database (or --db-url) and times reading every
+account and encoding the response body both ways, at each row count.
+
+    python -m benchmarks.read_path --rows 10000,100000
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+import orjson
+
+
+async def orm_path(db) -> bytes:
+    """What FastAPI does for the ORM objects of ``crud.get_accounts`` with a response_model."""
+    from pydantic import TypeAdapter
+
+    from app import crud, schemas
+
+    adapter = TypeAdapter(list[schemas.AccountResponse])
+    accounts = await crud.get_accounts(db)
+    content = adapter.dump_python(adapter.validate_python(accounts, from_attributes=True), mode="json")
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode()
+
+
+async def projection_path(db) -> bytes:
+    from app import crud
+
+    return orjson.dumps(await crud.get_account_projections(db))
+
+
+async def time_path(session_factory, path, repeat: int) -> list:
+    timings = []
+    for _ in range(repeat):
+        async with session_factory() as db:
+            started = time.perf_counter()
+            await path(db)
+            timings.append(time.perf_counter() - started)
+    return timings
+
+
+async def run(args) -> list:
+    from app.database import dispose_router, get_session_factory
+    from benchmarks.endpoints import seed_accounts
+
+    session_factory = get_session_factory()
+    results = []
+    for rows in args.rows:
+        seed_accounts(os.environ["DB_URL"], rows)
+        async with session_factory() as db:
+            # Both paths must produce the same body
+            assert orjson.loads(await orm_path(db)) == orjson.loads(await projection_path(db))
+        for name, path in (("orm", orm_path), ("projection", projection_path)):
+            timings = await time_path(session_factory, path, args.repeat)
+            results.append({
+                "path": name,
+                "rows": rows,
+                "median_ms": round(statistics.median(timings) * 1000, 1),
+                "min_ms": round(min(timings) * 1000, 1),
+            })
+            print(f"{name} @ {rows}: {results[-1]['median_ms']} ms", file=sys.stderr)
+    await dispose_router()
+    return results
+
+
+def speedups(results: list) -> dict:
+    """Median ORM time divided by median projection time, per row count."""
+    medians = {(run["path"], run["rows"]): run["median_ms"] for run in results}
+    return {
+        rows: round(medians[("orm", rows)] / medians[("projection", rows)], 2)
+        for path, rows in medians if path == "projection" and medians[("projection", rows)]
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", default="10000,100000",
+                        type=lambda value: [int(rows) for rows in value.split(",")],
+                        help="comma separated account counts")
+    parser.add_argument("--repeat", type=int, default=5, help="timed runs per path and row count")
+    parser.add_argument("--db-url", help="database to benchmark against, defaults to a temporary SQLite file")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    with tempfile.TemporaryDirectory() as tmp:
+        # The app reads DB_URL at import time, so it must be set before anything imports it
+        os.environ["DB_URL"] = args.db_url or f"sqlite:///{tmp}/benchmark.db"
+        results = asyncio.run(run(args))
+
+    print()
+    print(f"{'path':>12}  {'rows':>8}  {'median_ms':>10}  {'min_ms':>8}")
+    for run_result in results:
+        print(f"{run_result['path']:>12}  {run_result['rows']:>8}  "
+              f"{run_result['median_ms']:>10}  {run_result['min_ms']:>8}")
+    for rows, speedup in speedups(results).items():
+        print(f"projection is {speedup}x faster at {rows} rows")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""Cold start benchmark: import time of app.main and time to the first request.
+
+Every run starts a fresh interpreter, so nothing is cached between runs.
+Time to first request is measured from spawning uvicorn until /healthz and
+/readyz first answer 200.
+
+    python -m benchmarks.startup --repeat 5
+    python -m benchmarks.startup --max-import-ms 2000  # exit 1 above budget, e.g. in CI
+"""
+import argparse
+import json
+import os
+import platform
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import httpx
+
+IMPORT_SNIPPET = "import time; started = time.perf_counter(); import app.main; print(time.perf_counter() - started)"
+
+
+def measure_import() -> float:
+    """Seconds a fresh interpreter spends importing app.main."""
+    output = subprocess.run([sys.executable, "-c", IMPORT_SNIPPET], check=True, capture_output=True, text=True)
+    return float(output.stdout.strip().splitlines()[-1])
+
+
+def measure_first_request(timeout: float = 60) -> dict:
+    """Seconds from spawning uvicorn until /healthz and then /readyz first answer 200."""
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+    started = time.perf_counter()
+    server = subprocess.Popen([
+        sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(port),
+        "--log-level", "warning",
+    ])
+    timings = {}
+    try:
+        for path in ("/healthz", "/readyz"):
+            while time.perf_counter() - started < timeout:
+                try:
+                    if httpx.get(f"http://127.0.0.1:{port}{path}", timeout=1).status_code == 200:
+                        timings[path] = time.perf_counter() - started
+                        break
+                except httpx.TransportError:
+                    pass
+                time.sleep(0.005)
+            else:
+                raise TimeoutError(f"{path} did not answer within {timeout}s")
+    finally:
+        server.terminate()
+        server.wait()
+    return timings
+
+
+def summarize(name: str, timings: list) -> dict:
+    return {
+        "measure": name,
+        "runs": len(timings),
+        "median_ms": round(statistics.median(timings) * 1000, 1),
+        "min_ms": round(min(timings) * 1000, 1),
+        "max_ms": round(max(timings) * 1000, 1),
+    }
+
+
+def run(args) -> list:
+    imports = [measure_import() for _ in range(args.repeat)]
+    first_requests = [measure_first_request() for _ in range(args.repeat)]
+    return [
+        summarize("import app.main", imports),
+        summarize("first /healthz", [timings["/healthz"] for timings in first_requests]),
+        summarize("first /readyz", [timings["/readyz"] for timings in first_requests]),
+    ]
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5, help="fresh processes per measure")
+    parser.add_argument("--db-url", help="database the app points at, defaults to a temporary SQLite file")
+    parser.add_argument("--max-import-ms", type=float, help="fail when the median import time is above this")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    with tempfile.TemporaryDirectory() as tmp:
+        # Inherited by every spawned interpreter
+        os.environ["DB_URL"] = args.db_url or f"sqlite:///{tmp}/startup.db"
+        results = run(args)
+
+    print(f"{'measure':>16}  {'runs':>4}  {'median_ms':>10}  {'min_ms':>8}  {'max_ms':>8}")
+    for result in results:
+        print(f"{result['measure']:>16}  {result['runs']:>4}  {result['median_ms']:>10}  "
+              f"{result['min_ms']:>8}  {result['max_ms']:>8}")
+
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w") as output_file:
+            json.dump({
+                "created": datetime.now().isoformat(timespec="seconds"),
+                "python": platform.python_version(),
+                "machine": platform.machine(),
+                "results": results,
+            }, output_file, indent=2)
+
+    if args.max_import_ms is not None and results[0]["median_ms"] > args.max_import_ms:
+        print(f"import app.main takes {results[0]['median_ms']} ms, over the {args.max_import_ms} ms budget",
+              file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+import pytest
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.pool import StaticPool
+from app import models
+from .redis_stub import RedisStub
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture
+async def session_factory():
+    """Session factory of a fresh in-memory database, shared by every session through a StaticPool."""
+    engine = create_async_engine("sqlite+aiosqlite:///:memory:", poolclass=StaticPool)
+    async with engine.begin() as connection:
+        await connection.run_sync(models.Base.metadata.create_all)
+    try:
+        yield async_sessionmaker(bind=engine, autoflush=False, expire_on_commit=False)
+    finally:
+        await engine.dispose()
+
+
+@pytest.fixture
+async def db(session_factory):
+    """Create a new database session on a fresh in-memory database for a test."""
+    db = session_factory()
+    try:
+        yield db
+    finally:
+        await db.close()
+
+
+@pytest.fixture
+async def redis_stub():
+    """Run a local Redis-protocol stand-in for the duration of a test."""
+    stub = RedisStub()
+    await stub.start()
+    try:
+        yield stub
+    finally:
+        await stub.stop()
@@ -0,0 +1,113 @@
+import asyncio
+import time
+
+
+class RedisStub:
+    """Minimal in-memory Redis-protocol (RESP2) server for tests.
+
+    Supports the handful of commands the app uses: PING, GET, SET (EX/PX/NX),
+    DEL, INCR, INCRBY, PEXPIRE and PTTL. Unknown commands get an error reply.
+    """
+
+    def __init__(self):
+        self.data = {}
+        self.expires = {}
+        self.server = None
+        self.port = None
+
+    @property
+    def url(self):
+        return f"redis://127.0.0.1:{self.port}/0"
+
+    async def start(self):
+        self.server = await asyncio.start_server(self._handle, "127.0.0.1", 0)
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    def _alive(self, key):
+        expires_at = self.expires.get(key)
+        if expires_at is not None and expires_at <= time.monotonic():
+            self.data.pop(key, None)
+            self.expires.pop(key, None)
+        return key in self.data
+
+    async def _read_command(self, reader):
+        line = await reader.readline()
+        if not line:
+            return None
+        count = int(line[1:])
+        args = []
+        for _ in range(count):
+            length = int((await reader.readline())[1:])
+            args.append((await reader.readexactly(length + 2))[:-2])
+        return args
+
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                args = await self._read_command(reader)
+                if args is None:
+                    break
+                writer.write(self._execute(args[0].decode().upper(), args[1:]))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    def _execute(self, command, args):
+        if command == "PING":
+            return b"+PONG\r\n"
+        if command == "GET":
+            if not self._alive(args[0]):
+                return b"$-1\r\n"
+            return self._bulk(self.data[args[0]])
+        if command == "SET":
+            return self._set(args)
+        if command == "DEL":
+            deleted = 0
+            for key in args:
+                if self._alive(key):
+                    del self.data[key]
+                    self.expires.pop(key, None)
+                    deleted += 1
+            return self._integer(deleted)
+        if command in ("INCR", "INCRBY"):
+            amount = int(args[1]) if command == "INCRBY" else 1
+            value = (int(self.data[args[0]]) if self._alive(args[0]) else 0) + amount
+            self.data[args[0]] = str(value).encode()
+            return self._integer(value)
+        if command == "PEXPIRE":
+            if not self._alive(args[0]):
+                return self._integer(0)
+            self.expires[args[0]] = time.monotonic() + int(args[1]) / 1000
+            return self._integer(1)
+        if command == "PTTL":
+            if not self._alive(args[0]):
+                return self._integer(-2)
+            if args[0] not in self.expires:
+                return self._integer(-1)
+            return self._integer(int((self.expires[args[0]] - time.monotonic()) * 1000))
+        return f"-ERR unknown command '{command}'\r\n".encode()
+
+    def _set(self, args):
+        key, value, options = args[0], args[1], [option.decode().upper() for option in args[2:]]
+        if "NX" in options and self._alive(key):
+            return b"$-1\r\n"
+        self.data[key] = value
+        self.expires.pop(key, None)
+        for name, factor in (("EX", 1), ("PX", 0.001)):
+            if name in options:
+                self.expires[key] = time.monotonic() + int(options[options.index(name) + 1]) * factor
+        return b"+OK\r\n"
+
+    @staticmethod
+    def _bulk(value):
+        return b"$%d\r\n%s\r\n" % (len(value), value)
+
+    @staticmethod
+    def _integer(value):
+        return b":%d\r\n" % value
@@ -0,0 +1,179 @@
+import json
+import time
+
+import pytest
+from datetime import timedelta
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec, ed25519, rsa
+from fastapi import HTTPException
+from jose import jwt
+from passlib.context import CryptContext
+from unittest.mock import patch
+from app import auth
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture(autouse=True)
+def clear_token_cache():
+    """Start every test with an empty token cache."""
+    auth.token_cache.clear()
+    yield
+    auth.token_cache.clear()
+
+
+def write_key(path, private_key) -> str:
+    path.write_bytes(private_key.private_bytes(
+        serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+    ))
+    return str(path)
+
+
+@pytest.fixture
+def key_files(tmp_path):
+    """An RSA and a P-256 private key in PEM files."""
+    return (
+        write_key(tmp_path / "rsa.pem", rsa.generate_private_key(public_exponent=65537, key_size=2048)),
+        write_key(tmp_path / "ec.pem", ec.generate_private_key(ec.SECP256R1())),
+    )
+
+
+def test_token_cache_evicts_least_recently_used():
+    """Test that the cache keeps at most maxsize entries, dropping the oldest one."""
+    cache = auth.TokenCache(maxsize=2, ttl=60)
+    exp = time.time() + 60
+    cache.set("token-a", {"email": "a@example.com"}, exp)
+    cache.set("token-b", {"email": "b@example.com"}, exp)
+    cache.get("token-a")
+    cache.set("token-c", {"email": "c@example.com"}, exp)
+
+    assert cache.get("token-a") == {"email": "a@example.com"}
+    assert cache.get("token-b") is None
+    assert cache.get("token-c") == {"email": "c@example.com"}
+
+
+def test_token_cache_entry_expires_with_token():
+    """Test that an entry never outlives the exp of its token."""
+    cache = auth.TokenCache(maxsize=2, ttl=60)
+    cache.set("token-a", {"email": "a@example.com"}, time.time() - 1)
+
+    assert cache.get("token-a") is None
+    assert len(cache) == 0
+
+
+async def test_get_current_account_caches_verified_token():
+    """Test that a verified token is served from the cache on the next call."""
+    token = auth.create_access_token({"sub": "user@example.com"}, expires_delta=timedelta(minutes=5))
+
+    assert await auth.get_current_account(token) == {"email": "user@example.com"}
+    assert len(auth.token_cache) == 1
+    assert await auth.get_current_account(token) == {"email": "user@example.com"}
+
+
+async def test_get_current_account_invalid_token():
+    """Test that an invalid token is rejected and not cached."""
+    with pytest.raises(HTTPException) as exc_info:
+        await auth.get_current_account("not-a-token")
+
+    assert exc_info.value.status_code == 401
+    assert len(auth.token_cache) == 0
+
+
+async def test_revoked_token_is_rejected():
+    """Test that a revoked token is rejected even though it is cached."""
+    token = auth.create_access_token({"sub": "user@example.com"}, expires_delta=timedelta(minutes=5))
+    await auth.get_current_account(token)
+
+    await auth.revoke_token(token)
+
+    with pytest.raises(HTTPException):
+        await auth.get_current_account(token)
+
+
+async def test_revocation_shared_between_workers(redis_stub):
+    """Test that a token revoked on one worker is rejected by another that has it cached."""
+    token = auth.create_access_token({"sub": "user@example.com"}, expires_delta=timedelta(minutes=5))
+    serving, other = (auth.RedisRevocationList.from_url(redis_stub.url) for _ in range(2))
+
+    with patch("app.auth.revoked_tokens", other):
+        await auth.get_current_account(token)
+    with patch("app.auth.revoked_tokens", serving):
+        await auth.revoke_token(token)
+    with patch("app.auth.revoked_tokens", other), pytest.raises(HTTPException):
+        await auth.get_current_account(token)
+    # Kept no longer than the token is valid
+    assert 0 < redis_stub.expires[other._key(token).encode()] - time.monotonic() <= 300
+    for revocation_list in (serving, other):
+        await revocation_list.client.aclose()
+
+
+def test_calibrate_bcrypt_rounds():
+    """Test that calibration picks the highest cost within the target and the bounds."""
+    # 1 ms at the probe cost, doubling with every round
+    def measure(rounds, samples=3):
+        return 0.001 * 2 ** (rounds - auth.BCRYPT_PROBE_ROUNDS)
+
+    with patch("app.auth.measure_bcrypt_seconds", side_effect=measure):
+        assert auth.calibrate_bcrypt_rounds(100, min_rounds=4, max_rounds=31) == 14
+        assert auth.calibrate_bcrypt_rounds(128, min_rounds=4, max_rounds=31) == 15
+        assert auth.calibrate_bcrypt_rounds(100, min_rounds=4, max_rounds=12) == 12
+        assert auth.calibrate_bcrypt_rounds(0.1, min_rounds=10, max_rounds=31) == 10
+
+
+def test_set_bcrypt_rounds_flags_lower_costs():
+    """Test that hashes of a lower cost than the configured one need a rehash, and higher ones do not."""
+    with patch("app.auth.pwd_context", CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__default_rounds=4)):
+        old_hash = auth.get_password_hash("password123")
+        assert not auth.password_needs_rehash(old_hash)
+
+        auth.set_bcrypt_rounds(5)
+        new_hash = auth.get_password_hash("password123")
+
+        assert new_hash.startswith("$2b$05$")
+        assert auth.password_needs_rehash(old_hash)
+        assert not auth.password_needs_rehash(new_hash)
+        assert auth.verify_password("password123", old_hash)
+
+        # A lower calibrated cost keeps the stronger hashes
+        auth.set_bcrypt_rounds(4)
+        assert auth.get_password_hash("password123").startswith("$2b$04$")
+        assert not auth.password_needs_rehash(new_hash)
+
+
+async def test_key_rotation(key_files):
+    """Test that the first key signs with its kid and tokens of a rotated out key still verify."""
+    rsa_file, ec_file = key_files
+    with patch("app.auth._key_set", auth.KeySet.from_files(rsa_file)):
+        old_token = auth.create_access_token({"sub": "user@example.com"})
+
+    with patch("app.auth._key_set", auth.KeySet.from_files(f"{ec_file}, {rsa_file}")):
+        new_token = auth.create_access_token({"sub": "user@example.com"})
+        ec_key, rsa_key = auth.get_key_set().keys
+
+        assert jwt.get_unverified_header(old_token)["kid"] == rsa_key.kid
+        assert jwt.get_unverified_header(new_token) == {"alg": "ES256", "kid": ec_key.kid, "typ": "JWT"}
+        assert await auth.get_current_account(old_token) == {"email": "user@example.com"}
+        assert await auth.get_current_account(new_token) == {"email": "user@example.com"}
+        assert [key["kid"] for key in json.loads(auth.get_key_set().document)["keys"]] == [ec_key.kid, rsa_key.kid]
+        assert b'"d"' not in auth.get_key_set().document
+
+
+async def test_token_of_unknown_key_is_rejected(key_files):
+    """Test that tokens signed with a key that is not in the key set, or with the shared secret, are rejected."""
+    rsa_file, ec_file = key_files
+    with patch("app.auth._key_set", auth.KeySet.from_files(rsa_file)):
+        foreign_token = auth.create_access_token({"sub": "user@example.com"})
+    secret_token = jwt.encode({"sub": "user@example.com"}, auth.SECRET_KEY, algorithm=auth.ALGORITHM)
+
+    with patch("app.auth._key_set", auth.KeySet.from_files(ec_file)):
+        for token in (foreign_token, secret_token):
+            with pytest.raises(HTTPException):
+                await auth.get_current_account(token)
+
+
+def test_unsupported_signing_key(tmp_path):
+    """Test that an Ed25519 key, which python-jose cannot sign with, is refused when loaded."""
+    path = write_key(tmp_path / "ed25519.pem", ed25519.Ed25519PrivateKey.generate())
+
+    with pytest.raises(ValueError):
+        auth.KeySet.from_files(path)
@@ -0,0 +1,60 @@
+from benchmarks import endpoints, read_path, startup
+
+
+def test_percentile():
+    """Test the nearest-rank percentile of a list of latencies."""
+    latencies = [index / 1000 for index in range(1, 101)]
+
+    assert endpoints.percentile(latencies, 50) == 0.05
+    assert endpoints.percentile(latencies, 99) == 0.099
+    assert endpoints.percentile([0.2], 95) == 0.2
+
+
+def test_summarize():
+    """Test a run is summarized in req/s and millisecond percentiles."""
+    summary = endpoints.summarize("accounts", 10, [0.01, 0.02, 0.03, 0.04], errors=1, elapsed=0.5)
+
+    assert summary == {
+        "endpoint": "accounts", "concurrency": 10, "requests": 4, "errors": 1,
+        "rps": 8.0, "p50_ms": 20.0, "p95_ms": 40.0, "p99_ms": 40.0,
+    }
+
+
+def test_compare_with_baseline():
+    """Test runs are matched to their baseline by endpoint and concurrency."""
+    baseline = [{"endpoint": "token", "concurrency": 1, "rps": 10.0, "p99_ms": 200.0}]
+    results = [
+        {"endpoint": "token", "concurrency": 1, "rps": 12.0, "p99_ms": 150.0},
+        {"endpoint": "token", "concurrency": 8, "rps": 40.0, "p99_ms": 400.0},
+    ]
+
+    rows = endpoints.compare(results, baseline)
+
+    assert rows[0]["rps_change"] == 20.0
+    assert rows[0]["p99_change"] == -25.0
+    assert "rps_change" not in rows[1]
+
+
+def test_parse_args():
+    """Test concurrency levels and endpoints are parsed from comma separated lists."""
+    args = endpoints.parse_args(["--concurrency", "1,8", "--endpoints", "token,accounts"])
+
+    assert args.concurrency == [1, 8]
+    assert args.endpoints == ["token", "accounts"]
+
+
+def test_read_path_speedups():
+    """Test the ORM time is divided by the projection time of the same row count."""
+    results = [
+        {"path": "orm", "rows": 10, "median_ms": 30.0},
+        {"path": "projection", "rows": 10, "median_ms": 10.0},
+    ]
+
+    assert read_path.speedups(results) == {10: 3.0}
+
+
+def test_startup_summarize():
+    """Test startup timings are summarized in milliseconds."""
+    assert startup.summarize("import app.main", [0.3, 0.1, 0.2]) == {
+        "measure": "import app.main", "runs": 3, "median_ms": 200.0, "min_ms": 100.0, "max_ms": 300.0,
+    }
@@ -0,0 +1,74 @@
+import pytest
+from datetime import datetime
+from app import cache
+
+pytestmark = pytest.mark.anyio
+
+ACCOUNT = {
+    "id": 1,
+    "name": "Test User",
+    "email": "test@example.com",
+    "hashed_password": "hashed_password",
+    "is_active": True,
+    "created_date": datetime(2024, 8, 24, 12, 0, 0),
+    "last_login_date": None,
+}
+
+
+@pytest.fixture(params=["memory", "redis"])
+async def account_cache(request, redis_stub):
+    """Yield each cache backend in turn."""
+    if request.param == "memory":
+        yield cache.LRUAccountCache(maxsize=10, ttl=60)
+    else:
+        account_cache = cache.RedisAccountCache.from_url(redis_stub.url, ttl=60)
+        yield account_cache
+        await account_cache.client.aclose()
+
+
+async def test_get_set_delete(account_cache):
+    """Test a value round-trips through the backend and can be deleted."""
+    assert await account_cache.get("id:1") is None
+
+    await account_cache.set("id:1", ACCOUNT)
+    assert await account_cache.get("id:1") == ACCOUNT
+
+    await account_cache.delete("id:1")
+    assert await account_cache.get("id:1") is None
+
+
+async def test_hit_miss_counters(account_cache):
+    """Test hits and misses are counted."""
+    await account_cache.get("id:1")
+    await account_cache.set("id:1", ACCOUNT)
+    await account_cache.get("id:1")
+    await account_cache.get("id:1")
+
+    assert account_cache.stats() == {"hits": 2, "misses": 1}
+
+
+async def test_lru_evicts_oldest_entry():
+    """Test the in-process backend keeps at most maxsize entries."""
+    account_cache = cache.LRUAccountCache(maxsize=2, ttl=60)
+    await account_cache.set("id:1", ACCOUNT)
+    await account_cache.set("id:2", ACCOUNT)
+    await account_cache.get("id:1")
+    await account_cache.set("id:3", ACCOUNT)
+
+    assert len(account_cache) == 2
+    assert await account_cache.get("id:2") is None
+    assert await account_cache.get("id:1") is not None
+
+
+async def test_lru_entry_expires():
+    """Test an entry is dropped once its TTL has passed."""
+    account_cache = cache.LRUAccountCache(maxsize=2, ttl=0)
+    await account_cache.set("id:1", ACCOUNT)
+
+    assert await account_cache.get("id:1") is None
+
+
+def test_unknown_backend():
+    """Test an unknown backend name is refused."""
+    with pytest.raises(ValueError):
+        cache.create_account_cache("memcached")
@@ -0,0 +1,60 @@
+import json
+from datetime import timedelta
+
+import pytest
+from unittest.mock import patch
+
+from app import change_feed, crud, schemas
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def feed(session_factory):
+    with patch("app.auth.get_password_hash", return_value="hashed_password"):
+        yield change_feed.ChangeFeed(session_factory, poll_interval=0.01, retention=timedelta(days=1),
+                                     compact_interval=3600)
+
+
+async def register(session_factory, email: str):
+    async with session_factory() as db:
+        await crud.create_account(db, schemas.AccountRegister(name="User", email=email, password="password"))
+
+
+async def test_change_events(feed, session_factory):
+    """Test that the stream sends the logged changes, a heartbeat while idle, and new changes once woken."""
+    await register(session_factory, "user1@example.com")
+    assert await feed.sequence() == 1
+    events = change_feed.change_events(feed, session_factory, since=None, limit=10)
+
+    event = await events.__anext__()
+    assert event.startswith("id: 1\n")
+    assert json.loads(event.split("data: ")[1])["email"] == "user1@example.com"
+
+    with patch("app.change_feed.CHANGE_FEED_HEARTBEAT", 0.01):
+        assert await events.__anext__() == ": heartbeat\n\n"
+
+    # Sequenced by the feed's own polling
+    feed.start()
+    await register(session_factory, "user2@example.com")
+    event = await events.__anext__()
+    assert event.startswith("id: 2\n")
+    await events.aclose()
+    await feed.stop()
+
+
+async def test_change_events_cursor_expired(feed, session_factory):
+    """Test that a stream resuming before the retained log is told to resync."""
+    for index in range(3):
+        await register(session_factory, f"user{index}@example.com")
+    await feed.sequence()
+    feed.retention = timedelta(0)
+    assert await feed.compact() == 3
+
+    await register(session_factory, "user3@example.com")
+    await feed.sequence()
+    events = change_feed.change_events(feed, session_factory, since=2, limit=10)
+    assert await events.__anext__() == "event: expired\ndata: {}\n\n"
+    events = change_feed.change_events(feed, session_factory, since=3, limit=10)
+    assert (await events.__anext__()).startswith("id: 4\n")
+    await events.aclose()
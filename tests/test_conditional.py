@@ -0,0 +1,38 @@
+from datetime import datetime, timedelta
+
+from starlette.requests import Request
+
+from app import conditional
+
+
+def request_with(**headers) -> Request:
+    return Request({
+        "type": "http",
+        "headers": [(name.replace("_", "-").lower().encode(), value.encode()) for name, value in headers.items()],
+    })
+
+
+def test_if_none_match():
+    """Test weak comparison of If-None-Match against the ETag, including lists and the wildcard."""
+    etag = conditional.make_etag(1, datetime(2024, 1, 1))
+
+    assert etag.startswith('W/"') and etag != conditional.make_etag(2, datetime(2024, 1, 1))
+    assert conditional.is_not_modified(request_with(If_None_Match=etag), etag, None)
+    assert conditional.is_not_modified(request_with(If_None_Match=f'"other", {etag[2:]}'), etag, None)
+    assert conditional.is_not_modified(request_with(If_None_Match="*"), etag, None)
+    assert not conditional.is_not_modified(request_with(If_None_Match='"other"'), etag, None)
+
+
+def test_if_modified_since():
+    """Test If-Modified-Since at the whole second of Last-Modified, and that If-None-Match takes precedence."""
+    updated_at = datetime(2024, 1, 1, 12, 0, 0, 500000)
+    last_modified = conditional.validator_headers("etag", updated_at)["Last-Modified"]
+
+    assert conditional.is_not_modified(request_with(If_Modified_Since=last_modified), "etag", updated_at)
+    assert not conditional.is_not_modified(
+        request_with(If_Modified_Since=last_modified), "etag", updated_at + timedelta(seconds=1)
+    )
+    assert not conditional.is_not_modified(
+        request_with(If_Modified_Since=last_modified, If_None_Match='"other"'), "etag", updated_at
+    )
+    assert not conditional.is_not_modified(request_with(If_Modified_Since="yesterday"), "etag", updated_at)
@@ -1,30 +1,11 @@
 import pytest
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from datetime import datetime, timedelta
+from sqlalchemy import event, select, update
+from sqlalchemy.exc import IntegrityError
 from unittest.mock import patch
-from app import models, schemas, crud
+from app import auth, cache, models, schemas, crud
 
-# Create a test SQLite database in memory
-SQLALCHEMY_DATABASE_URL = "sqlite:///:memory:"
-engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False})
-TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-
-models.Base.metadata.create_all(bind=engine)
-
-
-@pytest.fixture(scope="function")
-def db():
-    """Create a new database session for a test."""
-    connection = engine.connect()
-    transaction = connection.begin()
-
-    db = TestingSessionLocal(bind=connection)
-    try:
-        yield db
-    finally:
-        db.close()
-        transaction.rollback()
-        connection.close()
+pytestmark = pytest.mark.anyio
 
 
 @pytest.fixture
@@ -35,13 +16,21 @@ def mock_auth():
 
 
 @pytest.fixture
-def mock_last_login_date():
-    """Fixture to mock set_last_login_date function."""
-    with patch('app.crud.set_last_login_date') as mock_set_last_login_date:
-        yield mock_set_last_login_date
+def statements(db):
+    """Fixture collecting every SQL statement sent to the test database."""
+    executed = []
 
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        executed.append(statement)
 
-def test_create_account_success(db, mock_auth, mock_last_login_date):
+    event.listen(db.bind.sync_engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield executed
+    finally:
+        event.remove(db.bind.sync_engine, "before_cursor_execute", before_cursor_execute)
+
+
+async def test_create_account_success(db, mock_auth):
     """Test create_account with success."""
     mock_auth.return_value = "hashed_password"
 
@@ -51,17 +40,35 @@ def test_create_account_success(db, mock_auth, mock_last_login_date):
         password="plaintextpassword"
     )
 
-    account = crud.create_account(db, account_data)
+    account = await crud.create_account(db, account_data)
 
     assert account.id is not None
     assert account.name == "Test User"
     assert account.email == "test@example.com"
     assert account.hashed_password == "hashed_password"
+    assert account.created_date is not None
+    assert account.last_login_date == account.created_date
 
-    mock_last_login_date.assert_called_once_with(db, email="test@example.com")
 
+async def test_create_account_single_statement(db, mock_auth, statements):
+    """Test create_account runs exactly one SQL statement besides logging the change."""
+    mock_auth.return_value = "hashed_password"
 
-def test_create_account_duplicate_email(db, mock_auth, mock_last_login_date):
+    account_data = schemas.AccountRegister(
+        name="Test User",
+        email="test@example.com",
+        password="plaintextpassword"
+    )
+
+    await crud.create_account(db, account_data)
+
+    # The account, then its entry in the change log, in the same transaction
+    assert len(statements) == 2
+    assert statements[0].startswith("INSERT INTO accounts")
+    assert statements[1].startswith("INSERT INTO account_changes")
+
+
+async def test_create_account_duplicate_email(db, mock_auth):
     """Test create_account with duplicate email."""
     mock_auth.return_value = "hashed_password"
 
@@ -71,17 +78,58 @@ def test_create_account_duplicate_email(db, mock_auth, mock_last_login_date):
         password="plaintextpassword"
     )
 
-    crud.create_account(db, account_data)
+    await crud.create_account(db, account_data)
+
+    with pytest.raises(IntegrityError):
+        await crud.create_account(db, account_data)
+
+
+async def test_create_accounts(db, statements):
+    """Test create_accounts inserts new accounts in one INSERT and reports taken emails."""
+    db.add(models.Account(name="Existing", email="existing@example.com", password="password",
+                          hashed_password="hashedpassword"))
+    await db.commit()
+    statements.clear()
+
+    accounts = [
+        {"name": name, "email": email, "password": "password", "hashed_password": "hashedpassword"}
+        for name, email in [
+            ("User1", "user1@example.com"),
+            ("Existing", "existing@example.com"),
+            ("User2", "user2@example.com"),
+            ("User1 again", "user1@example.com"),
+        ]
+    ]
+    errors = await crud.create_accounts(db, accounts)
+
+    assert errors == [None, "Email already registered", None, "Email already registered"]
+    # One executemany INSERT of the accounts and one INSERT ... SELECT of their change log entries
+    assert [statement.split()[:3] for statement in statements] == [
+        ["SELECT", "accounts.email", "FROM"], ["INSERT", "INTO", "accounts"], ["INSERT", "INTO", "account_changes"]
+    ]
+    assert len(await crud.get_accounts(db)) == 3
 
-    with pytest.raises(Exception):
-        crud.create_account(db, account_data)
+
+async def test_create_accounts_matches_create_account(db, mock_auth):
+    """Test that bulk and single registration set the same defaults."""
+    mock_auth.return_value = "hashed_password"
+    single = await crud.create_account(db, schemas.AccountRegister(name="Single", email="single@example.com",
+                                                                   password="password"))
+    await crud.create_accounts(db, [{"name": "Bulk", "email": "bulk@example.com", "password": "password",
+                                     "hashed_password": "hashed_password"}])
+    bulk = await crud.get_account_by_email(db, "bulk@example.com")
+
+    for column in ("is_active", "created_date", "last_login_date", "updated_at"):
+        assert (getattr(single, column) is None) == (getattr(bulk, column) is None), column
+    assert bulk.is_active is True
+    assert bulk.last_login_date == bulk.created_date
 
 
 @pytest.fixture
-def create_test_account(db: db):
+def create_test_account(db):
     """Fixture to create a test account in the database."""
 
-    def _create_test_account(name, email, password):
+    async def _create_test_account(name, email, password):
         hashed_password = "hashedpassword"
         account = models.Account(
             name=name,
@@ -90,113 +138,511 @@ def create_test_account(db: db):
             hashed_password=hashed_password
         )
         db.add(account)
-        db.commit()
-        db.refresh(account)
+        await db.commit()
+        await db.refresh(account)
         return account
 
     return _create_test_account
 
 
-def test_get_accounts_empty(db: db):
+async def test_get_accounts_empty(db):
     """Test get_accounts when there are no accounts in the database."""
-    accounts = crud.get_accounts(db)
+    accounts = await crud.get_accounts(db)
     assert len(accounts) == 0
 
 
-def test_get_accounts_with_data(db: db, create_test_account):
+async def test_get_accounts_with_data(db, create_test_account):
     """Test get_accounts when there are multiple accounts in the database."""
-    account1 = create_test_account(name="User1", email="user1@example.com", password="password1")
-    account2 = create_test_account(name="User2", email="user2@example.com", password="password2")
+    account1 = await create_test_account(name="User1", email="user1@example.com", password="password1")
+    account2 = await create_test_account(name="User2", email="user2@example.com", password="password2")
 
-    accounts = crud.get_accounts(db)
+    accounts = await crud.get_accounts(db)
     assert len(accounts) == 2
     assert account1 in accounts
     assert account2 in accounts
 
 
-def test_get_account_by_id(db: db, create_test_account):
+async def test_get_accounts_keyset_pagination(db, create_test_account):
+    """Test get_accounts pages through accounts ordered by id."""
+    for index in range(5):
+        await create_test_account(name=f"User{index}", email=f"user{index}@example.com", password="password")
+
+    first_page = await crud.get_accounts(db, limit=2)
+    assert [account.name for account in first_page] == ["User0", "User1"]
+
+    second_page = await crud.get_accounts(db, limit=2, after=first_page[-1].id)
+    assert [account.name for account in second_page] == ["User2", "User3"]
+
+    last_page = await crud.get_accounts(db, limit=2, after=second_page[-1].id)
+    assert [account.name for account in last_page] == ["User4"]
+
+
+async def test_get_account_projections(db, create_test_account, statements):
+    """Test get_account_projections returns response-shaped dicts without selecting the password."""
+    for index in range(3):
+        await create_test_account(name=f"User{index}", email=f"user{index}@example.com", password="password")
+    statements.clear()
+
+    accounts = await crud.get_account_projections(db, limit=2)
+
+    assert [type(account) for account in accounts] == [dict, dict]
+    assert list(accounts[0]) == list(schemas.AccountResponse.model_fields)
+    assert [account["name"] for account in accounts] == ["User0", "User1"]
+    assert [account["name"] for account in await crud.get_account_projections(db, after=accounts[-1]["id"])] == [
+        "User2"
+    ]
+    assert "accounts.password" not in statements[0]
+
+
+async def test_stream_accounts(db, create_test_account):
+    """Test stream_accounts yields every row in chunks of the requested size."""
+    for index in range(5):
+        await create_test_account(name=f"User{index}", email=f"user{index}@example.com", password="password")
+
+    chunks = [chunk async for chunk in crud.stream_accounts(db, chunk_size=2)]
+
+    assert [len(chunk) for chunk in chunks] == [2, 2, 1]
+    assert [row.email for chunk in chunks for row in chunk] == [f"user{index}@example.com" for index in range(5)]
+
+
+async def test_stream_accounts_key_range(db, create_test_account):
+    """Test stream_accounts reads only the ids in (after, until], and get_account_id_bounds."""
+    assert await crud.get_account_id_bounds(db) == (None, None)
+    accounts = [
+        await create_test_account(name=f"User{index}", email=f"user{index}@example.com", password="password")
+        for index in range(5)
+    ]
+
+    chunks = [
+        chunk async for chunk in crud.stream_accounts(
+            db, chunk_size=2, after=accounts[0].id, until=accounts[3].id, columns=[models.Account.id]
+        )
+    ]
+
+    assert [row.id for chunk in chunks for row in chunk] == [account.id for account in accounts[1:4]]
+    assert await crud.get_account_id_bounds(db) == (accounts[0].id, accounts[-1].id)
+
+
+async def test_get_account_by_id(db, create_test_account):
     """Test get_account_by_id with a valid and an invalid ID."""
-    account = create_test_account(name="User1", email="user1@example.com", password="password1")
+    account = await create_test_account(name="User1", email="user1@example.com", password="password1")
 
-    fetched_account = crud.get_account_by_id(db, acc_id=account.id)
+    fetched_account = await crud.get_account_by_id(db, acc_id=account.id)
     assert fetched_account is not None
     assert fetched_account.id == account.id
 
-    non_existent_account = crud.get_account_by_id(db, acc_id=999)
+    non_existent_account = await crud.get_account_by_id(db, acc_id=999)
     assert non_existent_account is None
 
 
-def test_get_account_by_email(db: db, create_test_account):
+async def test_get_account_by_email(db, create_test_account):
     """Test get_account_by_email with a valid and an invalid email."""
-    account = create_test_account(name="User1", email="user1@example.com", password="password1")
+    account = await create_test_account(name="User1", email="user1@example.com", password="password1")
 
-    fetched_account = crud.get_account_by_email(db, email="user1@example.com")
+    fetched_account = await crud.get_account_by_email(db, email="user1@example.com")
     assert fetched_account is not None
     assert fetched_account.email == account.email
 
-    non_existent_account = crud.get_account_by_email(db, email="nonexistent@example.com")
+    non_existent_account = await crud.get_account_by_email(db, email="nonexistent@example.com")
     assert non_existent_account is None
 
 
-def test_update_account_partial_update(db: db, create_test_account):
+async def test_update_account_partial_update(db, create_test_account):
     """Test partially updating an account (only one field)."""
-    create_test_account(name="Test User", email="test@example.com", password="password123")
+    await create_test_account(name="Test User", email="test@example.com", password="password123")
 
     account_update = schemas.AccountPartialUpdate(name="New Name")  # Only updating the name
-    updated_account = crud.update_account(db, email="test@example.com", account_update=account_update)
+    updated_account = await crud.update_account(db, email="test@example.com", account_update=account_update)
 
     assert updated_account is not None
     assert updated_account.name == "New Name"
     assert updated_account.email == "test@example.com"
 
 
-def test_update_account_nonexistent(db: db):
+async def test_update_account_nonexistent(db):
     """Test trying to update a non-existent account."""
     account_update = schemas.AccountPartialUpdate(name="Non-existent User")
-    updated_account = crud.update_account(db, email="nonexistent@example.com", account_update=account_update)
+    updated_account = await crud.update_account(db, email="nonexistent@example.com", account_update=account_update)
 
     assert updated_account is None
 
 
-def test_update_account_no_update(db: db, create_test_account):
+async def test_update_account_no_update(db, create_test_account):
     """Test updating an account with no changes."""
-    create_test_account(name="Test User", email="test@example.com", password="password123")
+    await create_test_account(name="Test User", email="test@example.com", password="password123")
 
     account_update = schemas.AccountPartialUpdate()
-    updated_account = crud.update_account(db, email="test@example.com", account_update=account_update)
+    updated_account = await crud.update_account(db, email="test@example.com", account_update=account_update)
 
     assert updated_account is not None
     assert updated_account.name == "Test User"
     assert updated_account.email == "test@example.com"
 
 
-def test_update_account_multiple_fields(db: db, create_test_account):
+async def test_update_account_multiple_fields(db, create_test_account):
     """Test updating multiple fields of an account."""
-    create_test_account(name="Test User", email="test@example.com", password="password123")
+    await create_test_account(name="Test User", email="test@example.com", password="password123")
 
     account_update = schemas.AccountPartialUpdate(name="Updated Name", password="newpassword")
-    updated_account = crud.update_account(db, email="test@example.com", account_update=account_update)
+    updated_account = await crud.update_account(db, email="test@example.com", account_update=account_update)
 
     assert updated_account is not None
     assert updated_account.name == "Updated Name"
     assert updated_account.email == "test@example.com"
 
 
-def test_delete_account_success(db: db, create_test_account):
+async def test_delete_account_success(db, create_test_account):
     """Test deleting an existing account successfully."""
-    create_test_account(name="Test User", email="test@example.com", password="password123")
+    await create_test_account(name="Test User", email="test@example.com", password="password123")
 
-    deleted_account = crud.delete_account(db, email="test@example.com")
+    deleted_account = await crud.delete_account(db, email="test@example.com")
 
     assert deleted_account is not None
     assert deleted_account.email == "test@example.com"
 
-    account_after_deletion = db.query(models.Account).filter(models.Account.email == "test@example.com").first()
+    account_after_deletion = await db.scalar(select(models.Account).filter(models.Account.email == "test@example.com"))
     assert account_after_deletion is None
 
 
-def test_delete_account_nonexistent(db: db):
+async def test_delete_account_nonexistent(db):
     """Test trying to delete a non-existent account."""
-    deleted_account = crud.delete_account(db, email="nonexistent@example.com")
+    deleted_account = await crud.delete_account(db, email="nonexistent@example.com")
 
     assert deleted_account is None
+
+
+@pytest.fixture
+def account_cache():
+    """Fixture to run crud against an in-process account cache."""
+    with patch('app.crud.account_cache', cache.LRUAccountCache(maxsize=100, ttl=60)) as account_cache:
+        yield account_cache
+
+
+async def test_get_account_read_through_cache(db, create_test_account, account_cache):
+    """Test that repeated lookups are served from the account cache."""
+    account = await create_test_account(name="User1", email="user1@example.com", password="password1")
+
+    first = await crud.get_account_by_email(db, email="user1@example.com")
+    second = await crud.get_account_by_email(db, email="user1@example.com")
+    by_id = await crud.get_account_by_id(db, acc_id=account.id)
+
+    assert first.id == second.id == by_id.id == account.id
+    assert second.hashed_password == account.hashed_password
+    assert account_cache.stats() == {"hits": 2, "misses": 1}
+
+
+async def test_update_account_refreshes_cache(db, create_test_account, account_cache):
+    """Test that update_account replaces the cached account."""
+    account = await create_test_account(name="Test User", email="test@example.com", password="password123")
+    await crud.get_account_by_id(db, acc_id=account.id)
+
+    account_update = schemas.AccountPartialUpdate(name="New Name")
+    await crud.update_account(db, email="test@example.com", account_update=account_update)
+
+    assert (await crud.get_account_by_id(db, acc_id=account.id)).name == "New Name"
+    assert (await crud.get_account_by_email(db, email="test@example.com")).name == "New Name"
+
+
+async def test_delete_account_invalidates_cache(db, create_test_account, account_cache):
+    """Test that delete_account drops the cached account."""
+    account = await create_test_account(name="Test User", email="test@example.com", password="password123")
+    await crud.get_account_by_email(db, email="test@example.com")
+
+    await crud.delete_account(db, email="test@example.com")
+
+    assert await crud.get_account_by_email(db, email="test@example.com") is None
+    assert await crud.get_account_by_id(db, acc_id=account.id) is None
+
+
+async def test_get_account_projection_read_through_cache(db, create_test_account, account_cache):
+    """Test get_account_projection fills and reads the account cache shared with get_account_by_id."""
+    account = await create_test_account(name="User1", email="user1@example.com", password="password1")
+
+    first = await crud.get_account_projection(db, acc_id=account.id)
+    second = await crud.get_account_projection(db, acc_id=account.id)
+    by_email = await crud.get_account_by_email(db, email="user1@example.com")
+
+    assert first == second
+    assert first["email"] == by_email.email == "user1@example.com"
+    assert "password" not in first
+    assert await crud.get_account_projection(db, acc_id=account.id + 1) is None
+    assert account_cache.stats() == {"hits": 2, "misses": 2}
+
+
+async def test_replica_reads_do_not_fill_cache(db, create_test_account, account_cache):
+    """Test that a replica read cannot put back an account a write uncached, while it still reads the cache."""
+    account = await create_test_account(name="User1", email="user1@example.com", password="password1")
+    db.info["role"] = "replica"
+
+    assert (await crud.get_account_projection(db, acc_id=account.id))["email"] == "user1@example.com"
+    assert (await crud.get_account_by_email(db, email="user1@example.com")).id == account.id
+    assert await account_cache.peek(f"id:{account.id}") is None
+    assert await account_cache.peek("email:user1@example.com") is None
+
+    db.info["role"] = "primary"
+    await crud.get_account_by_id(db, acc_id=account.id)
+    db.info["role"] = "replica"
+    await crud.get_account_projection(db, acc_id=account.id)
+    assert account_cache.stats() == {"hits": 1, "misses": 3}
+
+
+async def test_rehash_password(db, create_test_account, mock_auth, account_cache):
+    """Test that an outdated hash is replaced unless it changed since it was verified."""
+    account = await create_test_account(name="User1", email="user1@example.com", password="password1")
+    await crud.get_account_by_id(db, acc_id=account.id)
+    mock_auth.return_value = "rehashed_password"
+
+    assert await crud.rehash_password(db, account, "password1") is True
+    stored = await db.scalar(select(models.Account.hashed_password).filter(models.Account.id == account.id))
+    assert stored == "rehashed_password"
+    assert await account_cache.peek(f"id:{account.id}") is None
+
+    # The verified hash is no longer the stored one, e.g. after a password change
+    assert await crud.rehash_password(db, account, "password1") is False
+
+
+async def test_rotate_refresh_token(db, create_test_account, statements):
+    """Test that a refresh token is rotated with one lookup, and that reusing it revokes its family."""
+    account = await create_test_account(name="User1", email="user1@example.com", password="password1")
+    token = await crud.create_refresh_token(db, account.id)
+    statements.clear()
+
+    email, rotated = await crud.rotate_refresh_token(db, token)
+    assert email == "user1@example.com"
+    assert [statement.split()[0] for statement in statements] == ["SELECT", "UPDATE", "INSERT"]
+    assert await crud.rotate_refresh_token(db, "unknown-token") is None
+
+    with pytest.raises(crud.RefreshTokenReused):
+        await crud.rotate_refresh_token(db, token)
+    # The token rotated in from the reused one was revoked with it
+    assert await crud.rotate_refresh_token(db, rotated) is None
+
+
+async def test_purge_expired_refresh_tokens(db, create_test_account):
+    """Test that expired refresh tokens are rejected and then purged, while live ones are kept."""
+    account = await create_test_account(name="User1", email="user1@example.com", password="password1")
+    expired = await crud.create_refresh_token(db, account.id)
+    live = await crud.create_refresh_token(db, account.id)
+    await db.execute(
+        update(models.RefreshToken)
+        .where(models.RefreshToken.token_hash == auth.refresh_token_digest(expired))
+        .values(expires_at=datetime.now() - timedelta(seconds=1))
+    )
+    await db.commit()
+
+    assert await crud.rotate_refresh_token(db, expired) is None
+    assert await crud.purge_expired_refresh_tokens(db) == 1
+    assert await crud.rotate_refresh_token(db, live) is not None
+
+
+async def test_get_account_projections_by_ids_and_emails(db, create_test_account, statements):
+    """Test that batch lookups keep the order of the keys, mark missing ones and query once per chunk."""
+    accounts = [
+        await create_test_account(name=f"User{index}", email=f"user{index}@example.com", password="password")
+        for index in range(3)
+    ]
+    statements.clear()
+
+    with patch("app.crud.LOOKUP_CHUNK_SIZE", 2):
+        found = await crud.get_account_projections_by_ids(db, [accounts[2].id, 999, accounts[0].id, accounts[1].id,
+                                                               accounts[2].id])
+
+    assert [account and account["name"] for account in found] == ["User2", None, "User0", "User1", "User2"]
+    assert set(found[0]) == set(schemas.AccountResponse.model_fields)
+    assert [statement.split()[0] for statement in statements] == ["SELECT", "SELECT"]
+
+    found = await crud.get_account_projections_by_emails(db, ["user1@example.com", "missing@example.com"])
+    assert [account and account["id"] for account in found] == [accounts[1].id, None]
+
+
+async def test_get_account_projections_by_emails_case_insensitive(db, create_test_account):
+    """Test that an email matched by a case-insensitive collation is paired with the key as it was sent."""
+    # Rebuild the table with the case-insensitive comparison of the MySQL collations
+    accounts = models.Account.__table__
+    with patch.object(accounts.c.email.type, "collation", "NOCASE"):
+        async with db.bind.begin() as connection:
+            await connection.run_sync(lambda sync: accounts.drop(sync))
+            await connection.run_sync(lambda sync: accounts.create(sync))
+    account = await create_test_account(name="User1", email="user1@example.com", password="password")
+
+    with patch("app.crud.CASE_INSENSITIVE_EMAIL_DIALECTS", {"sqlite"}):
+        found = await crud.get_account_projections_by_emails(db, ["User1@Example.com", "user1@example.com"])
+
+    assert [match and match["id"] for match in found] == [account.id, account.id]
+
+
+async def test_get_account_projections_by_emails_case_sensitive(db, create_test_account):
+    """Test that with a case-sensitive collation emails differing only in case are different accounts."""
+    lower = await create_test_account(name="Lower", email="a@example.com", password="password")
+    upper = await create_test_account(name="Upper", email="A@example.com", password="password")
+
+    found = await crud.get_account_projections_by_emails(db, ["a@example.com", "A@example.com", "a@EXAMPLE.com"])
+
+    assert [match and match["id"] for match in found] == [lower.id, upper.id, None]
+
+
+async def test_writes_set_updated_at(db, create_test_account, mock_auth):
+    """Test that every write moves updated_at, and with it the version of the pages holding the account."""
+    mock_auth.return_value = "hashed_password"
+    account = await crud.create_account(db, schemas.AccountRegister(name="User1", email="user1@example.com",
+                                                                    password="password1"))
+    versions = [await crud.get_account_projections_version(db, limit=10)]
+
+    await crud.update_account(db, "user1@example.com", schemas.AccountPartialUpdate(name="Renamed"))
+    versions.append(await crud.get_account_projections_version(db, limit=10))
+    await crud.set_last_login_dates(db, {"user1@example.com": datetime.now()})
+    versions.append(await crud.get_account_projections_version(db, limit=10))
+    await crud.rehash_password(db, account, "password1")
+    versions.append(await crud.get_account_projections_version(db, limit=10))
+    await crud.create_accounts(db, [{"name": "User2", "email": "user2@example.com", "password": "password2",
+                                     "hashed_password": "hashed_password"}])
+    versions.append(await crud.get_account_projections_version(db, limit=10))
+
+    assert len(set(versions)) == len(versions)
+    assert [count for count, _, _ in versions] == [1, 1, 1, 1, 2]
+    assert versions[-1][2] == await crud.get_account_updated_at(db, acc_id=account.id + 1)
+    assert await crud.get_account_updated_at(db, acc_id=999) is None
+
+
+async def test_writes_are_logged(db, create_test_account, mock_auth):
+    """Test that every account write appends to the change log, which is read in order with the current state."""
+    mock_auth.return_value = "hashed_password"
+    await crud.create_account(db, schemas.AccountRegister(name="User1", email="user1@example.com",
+                                                          password="password1"))
+    await crud.create_accounts(db, [{"name": "User2", "email": "user2@example.com", "password": "password2",
+                                     "hashed_password": "hashed_password"}])
+    await crud.update_account(db, "user1@example.com", schemas.AccountPartialUpdate(name="Renamed"))
+    await crud.set_last_login_dates(db, {"user2@example.com": datetime.now()})
+    await crud.delete_account(db, "user2@example.com")
+
+    # Nothing is readable before it is sequenced
+    assert await crud.get_account_changes(db, since=None, limit=10) == []
+    assert await crud.sequence_account_changes(db, limit=100) == 5
+
+    changes = await crud.get_account_changes(db, since=None, limit=10)
+    assert [(change["operation"], change["email"]) for change in changes] == [
+        ("create", "user1@example.com"), ("create", "user2@example.com"), ("update", "user1@example.com"),
+        ("update", "user2@example.com"), ("delete", "user2@example.com"),
+    ]
+    assert changes[0]["account"]["name"] == "Renamed"
+    assert changes[1]["account"] is None
+
+    assert await crud.get_account_changes(db, since=changes[2]["id"], limit=1) == changes[3:4]
+
+
+async def test_sequence_account_changes(db):
+    """Test that changes are positioned in the order they became visible, not in the order of their ids."""
+    now = datetime.now()
+
+    def change(change_id):
+        return models.AccountChange(id=change_id, account_id=change_id, operation="update",
+                                    email=f"user{change_id}@example.com", changed_at=now)
+
+    # Id 2 commits first, id 1 was allocated earlier but commits later
+    db.add(change(2))
+    await db.commit()
+    assert await crud.sequence_account_changes(db, limit=100) == 1
+    db.add_all([change(1), change(3)])
+    await db.commit()
+    assert await crud.sequence_account_changes(db, limit=1) == 1
+    assert await crud.sequence_account_changes(db, limit=100) == 1
+    assert await crud.sequence_account_changes(db, limit=100) == 0
+
+    changes = await crud.get_account_changes(db, since=None, limit=10)
+    assert [(change["id"], change["account_id"]) for change in changes] == [(1, 2), (2, 1), (3, 3)]
+    assert await crud.get_account_changes_bounds(db) == (0, 3)
+
+
+async def test_compact_account_changes(db):
+    """Test that compaction deletes expired sequenced changes only and records the highest seq deleted."""
+    now = datetime.now()
+    db.add_all([
+        models.AccountChange(id=change_id, seq=seq, account_id=1, operation="update", email="user@example.com",
+                             changed_at=changed_at)
+        for change_id, seq, changed_at in (
+            (1, 1, now - timedelta(days=2)), (2, 2, now - timedelta(days=2)), (3, 3, now),
+            # Not sequenced yet
+            (4, None, now - timedelta(days=2)),
+        )
+    ])
+    await db.execute(update(models.AccountChangeLogState).values(sequenced_through=3))
+    await db.commit()
+    assert await crud.get_account_changes_bounds(db) == (0, 3)
+
+    assert await crud.compact_account_changes(db, older_than=now - timedelta(days=3)) == 0
+    assert await crud.compact_account_changes(db, older_than=now - timedelta(days=1)) == 2
+    assert await crud.get_account_changes_bounds(db) == (2, 3)
+    assert [change["id"] for change in await crud.get_account_changes(db, since=2, limit=10)] == [3]
+
+    assert await crud.compact_account_changes(db, older_than=now + timedelta(days=1)) == 1
+    assert await crud.get_account_changes_bounds(db) == (3, 3)
+    # Sequenced after the newest change was compacted, the position is still never reused
+    assert await crud.sequence_account_changes(db, limit=100) == 1
+    assert [change["id"] for change in await crud.get_account_changes(db, since=3, limit=10)] == [4]
+
+
+@pytest.fixture(params=[True, False], ids=["returning", "fallback"])
+def returning(request):
+    """Run a test with and without RETURNING support of the database."""
+    with patch("app.crud._supports_returning", return_value=request.param):
+        yield request.param
+
+
+async def test_update_and_delete_account_single_statement(db, create_test_account, account_cache, returning,
+                                                          statements):
+    """Test that an update or delete is one statement with RETURNING, plus a SELECT without it."""
+    account = await create_test_account(name="Test User", email="test@example.com", password="password123")
+    await crud.get_account_by_id(db, acc_id=account.id)
+    statements.clear()
+
+    updated = await crud.update_account(db, "test@example.com", schemas.AccountPartialUpdate(name="New Name"))
+
+    assert (updated.id, updated.name, updated.email) == (account.id, "New Name", "test@example.com")
+    expected = ["UPDATE", "INSERT"] if returning else ["UPDATE", "SELECT", "INSERT"]
+    assert [statement.split()[0] for statement in statements] == expected
+    assert (await account_cache.peek(f"id:{account.id}"))["name"] == "New Name"
+    statements.clear()
+
+    deleted = await crud.delete_account(db, "test@example.com")
+
+    assert (deleted.id, deleted.name) == (account.id, "New Name")
+    expected = ["DELETE", "INSERT"] if returning else ["SELECT", "DELETE", "INSERT"]
+    assert [statement.split()[0] for statement in statements] == expected
+    assert await account_cache.peek(f"id:{account.id}") is None
+    assert await crud.update_account(db, "test@example.com", schemas.AccountPartialUpdate(name="Gone")) is None
+    assert await crud.delete_account(db, "test@example.com") is None
+
+
+async def test_set_accounts_active_and_delete_accounts(db, create_test_account, account_cache, returning,
+                                                      statements):
+    """Test deactivating by filter and deleting by emails with set-based statements, uncaching the accounts."""
+    accounts = [
+        await create_test_account(name=name, email=f"{name.lower()}@example.com", password="password")
+        for name in ("Alice", "Albert", "Bob")
+    ]
+    await db.execute(update(models.Account).values(is_active=True))
+    await db.commit()
+    await crud.get_account_by_id(db, acc_id=accounts[0].id)
+    statements.clear()
+
+    assert await crud.set_accounts_active(db, schemas.AccountSearch(name_prefix="Al"), is_active=False) == 2
+    # Logged after the write, from its keys
+    expected = ["UPDATE", "INSERT"] if returning else ["SELECT", "UPDATE", "INSERT"]
+    assert [statement.split()[0] for statement in statements] == expected
+    assert await crud.set_accounts_active(db, schemas.AccountSearch(name_prefix="Al"), is_active=False) == 0
+    assert await account_cache.peek(f"id:{accounts[0].id}") is None
+    inactive = await db.scalars(select(models.Account.name).filter(models.Account.is_active.is_(False)))
+    assert sorted(inactive.all()) == ["Albert", "Alice"]
+
+    statements.clear()
+    assert await crud.delete_accounts(db, ["alice@example.com", "bob@example.com", "nobody@example.com"]) == 2
+    expected = ["DELETE", "INSERT"] if returning else ["SELECT", "DELETE", "INSERT"]
+    assert [statement.split()[0] for statement in statements] == expected
+    assert (await crud.get_accounts(db))[0].name == "Albert"
+    await crud.sequence_account_changes(db, limit=100)
+    changes = await crud.get_account_changes(db, since=None, limit=10)
+    # Each set-based write logs its accounts in no particular order
+    assert sorted((change["operation"], change["email"]) for change in changes) == [
+        ("delete", "alice@example.com"), ("delete", "bob@example.com"),
+        ("update", "albert@example.com"), ("update", "alice@example.com"),
+    ]
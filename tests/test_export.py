@@ -0,0 +1,104 @@
+import csv
+import gzip
+import json
+import os
+
+import orjson
+import pytest
+from sqlalchemy import create_engine
+from unittest.mock import patch
+
+from app import export, models
+
+
+@pytest.fixture
+def db_url(tmp_path):
+    """A SQLite database file holding 10 accounts, with ids 1 to 10."""
+    url = f"sqlite:///{tmp_path / 'export.db'}"
+    engine = create_engine(url)
+    models.Base.metadata.create_all(engine)
+    with engine.begin() as connection:
+        connection.execute(models.Account.__table__.insert(), [
+            {"name": f"User{index}", "email": f"user{index}@example.com", "password": "password",
+             "hashed_password": "hashedpassword", "is_active": index % 2 == 0}
+            for index in range(10)
+        ])
+    engine.dispose()
+    return url
+
+
+def read_ndjson(paths) -> list:
+    rows = []
+    for path in paths:
+        with gzip.open(path) as file:
+            rows.extend(orjson.loads(line) for line in file)
+    return rows
+
+
+def test_split_key_ranges():
+    """Test that the key ranges cover every id once, and that an empty table has none."""
+    assert export.split_key_ranges(1, 10, 3) == [(0, 4), (4, 8), (8, 10)]
+    assert export.split_key_ranges(5, 5, 4) == [(4, 5)]
+    assert export.split_key_ranges(None, None, 4) == []
+
+
+def test_export_ndjson(db_url, tmp_path):
+    """Test exporting every account once, in id order, without the credentials."""
+    files = export.export(db_url, str(tmp_path / "out"), workers=1, parts=3, chunk_size=2)
+
+    assert [rows for _, rows in files] == [4, 4, 2]
+    rows = read_ndjson(path for path, _ in files)
+    assert [row["id"] for row in rows] == list(range(1, 11))
+    assert set(rows[0]) == {column.key for column in export.EXPORT_COLUMNS}
+    assert "password" not in rows[0] and "hashed_password" not in rows[0]
+
+
+def test_export_csv_in_parallel(db_url, tmp_path):
+    """Test exporting key ranges from several processes, each part a CSV file with a header."""
+    output_dir = str(tmp_path / "out")
+    files = export.export(db_url, output_dir, fmt="csv", workers=2, parts=2, chunk_size=3)
+
+    ids = []
+    for path, _ in files:
+        with gzip.open(path, "rt", newline="") as file:
+            rows = list(csv.DictReader(file))
+        ids.extend(int(row["id"]) for row in rows)
+    assert ids == list(range(1, 11))
+    with open(os.path.join(output_dir, export.MANIFEST)) as file:
+        assert json.load(file)["ranges"] == [[0, 5], [5, 10]]
+
+
+def test_export_resumes_from_last_exported_id(db_url, tmp_path):
+    """Test that a resumed export drops what was written past the last checkpoint and repeats no row."""
+    output_dir = str(tmp_path / "out")
+    encoded = []
+
+    def fail_after_two_chunks(rows):
+        if len(encoded) == 2:
+            raise ConnectionError("lost the database")
+        encoded.append(rows)
+        return export.encode_ndjson(rows)
+
+    with patch.dict(export.ENCODERS, {"ndjson": fail_after_two_chunks}), pytest.raises(ConnectionError):
+        export.export(db_url, output_dir, workers=1, parts=1, chunk_size=3)
+    path = export.part_path(output_dir, 0, "ndjson", export.EXPORT_COMPRESSLEVEL)
+    assert export.read_progress(path, 0)["last_id"] == 6
+    # A chunk cut short by the crash
+    with open(path, "ab") as file:
+        file.write(gzip.compress(b'{"id": 7}\n')[:10])
+
+    files = export.export(db_url, output_dir, workers=1, chunk_size=3, resume=True)
+
+    assert files == [(path, 10)]
+    assert [row["id"] for row in read_ndjson([path])] == list(range(1, 11))
+    assert export.export(db_url, output_dir, workers=1, resume=True) == [(path, 10)]
+
+
+def test_export_uncompressed(db_url, tmp_path):
+    """Test that compresslevel 0 writes plain NDJSON files."""
+    files = export.export(db_url, str(tmp_path / "out"), workers=1, parts=1, compresslevel=0)
+
+    path, rows = files[0]
+    assert not path.endswith(".gz") and rows == 10
+    with open(path, "rb") as file:
+        assert len(file.read().splitlines()) == 10
@@ -0,0 +1,145 @@
+import anyio
+import httpx
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from unittest.mock import patch
+
+from app import git_auth
+
+pytestmark = pytest.mark.anyio
+
+
+class FakeGitHub:
+    """Mock transport answering the token exchange and /user calls, counting them."""
+
+    def __init__(self):
+        self.calls = []
+        self.fail = None
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        self.calls.append(request.url.path)
+        if self.fail == "timeout":
+            raise httpx.ReadTimeout("timed out", request=request)
+        if self.fail == "error":
+            return httpx.Response(502)
+        if request.url.path == "/login/oauth/access_token":
+            code = dict(httpx.QueryParams(request.content.decode()))["code"]
+            return httpx.Response(200, json={"access_token": f"token-{code}"} if code != "bad" else {})
+        return httpx.Response(200, json={"login": "octocat", "token": request.headers["Authorization"]})
+
+
+@pytest.fixture
+def fake_github():
+    return FakeGitHub()
+
+
+@pytest.fixture
+def github(fake_github):
+    return git_auth.GitHubClient(
+        transport=httpx.MockTransport(fake_github),
+        breaker=git_auth.CircuitBreaker(failure_threshold=2, reset_timeout=30),
+    )
+
+
+async def test_get_user(github, fake_github):
+    """Test that the profile of an access token is fetched with that token."""
+    first = await github.get_user("token-a")
+    other = await github.get_user("token-b")
+
+    assert first == {"login": "octocat", "token": "Bearer token-a"}
+    assert other["token"] == "Bearer token-b"
+    assert fake_github.calls == ["/user", "/user"]
+    await github.aclose()
+
+
+async def test_client_is_shared(github):
+    """Test that every call goes through the same pooled client until it is closed."""
+    await github.exchange_code("a")
+    client = github._client
+    await github.get_user("token-a")
+
+    assert github._client is client
+    await github.aclose()
+    assert client.is_closed
+
+
+async def test_circuit_opens_after_failures(github, fake_github):
+    """Test that consecutive timeouts and 5xx open the circuit and further calls fail without a request."""
+    fake_github.fail = "timeout"
+    with pytest.raises(git_auth.GitHubUnavailable):
+        await github.exchange_code("a")
+    fake_github.fail = "error"
+    with pytest.raises(git_auth.GitHubUnavailable):
+        await github.exchange_code("a")
+
+    fake_github.fail = None
+    with pytest.raises(git_auth.GitHubUnavailable) as exc_info:
+        await github.exchange_code("a")
+
+    assert github.breaker.state == "open"
+    assert len(fake_github.calls) == 2
+    assert 1 <= exc_info.value.retry_after <= 30
+    await github.aclose()
+
+
+async def test_circuit_half_open_trial(github, fake_github):
+    """Test that after the reset timeout one trial call closes the circuit again."""
+    fake_github.fail = "error"
+    for _ in range(2):
+        with pytest.raises(git_auth.GitHubUnavailable):
+            await github.exchange_code("a")
+    fake_github.fail = None
+
+    with patch("app.git_auth.time.monotonic", return_value=github.breaker.opened_at + 31):
+        assert github.breaker.state == "half-open"
+        assert await github.exchange_code("a") == "token-a"
+
+    assert github.breaker.state == "closed"
+    await github.aclose()
+
+
+async def test_cancelled_trial_is_released(github, fake_github):
+    """Test that a cancelled half-open trial neither re-opens the circuit nor blocks the next trial."""
+    fake_github.fail = "error"
+    for _ in range(2):
+        with pytest.raises(git_auth.GitHubUnavailable):
+            await github.exchange_code("a")
+    # Past the reset timeout without patching the clock, which the cancel scope below relies on
+    github.breaker.opened_at -= 31
+    opened_at = github.breaker.opened_at
+
+    async def hang(request: httpx.Request) -> httpx.Response:
+        await anyio.sleep_forever()
+
+    hanging = git_auth.GitHubClient(transport=httpx.MockTransport(hang), breaker=github.breaker)
+    with anyio.move_on_after(0.05):
+        await hanging.exchange_code("a")
+
+    assert github.breaker.opened_at == opened_at
+    assert github.breaker.state == "half-open"
+    fake_github.fail = None
+    assert await github.exchange_code("a") == "token-a"
+    assert github.breaker.state == "closed"
+    await hanging.aclose()
+    await github.aclose()
+
+
+def test_callback_endpoint(github, fake_github):
+    """Test the OAuth callback exchanges the code, returns the profile and maps outages to 503."""
+    app = FastAPI()
+    app.include_router(git_auth.router)
+    client = TestClient(app)
+
+    with patch("app.git_auth.github", github):
+        response = client.get("/auth/callback", params={"code": "a"})
+        assert response.status_code == 200
+        assert response.json() == {"user_info": {"login": "octocat", "token": "Bearer token-a"}}
+
+        assert client.get("/auth/callback", params={"code": "bad"}).status_code == 400
+
+        fake_github.fail = "error"
+        client.get("/auth/callback", params={"code": "a"})
+        response = client.get("/auth/callback", params={"code": "a"})
+        assert response.status_code == 503
+        assert int(response.headers["Retry-After"]) >= 1
@@ -0,0 +1,47 @@
+import asyncio
+import time
+
+import pytest
+from unittest.mock import patch
+from app import hashing
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def hasher():
+    """Create a small hasher that is shut down after the test."""
+    hasher = hashing.PasswordHasher(workers=1, queue_size=0, queue_timeout=0.1)
+    try:
+        yield hasher
+    finally:
+        hasher.shutdown()
+
+
+async def test_hash_and_verify(hasher):
+    """Test that a hash produced by the pool verifies against its password."""
+    hashed_password = await hasher.hash("password123")
+
+    assert hashed_password != "password123"
+    assert await hasher.verify("password123", hashed_password) is True
+    assert await hasher.verify("wrongpassword", hashed_password) is False
+    assert hasher.in_flight == 0
+
+
+async def test_hash_overloaded(hasher):
+    """Test that a job waiting longer than the queue timeout is rejected."""
+    def slow_hash(password):
+        time.sleep(0.5)
+        return "hashed_password"
+
+    with patch('app.auth.get_password_hash', side_effect=slow_hash):
+        results = await asyncio.gather(hasher.hash("first"), hasher.hash("second"), return_exceptions=True)
+
+    assert results[0] == "hashed_password"
+    assert isinstance(results[1], hashing.HashingOverloaded)
+
+
+def test_unknown_pool():
+    """Test that an unknown pool type is refused."""
+    with pytest.raises(ValueError):
+        hashing.PasswordHasher(workers=1, pool="fibers")
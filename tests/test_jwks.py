@@ -0,0 +1,117 @@
+import httpx
+import pytest
+from cryptography.hazmat.primitives.asymmetric import ec
+from jose import JWTError
+from unittest.mock import patch
+
+from app import auth, jwks
+from .test_auth import write_key
+
+pytestmark = pytest.mark.anyio
+
+
+class FakeIssuer:
+    """Mock transport serving the JWKS of a key set, counting the fetches."""
+
+    def __init__(self, key_set: auth.KeySet):
+        self.key_set = key_set
+        self.fetches = 0
+        self.fail = False
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        self.fetches += 1
+        if self.fail:
+            return httpx.Response(503)
+        return httpx.Response(200, content=self.key_set.document, headers={"Cache-Control": "public, max-age=300"})
+
+
+@pytest.fixture
+def key_sets(tmp_path):
+    """Key sets before and after a new key was rotated in, and one the issuer never had."""
+    old, new, stranger = (
+        write_key(tmp_path / f"{name}.pem", ec.generate_private_key(ec.SECP256R1()))
+        for name in ("old", "new", "stranger")
+    )
+    return {
+        "old": auth.KeySet.from_files(old),
+        "rotated": auth.KeySet.from_files(f"{new},{old}"),
+        "stranger": auth.KeySet.from_files(stranger),
+    }
+
+
+def sign(key_set: auth.KeySet) -> str:
+    with patch("app.auth._key_set", key_set):
+        return auth.create_access_token({"sub": "user@example.com"})
+
+
+@pytest.fixture
+def clock():
+    """Freeze the monotonic clock, moved by assigning clock.now."""
+    class Clock:
+        now = 1000.0
+
+    with patch("app.jwks.time.monotonic", side_effect=lambda: Clock.now):
+        yield Clock
+
+
+def create_verifier(issuer: FakeIssuer) -> jwks.JWKSVerifier:
+    return jwks.JWKSVerifier("https://issuer/.well-known/jwks.json", transport=httpx.MockTransport(issuer))
+
+
+async def test_keys_cached_for_max_age(key_sets, clock):
+    """Test that tokens are verified locally until the key set goes stale."""
+    issuer = FakeIssuer(key_sets["old"])
+    verifier = create_verifier(issuer)
+    token = sign(key_sets["old"])
+
+    for _ in range(3):
+        assert (await verifier.verify(token))["sub"] == "user@example.com"
+    assert issuer.fetches == 1
+
+    clock.now += 300
+    await verifier.verify(token)
+    assert issuer.fetches == 2
+    await verifier.aclose()
+
+
+async def test_unknown_kid_refetches_at_most_once_per_interval(key_sets, clock):
+    """Test that a rotated in key is picked up early, while unknown kids cannot trigger a fetch per token."""
+    issuer = FakeIssuer(key_sets["old"])
+    verifier = create_verifier(issuer)
+    await verifier.verify(sign(key_sets["old"]))
+
+    issuer.key_set = key_sets["rotated"]
+    clock.now += jwks.MIN_REFRESH_INTERVAL
+    assert (await verifier.verify(sign(key_sets["rotated"])))["sub"] == "user@example.com"
+    assert issuer.fetches == 2
+
+    forged = sign(key_sets["stranger"])
+    for _ in range(3):
+        with pytest.raises(JWTError):
+            await verifier.verify(forged)
+    assert issuer.fetches == 2
+    await verifier.aclose()
+
+
+async def test_stale_keys_kept_while_issuer_unavailable(key_sets, clock):
+    """Test that the cached keys keep verifying when a refresh fails, and that nothing verifies without keys."""
+    issuer = FakeIssuer(key_sets["old"])
+    verifier = create_verifier(issuer)
+    token = sign(key_sets["old"])
+    await verifier.verify(token)
+
+    issuer.fail = True
+    clock.now += 300
+    assert (await verifier.verify(token))["sub"] == "user@example.com"
+    assert issuer.fetches == 2
+
+    with pytest.raises(httpx.HTTPError):
+        await create_verifier(issuer).verify(token)
+    await verifier.aclose()
+
+
+def test_parse_max_age():
+    """Test reading max-age from Cache-Control, with a default when it is missing."""
+    assert jwks.parse_max_age("public, max-age=600", default=300) == 600
+    assert jwks.parse_max_age("no-store", default=300) == 300
+    assert jwks.parse_max_age(None, default=300) == 300
@@ -0,0 +1,118 @@
+import asyncio
+from datetime import datetime
+
+import pytest
+from sqlalchemy import event, select
+from app import models
+from app.login_buffer import LastLoginBuffer
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+async def session_factory(session_factory):
+    """The fresh in-memory database, holding three accounts."""
+    async with session_factory() as db:
+        for index in range(3):
+            db.add(models.Account(
+                name=f"User{index}",
+                email=f"user{index}@example.com",
+                password="password",
+                hashed_password="hashedpassword",
+            ))
+        await db.commit()
+    return session_factory
+
+
+async def last_login_dates(session_factory):
+    async with session_factory() as db:
+        rows = await db.execute(select(models.Account.email, models.Account.last_login_date))
+        return dict(rows.all())
+
+
+async def test_flush_writes_pending_logins_in_one_statement(session_factory):
+    """Test that a flush writes every pending login with a single UPDATE and logs them with a single INSERT."""
+    buffer = LastLoginBuffer(session_factory, flush_interval=60, max_size=100)
+    first_login = datetime(2024, 8, 24, 12, 0, 0)
+    second_login = datetime(2024, 8, 24, 13, 0, 0)
+    buffer.add("user0@example.com", first_login)
+    buffer.add("user1@example.com", first_login)
+    buffer.add("user0@example.com", second_login)
+    assert buffer.depth == 2
+
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    sync_engine = session_factory.kw["bind"].sync_engine
+    event.listen(sync_engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        assert await buffer.flush() == 2
+    finally:
+        event.remove(sync_engine, "before_cursor_execute", before_cursor_execute)
+
+    # Plus one INSERT ... SELECT logging the changes
+    assert len(statements) == 2
+    assert statements[0].startswith("UPDATE accounts")
+    assert statements[1].startswith("INSERT INTO account_changes")
+    assert buffer.depth == 0
+    assert await last_login_dates(session_factory) == {
+        "user0@example.com": second_login,
+        "user1@example.com": first_login,
+        "user2@example.com": None,
+    }
+
+
+async def test_flush_when_buffer_is_full(session_factory):
+    """Test that reaching max_size triggers a flush without waiting for the interval."""
+    buffer = LastLoginBuffer(session_factory, flush_interval=60, max_size=2)
+    buffer.add("user0@example.com")
+    buffer.add("user1@example.com")
+
+    await asyncio.sleep(0.1)
+
+    assert buffer.depth == 0
+    dates = await last_login_dates(session_factory)
+    assert dates["user0@example.com"] is not None
+    assert dates["user1@example.com"] is not None
+
+
+async def test_stop_flushes_pending_logins(session_factory):
+    """Test that stopping the buffer flushes what is still pending."""
+    buffer = LastLoginBuffer(session_factory, flush_interval=60, max_size=100)
+    buffer.start()
+    buffer.add("user2@example.com")
+
+    await buffer.stop()
+
+    assert buffer.depth == 0
+    assert (await last_login_dates(session_factory))["user2@example.com"] is not None
+
+
+async def test_failed_flush_keeps_logins(session_factory):
+    """Test that logins survive a failed flush."""
+    def broken_session_factory():
+        raise ConnectionError("database is gone")
+
+    buffer = LastLoginBuffer(broken_session_factory, flush_interval=60, max_size=100)
+    buffer.add("user0@example.com")
+
+    with pytest.raises(ConnectionError):
+        await buffer.flush()
+
+    assert buffer.depth == 1
+
+
+async def test_failed_flush_when_buffer_is_full_is_logged(session_factory, caplog):
+    """Test that a size-triggered flush, which nobody awaits, logs its failure and keeps the logins."""
+    def broken_session_factory():
+        raise ConnectionError("database is gone")
+
+    buffer = LastLoginBuffer(broken_session_factory, flush_interval=60, max_size=1)
+    buffer.add("user0@example.com")
+    await asyncio.sleep(0.1)
+
+    assert buffer.depth == 1
+    assert "Failed to flush 1 last login dates" in caplog.text
+    assert "database is gone" in caplog.text
@@ -0,0 +1,113 @@
+import itertools
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.pool import StaticPool
+from unittest.mock import patch
+
+from app import metrics
+from app.database import instrument_engine
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    """Point the module-level metrics used by the middleware at a fresh registry."""
+    registry = metrics.Registry()
+    for name, metric in vars(metrics).items():
+        if isinstance(metric, metrics.Metric):
+            if isinstance(metric, metrics.Histogram):
+                fresh = metrics.Histogram(metric.name, metric.documentation, metric.labelnames, registry,
+                                          metric.buckets)
+            else:
+                fresh = type(metric)(metric.name, metric.documentation, metric.labelnames, registry)
+            monkeypatch.setattr(metrics, name, fresh)
+    return registry
+
+
+def test_histogram_render():
+    """Test that histograms render cumulative buckets, sum and count."""
+    registry = metrics.Registry()
+    histogram = metrics.Histogram("latency_seconds", "Latency.", ["route"], registry, buckets=(0.1, 1))
+    histogram.observe(0.05, "/a")
+    histogram.observe(0.1, "/a")
+    histogram.observe(5, "/a")
+
+    assert registry.render().splitlines() == [
+        "# HELP latency_seconds Latency.",
+        "# TYPE latency_seconds histogram",
+        'latency_seconds_bucket{route="/a",le="0.1"} 2',
+        'latency_seconds_bucket{route="/a",le="1"} 2',
+        'latency_seconds_bucket{route="/a",le="+Inf"} 3',
+        'latency_seconds_sum{route="/a"} 5.15',
+        'latency_seconds_count{route="/a"} 3',
+    ]
+
+
+def test_counter_and_gauge_render():
+    """Test counter labels are escaped and function gauges are read at render time."""
+    registry = metrics.Registry()
+    counter = metrics.Counter("events_total", "Events.", ["kind"], registry)
+    counter.inc('say "hi"\n')
+    counter.inc('say "hi"\n', amount=2)
+    depth = [3]
+    metrics.Gauge("depth", "Depth.", registry=registry, function=lambda: depth[0])
+    depth[0] = 7
+
+    lines = registry.render().splitlines()
+
+    assert 'events_total{kind="say \\"hi\\"\\n"} 3' in lines
+    assert "# TYPE depth gauge" in lines
+    assert "depth 7" in lines
+
+
+def test_middleware_records_routes_and_queries(registry):
+    """Test per-route latency, status, in-flight and query metrics of requests."""
+    engine = create_async_engine("sqlite+aiosqlite://", poolclass=StaticPool)
+    instrument_engine(engine.sync_engine)
+    app = FastAPI()
+
+    @app.get("/items/{item_id}")
+    async def get_item(item_id: int):
+        async with engine.connect() as connection:
+            await connection.execute(text("SELECT 1"))
+            await connection.execute(text("SELECT 2"))
+        return {"in_flight": metrics.HTTP_REQUESTS_IN_FLIGHT.values[("GET", "/items/{item_id}")]}
+
+    app.add_middleware(metrics.PrometheusMiddleware, routes=app.routes)
+    client = TestClient(app)
+
+    assert client.get("/items/1").json() == {"in_flight": 1}
+    assert client.get("/items/2").status_code == 200
+    assert client.get("/missing").status_code == 404
+
+    lines = registry.render().splitlines()
+    assert 'http_requests_total{method="GET",route="/items/{item_id}",status="200"} 2' in lines
+    assert 'http_requests_total{method="GET",route="unmatched",status="404"} 1' in lines
+    assert 'http_request_duration_seconds_count{method="GET",route="/items/{item_id}"} 2' in lines
+    assert 'http_requests_in_flight{method="GET",route="/items/{item_id}"} 0' in lines
+    assert 'db_queries_per_request_sum{route="/items/{item_id}"} 4' in lines
+    assert 'db_queries_per_request_sum{route="unmatched"} 0' in lines
+    assert "db_query_duration_seconds_count 4" in lines
+
+
+@pytest.mark.anyio
+async def test_failed_statement_does_not_skew_durations(registry):
+    """Test that a failing statement leaves nothing behind for the timing of the next one on the connection."""
+    engine = create_async_engine("sqlite+aiosqlite://", poolclass=StaticPool)
+    instrument_engine(engine.sync_engine)
+
+    async with engine.connect() as connection:
+        with patch("app.database.time.perf_counter", side_effect=itertools.count(step=10)):
+            with pytest.raises(OperationalError):
+                await connection.execute(text("SELECT * FROM missing"))
+            await connection.execute(text("SELECT 1"))
+        info = dict(connection.sync_connection.info)
+    await engine.dispose()
+
+    lines = registry.render().splitlines()
+    assert "db_query_duration_seconds_count 1" in lines
+    assert "db_query_duration_seconds_sum 10" in lines
+    assert "query_started" not in info
@@ -0,0 +1,117 @@
+import pytest
+from datetime import datetime, timedelta
+from sqlalchemy import create_engine
+from app import models, schemas, crud
+
+pytestmark = pytest.mark.anyio
+
+START = datetime(2024, 8, 1)
+
+
+@pytest.fixture
+async def db(db):
+    """The fresh in-memory database, holding ten accounts, every other one active."""
+    for index in range(10):
+        db.add(models.Account(
+            name=f"{'alice' if index < 5 else 'bob'}{index}",
+            email=f"user{index}@example.com",
+            password="password",
+            hashed_password="hashedpassword",
+            is_active=index % 2 == 0,
+            created_date=START + timedelta(days=index),
+            last_login_date=START + timedelta(days=20 - index) if index != 9 else None,
+        ))
+    await db.commit()
+    return db
+
+
+@pytest.fixture(scope="module")
+def sync_engine():
+    """Create an empty schema to run EXPLAIN QUERY PLAN against."""
+    engine = create_engine("sqlite://")
+    models.Base.metadata.create_all(bind=engine)
+    return engine
+
+
+def query_plan(engine, query):
+    with engine.connect() as connection:
+        compiled = query.compile(connection)
+        params = tuple(compiled.params[name] for name in compiled.positiontup)
+        rows = connection.exec_driver_sql("EXPLAIN QUERY PLAN " + str(compiled), params).all()
+    return " | ".join(row[-1] for row in rows)
+
+
+async def search_all(db, search, limit):
+    """Page through a search and return the names in the order they were served."""
+    names = []
+    cursor = None
+    while True:
+        accounts = await crud.search_accounts(db, search, limit=limit, after=cursor)
+        names.extend(account.name for account in accounts)
+        if len(accounts) < limit:
+            return names
+        cursor = crud.decode_search_cursor(crud.encode_search_cursor(accounts[-1], search.sort), search.sort)
+
+
+async def test_search_filters(db):
+    """Test every filter narrows the result."""
+    search = schemas.AccountSearch(
+        is_active=True,
+        name_prefix="alice",
+        created_from=START + timedelta(days=1),
+        created_to=START + timedelta(days=4),
+    )
+    assert await search_all(db, search, limit=10) == ["alice2"]
+
+    search = schemas.AccountSearch(last_login_from=START + timedelta(days=15), last_login_to=START + timedelta(days=17))
+    assert await search_all(db, search, limit=10) == ["alice4", "bob5"]
+
+
+async def test_search_pages_in_sort_order(db):
+    """Test keyset pages follow the sort column and order."""
+    search = schemas.AccountSearch(sort="last_login_date", order="desc")
+    assert await search_all(db, search, limit=3) == [
+        "alice0", "alice1", "alice2", "alice3", "alice4", "bob5", "bob6", "bob7", "bob8"
+    ]
+
+    search = schemas.AccountSearch(is_active=False, sort="created_date")
+    assert await search_all(db, search, limit=2) == ["alice1", "alice3", "bob5", "bob7", "bob9"]
+
+    search = schemas.AccountSearch(name_prefix="bob", order="desc")
+    assert await search_all(db, search, limit=2) == ["bob9", "bob8", "bob7", "bob6", "bob5"]
+
+
+def test_decode_malformed_cursor():
+    """Test a cursor that was not issued by the API is refused."""
+    with pytest.raises(ValueError):
+        crud.decode_search_cursor("not-a-cursor", "id")
+    with pytest.raises(ValueError):
+        crud.decode_search_cursor(crud.encode_search_cursor(models.Account(id=1, name="x"), "name"), "created_date")
+
+
+@pytest.mark.parametrize("search, index", [
+    (schemas.AccountSearch(is_active=True, sort="created_date"), "ix_accounts_is_active_created_date"),
+    (schemas.AccountSearch(is_active=True, created_from=START, sort="created_date", order="desc"),
+     "ix_accounts_is_active_created_date"),
+    (schemas.AccountSearch(is_active=False, sort="last_login_date", order="desc"),
+     "ix_accounts_is_active_last_login_date"),
+    (schemas.AccountSearch(is_active=True, name_prefix="ali", sort="name"), "ix_accounts_is_active_name"),
+    (schemas.AccountSearch(sort="created_date"), "ix_accounts_created_date"),
+    (schemas.AccountSearch(last_login_from=START, sort="last_login_date"), "ix_accounts_last_login_date"),
+    (schemas.AccountSearch(name_prefix="ali", sort="name"), "ix_accounts_name"),
+])
+def test_search_uses_index(sync_engine, search, index):
+    """Test each access pattern is served by its index without a sort step."""
+    plan = query_plan(sync_engine, crud.search_accounts_query(search, limit=100, after=None))
+
+    assert f"INDEX {index} " in plan
+    assert "TEMP B-TREE" not in plan
+
+
+def test_search_page_uses_index(sync_engine):
+    """Test a follow-up page still walks the index."""
+    search = schemas.AccountSearch(is_active=True, sort="created_date")
+    plan = query_plan(sync_engine, crud.search_accounts_query(search, limit=100, after=(START, 10)))
+
+    assert "INDEX ix_accounts_is_active_created_date " in plan
+    assert "TEMP B-TREE" not in plan
@@ -0,0 +1,140 @@
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+
+import httpx
+import pytest
+from sqlalchemy import create_engine
+from unittest.mock import patch
+
+from app import models, serve
+
+
+def free_port() -> int:
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+@pytest.fixture
+def server(tmp_path):
+    """Run the supervisor with two quickly recycled workers against a SQLite file."""
+    db_url = f"sqlite:///{tmp_path}/serve.db"
+    engine = create_engine(db_url)
+    models.Base.metadata.create_all(bind=engine)
+    engine.dispose()
+    port, metrics_port = free_port(), free_port()
+
+    process = subprocess.Popen(
+        [sys.executable, "-m", "app.serve", "--port", str(port), "--workers", "2", "--max-requests", "3",
+         "--health-interval", "0.5", "--graceful-timeout", "5", "--log-level", "warning",
+         "--metrics-port", str(metrics_port), "--allow-per-process-state"],
+        env={**os.environ, "DB_URL": db_url},
+    )
+    try:
+        yield process, f"http://127.0.0.1:{port}", f"http://127.0.0.1:{metrics_port}"
+    finally:
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+
+
+def wait_for(url: str, timeout: float = 30) -> httpx.Response:
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            return httpx.get(url, timeout=2)
+        except httpx.TransportError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.1)
+
+
+def test_supervisor_recycles_restarts_and_stops(server):
+    """Test workers are recycled after max requests, restarted on SIGHUP and stopped on SIGTERM."""
+    process, base_url, metrics_url = server
+    assert wait_for(f"{base_url}/readyz").json() == {"status": "ready"}
+    # Workers are only scraped once the supervisor has seen them ready
+    deadline = time.monotonic() + 10
+    while True:
+        requests = [line for line in wait_for(f"{metrics_url}/metrics").text.splitlines()
+                    if line.startswith("http_requests_total{")]
+        if requests or time.monotonic() > deadline:
+            break
+        time.sleep(0.1)
+    assert requests and all(line.startswith('http_requests_total{pid="') for line in requests)
+
+    pids = {wait_for(f"{base_url}/healthz").json()["pid"] for _ in range(12)}
+    # Two workers answer at most 3 requests each (give or take the health probes) before being replaced
+    assert len(pids) >= 3
+
+    process.send_signal(signal.SIGHUP)
+    time.sleep(1)
+    responses = [wait_for(f"{base_url}/healthz") for _ in range(6)]
+    assert all(response.status_code == 200 for response in responses)
+
+    process.send_signal(signal.SIGTERM)
+    assert process.wait(timeout=30) == 0
+
+
+def test_parse_args():
+    """Test the defaults and overrides of the command line options."""
+    args = serve.parse_args(["--workers", "3", "--max-requests", "1000", "--max-requests-jitter", "100"])
+
+    assert (args.host, args.port) == ("127.0.0.1", 8000)
+    assert (args.workers, args.max_requests, args.max_requests_jitter) == (3, 1000, 100)
+
+
+def test_merge_metrics():
+    """Test that the pages of several workers keep one HELP and TYPE per family and label samples by pid."""
+    page = "# HELP hits_total Hits.\n# TYPE hits_total counter\nhits_total{route=\"/a b\"} {count}\nup {count}\n"
+    merged = serve.merge_metrics({11: page.replace("{count}", "1"), 12: page.replace("{count}", "2")})
+
+    assert merged.splitlines() == [
+        "# HELP hits_total Hits.",
+        "# TYPE hits_total counter",
+        'hits_total{pid="11",route="/a b"} 1',
+        'up{pid="11"} 1',
+        'hits_total{pid="12",route="/a b"} 2',
+        'up{pid="12"} 2',
+    ]
+
+
+def test_pin_bcrypt_rounds():
+    """Test that the supervisor calibrates once and hands the cost to its workers, unless it is pinned."""
+    with patch.dict(os.environ), patch("app.auth.BCRYPT_CALIBRATE_ON_STARTUP", True), \
+            patch("app.auth.BCRYPT_ROUNDS", None), \
+            patch("app.auth.calibrate_bcrypt_rounds", return_value=11) as calibrate:
+        serve.pin_bcrypt_rounds()
+        assert os.environ["BCRYPT_ROUNDS"] == "11"
+
+        with patch("app.auth.BCRYPT_ROUNDS", "12"):
+            serve.pin_bcrypt_rounds()
+        assert calibrate.call_count == 1
+
+
+def test_per_process_state():
+    """Test that the in-process backends are reported, and shared ones are not."""
+    with patch("app.throttle.LOGIN_THROTTLE_BACKEND", "memory"), patch("app.cache.ACCOUNT_CACHE_BACKEND", "none"), \
+            patch("app.auth.TOKEN_REVOCATION_BACKEND", "redis"):
+        problems = serve.per_process_state()
+
+    assert [problem.split(":")[0] for problem in problems] == ["LOGIN_THROTTLE_BACKEND=memory"]
+
+
+def test_refuses_several_workers_with_per_process_state():
+    """Test that several workers only start with shared backends, a single worker or an explicit opt-in."""
+    with patch("app.throttle.LOGIN_THROTTLE_BACKEND", "redis"), patch("app.cache.ACCOUNT_CACHE_BACKEND", "none"), \
+            patch("app.auth.TOKEN_REVOCATION_BACKEND", "memory"):
+        with pytest.raises(serve.PerProcessState, match="TOKEN_REVOCATION_BACKEND=memory"):
+            serve.Supervisor("127.0.0.1", 0, workers=2).run()
+
+        serve.Supervisor("127.0.0.1", 0, workers=1).check_shared_state()
+        serve.Supervisor("127.0.0.1", 0, workers=2, allow_per_process_state=True).check_shared_state()
+
+    with patch("app.throttle.LOGIN_THROTTLE_BACKEND", "redis"), patch("app.cache.ACCOUNT_CACHE_BACKEND", "redis"), \
+            patch("app.auth.TOKEN_REVOCATION_BACKEND", "redis"):
+        serve.Supervisor("127.0.0.1", 0, workers=2).check_shared_state()
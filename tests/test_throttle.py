@@ -0,0 +1,137 @@
+import asyncio
+
+import pytest
+from unittest.mock import patch
+from app import throttle
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture(params=["memory", "redis"])
+async def store(request, redis_stub):
+    """Yield each throttle store in turn."""
+    if request.param == "memory":
+        yield throttle.MemoryThrottleStore(maxsize=10)
+    else:
+        store = throttle.RedisThrottleStore.from_url(redis_stub.url)
+        yield store
+        await store.client.aclose()
+
+
+async def counts(store, key: str, window_index: int) -> tuple:
+    """(current, previous) window counts of ``key`` as held by ``store``."""
+    if isinstance(store, throttle.MemoryThrottleStore):
+        if key not in store._windows:
+            return 0, 0
+        _, current, previous = store._roll(key, window_index)
+        return current, previous
+    current = await store.client.get(store._key(key, window_index))
+    previous = await store.client.get(store._key(key, window_index - 1))
+    return int(current or 0), int(previous or 0)
+
+
+@pytest.fixture
+def clock():
+    """Freeze time at the start of a window, moved by assigning clock.now."""
+    class Clock:
+        now = 6000.0
+
+    with patch("app.throttle.time.time", side_effect=lambda: Clock.now):
+        yield Clock
+
+
+def test_sliding_window_retry_after():
+    """Test the wait until the sliding window estimate drops below the limit."""
+    assert throttle.sliding_window_retry_after(2, 0, limit=3, window=60, elapsed=10) == 0
+    # 3 failures in this window: wait for it to end
+    assert throttle.sliding_window_retry_after(3, 0, limit=3, window=60, elapsed=10) == 50
+    # 6 failures: wait for half of this window to slide out of the next one
+    assert throttle.sliding_window_retry_after(6, 0, limit=3, window=60, elapsed=10) == 80
+    # 4 failures in the previous window, one in this: wait until under 2 of them still count
+    assert throttle.sliding_window_retry_after(1, 4, limit=3, window=60, elapsed=15) == 15
+    assert throttle.sliding_window_retry_after(1, 4, limit=3, window=60, elapsed=31) == 0
+
+
+async def test_email_limit(store, clock):
+    """Test that an email is throttled after its failures, independently of other emails."""
+    login_throttle = throttle.LoginThrottle(store, email_limit=3, ip_limit=100, window=60)
+    for _ in range(3):
+        assert (await login_throttle.reserve("User@example.com", "10.0.0.1"))[0] == 0
+
+    assert (await login_throttle.reserve("user@example.com", "10.0.0.2"))[0] == 60
+    assert (await login_throttle.reserve("other@example.com", "10.0.0.1"))[0] == 0
+
+    # Half way into the next window half of the failures still count
+    clock.now += 60 + 30
+    assert (await login_throttle.reserve("user@example.com", "10.0.0.1"))[0] == 0
+    assert (await login_throttle.reserve("user@example.com", "10.0.0.1"))[0] == 0
+    assert (await login_throttle.reserve("user@example.com", "10.0.0.1"))[0] == 10
+
+
+async def test_concurrent_attempts_counted_before_verifying(store, clock):
+    """Test that a burst of attempts cannot all pass before the first ones fail, and that rejections are free."""
+    login_throttle = throttle.LoginThrottle(store, email_limit=3, ip_limit=100, window=60)
+
+    results = await asyncio.gather(*(login_throttle.reserve("user@example.com", "10.0.0.1") for _ in range(10)))
+
+    assert sum(retry_after == 0 for retry_after, _ in results) == 3
+    assert min(retry_after for retry_after, _ in results if retry_after) >= 60
+    assert await counts(store, "email:user@example.com", 100) == (3, 0)
+    assert await counts(store, "ip:10.0.0.1", 100) == (3, 0)
+
+
+async def test_refund_on_success(store, clock):
+    """Test that successful logins are refunded, even after the window rolled over."""
+    login_throttle = throttle.LoginThrottle(store, email_limit=2, ip_limit=100, window=60)
+    for _ in range(5):
+        retry_after, window_index = await login_throttle.reserve("user@example.com", "10.0.0.1")
+        assert retry_after == 0
+        await login_throttle.refund("user@example.com", "10.0.0.1", window_index)
+
+    _, window_index = await login_throttle.reserve("user@example.com", "10.0.0.1")
+    clock.now += 60
+    await login_throttle.refund("user@example.com", "10.0.0.1", window_index)
+    assert await counts(store, "email:user@example.com", 101) == (0, 0)
+
+
+async def test_ip_limit(store, clock):
+    """Test that a client IP is throttled after failures spread over many emails."""
+    login_throttle = throttle.LoginThrottle(store, email_limit=3, ip_limit=5, window=60)
+    for index in range(5):
+        await login_throttle.reserve(f"user{index}@example.com", "10.0.0.1")
+
+    assert (await login_throttle.reserve("new@example.com", "10.0.0.1"))[0] == 60
+    assert (await login_throttle.reserve("new@example.com", "10.0.0.2"))[0] == 0
+
+
+async def test_disabled_limit(store, clock):
+    """Test that a limit of 0 never throttles."""
+    login_throttle = throttle.LoginThrottle(store, email_limit=0, ip_limit=0, window=60)
+    for _ in range(10):
+        assert await login_throttle.reserve("user@example.com", "10.0.0.1") == (0, 100)
+
+    assert (await login_throttle.reserve("user@example.com", "10.0.0.1"))[0] == 0
+
+
+async def test_memory_store_is_bounded(clock):
+    """Test that the memory store keeps only the most recently used keys."""
+    store = throttle.MemoryThrottleStore(maxsize=2)
+    await store.incr("a", 100, ttl=120)
+    await store.incr("b", 100, ttl=120)
+    await store.incr("c", 100, ttl=120)
+
+    assert await counts(store, "a", 100) == (0, 0)
+    assert await counts(store, "c", 100) == (1, 0)
+    assert await counts(store, "c", 101) == (0, 1)
+    assert await counts(store, "c", 102) == (0, 0)
+
+
+async def test_redis_store_unavailable(redis_stub, clock):
+    """Test that an unreachable Redis store lets attempts through."""
+    store = throttle.RedisThrottleStore.from_url(redis_stub.url)
+    await redis_stub.stop()
+    login_throttle = throttle.LoginThrottle(store, email_limit=1, ip_limit=1, window=60)
+
+    assert (await login_throttle.reserve("user@example.com", "10.0.0.1"))[0] == 0
+    assert (await login_throttle.reserve("user@example.com", "10.0.0.1"))[0] == 0
+    await store.client.aclose()